@@ -0,0 +1,108 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from rag_app.app.core.errors import TurnRejectedError
+from rag_app.app.core.metrics import QUEUED_TURNS, REJECTED_TURNS, observe
+
+
+class AdmissionController:
+    """
+    Caps how many chat turns run at once, so a burst of users doesn't fan straight out to the
+    embeddings server, Chroma and the LLM provider.
+
+    Up to `max_running` turns run at a time. The next `max_queued` wait for a free slot, at most
+    `max_queued_per_user` of them from any one user, and anything past that is rejected straight
+    away with TurnRejectedError. Waiting turns are admitted round robin across users, oldest
+    first within each user, so one busy user can't starve the others.
+
+    Like TurnTracker, the limits are per process: with several workers each one admits its own
+    `max_running` turns.
+    """
+
+    def __init__(
+            self,
+            max_running: int = 8,
+            max_queued: int = 32,
+            max_queued_per_user: int = 4,
+            retry_after: int = 5,
+            ):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.retry_after = retry_after
+
+        self._running = 0
+        self._queued = 0
+        # each user's waiting turns, oldest first. the next user to be served is always first.
+        self._waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self, user: str):
+        """
+        holds a slot for the duration of the block, waiting for one if they are all taken
+        """
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user: str):
+        # a free slot only goes straight to a newcomer if nobody is waiting for it
+        if self._running < self.max_running and not self._queued:
+            self._running += 1
+            return
+
+        waiting = self._waiting.get(user)
+        if self._queued >= self.max_queued or (waiting and len(waiting) >= self.max_queued_per_user):
+            self.rejected += 1
+            REJECTED_TURNS.inc()
+            raise TurnRejectedError("Too many turns in progress, try again shortly.", retry_after=self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(future)
+        self._queued += 1
+        QUEUED_TURNS.inc()
+        try:
+            with observe("admission_wait"):
+                await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as the waiter went away, so pass it on
+                self.release()
+            else:
+                self._forget(user, future)
+            raise
+
+    def release(self):
+        """
+        frees a slot, handing it straight to the next waiting turn if there is one
+        """
+        while self._waiting:
+            user, waiting = next(iter(self._waiting.items()))
+            future = waiting.popleft()
+            self._queued -= 1
+            QUEUED_TURNS.dec()
+            if waiting:
+                # the user goes to the back of the line for their next turn
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def _forget(self, user: str, future: asyncio.Future):
+        waiting = self._waiting.get(user)
+        if waiting is None or future not in waiting:
+            return
+        waiting.remove(future)
+        self._queued -= 1
+        QUEUED_TURNS.dec()
+        if not waiting:
+            del self._waiting[user]
+
+    def stats(self) -> dict[str, int]:
+        return {"running": self._running, "queued": self._queued, "rejected": self.rejected}
@@ -0,0 +1,245 @@
+import asyncio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from rag_app.app.core.config import Configurations
+from rag_app.app.core.errors import UserNotFoundError, ChatNotFoundError
+from rag_app.app.models import ChatOut, PromptRequest, BatchRequest, BatchResult, MessageDocuments, SearchHit, SearchResults
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.container import Services
+from rag_app.app.services.session import Session
+from rag_app.app.services.transfer import export_lines
+from rag_app.api.deps import get_configs, get_services, get_turn_tracker, get_admission, TurnTracker, AdmissionController
+from rag_app.api.turns import chat_key
+
+# JSON API for programmatic clients. there are no cookies here: every request names its user,
+# and gets a short-lived Session built on the shared services.
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+
+def open_session(
+        configs: Configurations, 
+        services: Services, 
+        user_name: str, 
+        chat_id: int | None = None, 
+        load_chat: bool = True,
+        ) -> Session:
+    """
+    builds a session for the user, with the chat loaded if chat_id is given.
+    raises a 404 if either doesn't exist or the chat belongs to someone else.
+    """
+    session = Session(configs=configs, services=services)
+    try:
+        session.load_user(user_name=user_name)
+    except UserNotFoundError:
+        raise HTTPException(status_code=404, detail=f"User {user_name} not found.")
+
+    if chat_id is not None:
+        chat = services.db.get_chat(chat_id=chat_id)
+        if chat is None or chat[1] != session.user.id:
+            raise HTTPException(status_code=404, detail=f"Chat {chat_id} not found.")
+        if not load_chat:
+            return session
+        try:
+            session.load_chat(chat_id=chat_id)
+        except ChatNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Chat {chat_id} not found.")
+    return session
+
+def chat_out(services: Services, chat_id: int) -> ChatOut:
+    chat_id, _, slug, created_at, updated_at = services.db.get_chat(chat_id=chat_id)
+    return ChatOut(id=chat_id, slug=slug, created_at=created_at, updated_at=updated_at)
+
+@router.get("/users/{user_name}/chats", response_model=list[ChatOut])
+def list_chats(
+    user_name: str,
+    limit: int = Query(default=20, ge=1, le=100),
+    before_updated_at: int | None = None,
+    before_id: int | None = None,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    lists the user's chats, most recently updated first. to get the next page, pass the
+    updated_at and id of the last chat as before_updated_at and before_id.
+    """
+    session = open_session(configs=configs, services=services, user_name=user_name)
+    before = (before_updated_at, before_id) if before_updated_at is not None and before_id is not None else None
+    return [
+        ChatOut(id=chat_id, slug=slug, updated_at=updated_at)
+        for chat_id, slug, updated_at in session.user.get_chats(limit=limit, before=before)
+        ]
+
+
+@router.get("/users/{user_name}/archived_chats", response_model=list[ChatOut])
+def list_archived_chats(
+    user_name: str,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    lists the user's chats that were archived for being idle, most recently updated first
+    """
+    session = open_session(configs=configs, services=services, user_name=user_name)
+    return [
+        ChatOut(id=chat_id, slug=slug, updated_at=updated_at)
+        for chat_id, slug, updated_at in services.db.get_archived_chats(user_id=session.user.id)
+        ]
+
+
+@router.post("/users/{user_name}/archived_chats/{chat_id}/restore", response_model=ChatOut)
+def restore_chat(
+    user_name: str,
+    chat_id: int,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    moves an archived chat back among the user's chats, under the same id
+    """
+    session = open_session(configs=configs, services=services, user_name=user_name)
+    if not services.db.restore_chat(chat_id=chat_id, user_id=session.user.id):
+        raise HTTPException(status_code=404, detail=f"Archived chat {chat_id} not found.")
+    return chat_out(services=services, chat_id=chat_id)
+
+
+@router.get("/users/{user_name}/export")
+def export_chats(
+    user_name: str,
+    since: int | None = Query(default=None, description="only messages created at or after this unix time"),
+    until: int | None = Query(default=None, description="only messages created before this unix time"),
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    streams the user's chats as JSON Lines, one message per line, as they are read from the
+    database. `rag-app-db import` loads the file into another database.
+    """
+    open_session(configs=configs, services=services, user_name=user_name)
+    return StreamingResponse(
+        export_lines(db=services.db, user_name=user_name, since=since, until=until),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{user_name}.jsonl"'},
+    )
+
+
+@router.get("/users/{user_name}/search", response_model=SearchResults)
+def search_messages(
+    user_name: str,
+    q: str = Query(min_length=1, max_length=500),
+    limit: int = Query(default=20, ge=1, le=100),
+    after_rank: float | None = None,
+    after_id: int | None = None,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    searches everything the user and the assistant wrote in the user's chats, best match first.
+    to get the next page, pass next_after_rank and next_after_id as after_rank and after_id.
+    """
+    session = open_session(configs=configs, services=services, user_name=user_name)
+    after = (after_rank, after_id) if after_rank is not None and after_id is not None else None
+    # one extra row tells whether there is another page
+    rows = services.db.search_messages(user_id=session.user.id, text=q, limit=limit + 1, after=after)
+    hits = [
+        SearchHit(message_id=message_id, chat_id=chat_id, slug=slug, role=role, snippet=snippet, rank=rank)
+        for message_id, chat_id, slug, role, snippet, rank in rows[:limit]
+        ]
+    if len(rows) > limit:
+        return SearchResults(hits=hits, next_after_rank=hits[-1].rank, next_after_id=hits[-1].message_id)
+    return SearchResults(hits=hits)
+
+
+@router.post("/users/{user_name}/chats", response_model=ChatOut, status_code=201)
+def create_chat(
+    user_name: str,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    session = open_session(configs=configs, services=services, user_name=user_name)
+    chat = Chat(user=session.user, db=services.db, configs=configs)
+    chat.create()
+    return chat_out(services=services, chat_id=chat.id)
+
+
+@router.get("/users/{user_name}/chats/{chat_id}/messages", response_model=list[MessageDocuments])
+def get_messages(
+    user_name: str,
+    chat_id: int,
+    limit: int = Query(default=60, ge=1, le=500),
+    before_id: int | None = None,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+):
+    """
+    returns the latest `limit` messages of the chat, oldest first. to page further back,
+    pass the id of the first message returned as before_id.
+    """
+    open_session(configs=configs, services=services, user_name=user_name, chat_id=chat_id, load_chat=False)
+    rows = services.db.get_messages(chat_id=chat_id, limit=limit, before_id=before_id) or []
+    # the system prompt is the same for every chat, so it isn't returned
+    return [msg_docs for msg_docs in Chat.blobs_to_msg_docs(rows, db=services.db) if msg_docs.message.role != "system"]
+
+
+@router.post("/users/{user_name}/chats/{chat_id}/messages", response_model=MessageDocuments)
+async def send_prompt(
+    user_name: str,
+    chat_id: int,
+    body: PromptRequest,
+    idempotency_key: str | None = Header(default=None),
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+    turns: TurnTracker = Depends(get_turn_tracker),
+    admission: AdmissionController = Depends(get_admission),
+):
+    """
+    answers the prompt in the chat. a retry sent with the same Idempotency-Key header while the
+    first request is still running gets that request's answer instead of a second one. when the
+    server is at capacity this fails with a 429 and a Retry-After header.
+    """
+    async def turn():
+        # loaded inside the turn, so it sees the messages of any turn that ran before it
+        session = await run_in_threadpool(
+            open_session, configs=configs, services=services, user_name=user_name, chat_id=chat_id,
+            )
+        async with admission.admit(user_name):
+            return await session.aprocess_prompt(prompt=body.prompt, tool_names=body.tool_names)
+
+    return await turns.run(key=chat_key(chat_id), turn=turn, idempotency_key=idempotency_key)
+
+
+@router.post("/users/{user_name}/batch", response_model=list[BatchResult])
+async def send_batch(
+    user_name: str,
+    body: BatchRequest,
+    configs: Configurations = Depends(get_configs),
+    services: Services = Depends(get_services),
+    admission: AdmissionController = Depends(get_admission),
+):
+    """
+    answers each prompt in a new chat of its own, running up to `batch_concurrency` of them at
+    a time. results come back in the order of the prompts; a prompt that fails gets an error
+    instead of a response, without failing the rest of the batch. the prompts queue for the
+    server's turn slots like any other turn, so a big batch doesn't starve other users.
+    """
+    if len(body.prompts) > configs.batch_max_prompts:
+        raise HTTPException(status_code=413, detail=f"A batch can have at most {configs.batch_max_prompts} prompts.")
+    # fails the whole batch early if the user doesn't exist
+    await run_in_threadpool(open_session, configs=configs, services=services, user_name=user_name)
+
+    semaphore = asyncio.Semaphore(configs.batch_concurrency)
+
+    async def answer(prompt: str) -> BatchResult:
+        async with semaphore:
+            session = None
+            try:
+                session = await run_in_threadpool(open_session, configs=configs, services=services, user_name=user_name)
+                async with admission.admit(user_name):
+                    msg_docs = await session.aprocess_prompt(prompt=prompt, tool_names=body.tool_names)
+                return BatchResult(prompt=prompt, chat_id=session.chat.id, response=msg_docs)
+            except Exception as e:
+                configs.logger.error(f"Batch prompt failed: {e}")
+                chat_id = session.chat.id if session and session.chat else None
+                return BatchResult(prompt=prompt, chat_id=chat_id, error=str(e))
+
+    return await asyncio.gather(*(answer(prompt) for prompt in body.prompts))
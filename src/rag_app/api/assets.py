@@ -0,0 +1,196 @@
+import argparse, gzip, hashlib, json, mimetypes, os, shutil
+from pathlib import Path, PurePosixPath
+import requests
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from rag_app.app.core.errors import VendoredFileError
+
+try:
+    import brotli
+except ImportError:   # optional: without it the build only writes .gz files
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+DIST = "dist"
+MANIFEST = "manifest.json"
+
+# fingerprinted files never change under the same name, so browsers can keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+# anything else is served under a fixed name, so browsers have to check it's still current
+REVALIDATE = "no-cache"
+
+# third-party scripts the pages use, committed in static/vendor and pinned to a version and the
+# sha256 of its content. fetch_vendored() only restores a missing file from its pinned URL.
+VENDORED = {
+    "vendor/htmx.min.js": (
+        "https://unpkg.com/htmx.org@1.9.10/dist/htmx.min.js",
+        "b3bdcf5c741897a53648b1207fff0469a0d61901429ba1f6e88f98ebd84e669e",
+    ),
+    "vendor/sse.js": (
+        "https://unpkg.com/htmx.org@1.9.10/dist/ext/sse.js",
+        "9814c1d005fd2674e3ee15ba887357968f9b9255331380f01b19b613a5856538",
+    ),
+}
+
+COMPRESSIBLE = {".css", ".js", ".json", ".svg", ".txt", ".html"}
+MIN_COMPRESS_SIZE = 256
+ENCODINGS = {"br": ".br", "gzip": ".gz"}   # in order of preference
+
+
+def fetch_vendored(static_dir: Path = STATIC_DIR) -> list[str]:
+    """
+    downloads the vendored scripts that aren't in static_dir yet, returns their names.
+    raises VendoredFileError, without writing anything, for a download that doesn't match its pin.
+    """
+    fetched = []
+    for name, (url, sha256) in VENDORED.items():
+        path = static_dir / name
+        if path.exists():
+            continue
+        response = requests.get(url, timeout=20)
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest != sha256:
+            raise VendoredFileError(f"{url} has sha256 {digest}, not the pinned {sha256}.")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(response.content)
+        fetched.append(name)
+    return fetched
+
+
+def check_vendored(static_dir: Path = STATIC_DIR):
+    """
+    raises VendoredFileError if a vendored script is missing from static_dir or differs from its pin
+    """
+    for name, (_, sha256) in VENDORED.items():
+        path = static_dir / name
+        if not path.exists():
+            raise VendoredFileError(f"{path} is missing.")
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        if digest != sha256:
+            raise VendoredFileError(f"{path} has sha256 {digest}, not the pinned {sha256}.")
+
+
+def build_static(static_dir: Path = STATIC_DIR) -> dict[str, str]:
+    """
+    copies every static file to static/dist under a name with a hash of its content in it, next to
+    gzip and brotli versions of the ones worth compressing, and writes the manifest that maps each
+    file to its copy. dist is rebuilt from scratch every time.
+    """
+    dist = static_dir / DIST
+    shutil.rmtree(dist, ignore_errors=True)
+
+    manifest = {}
+    for path in sorted(static_dir.rglob("*")):
+        relative = path.relative_to(static_dir)
+        if not path.is_file() or relative.parts[0] == DIST or path.name.startswith("."):
+            continue
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        name = PurePosixPath(relative.as_posix())
+        hashed = PurePosixPath(DIST) / name.with_name(f"{path.name.removesuffix(path.suffix)}.{digest}{path.suffix}")
+
+        target = static_dir / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        if path.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            # mtime=0 so the same file always builds the same .gz
+            Path(f"{target}.gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                Path(f"{target}.br").write_bytes(brotli.compress(data, quality=11))
+        manifest[str(name)] = str(hashed)
+
+    (dist / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
+
+
+class StaticAssets:
+    """
+    Resolves static file names to the fingerprinted copies listed in the build manifest.
+    Without a build, files are served under their own names.
+    """
+
+    def __init__(self, static_dir: Path = STATIC_DIR):
+        self.static_dir = static_dir
+        path = static_dir / DIST / MANIFEST
+        self.manifest: dict[str, str] = json.loads(path.read_text()) if path.exists() else {}
+        # part of the pages' ETags, since the pages link to the fingerprinted names
+        self.version = hashlib.sha256(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:12]
+
+    def url(self, request: Request, name: str) -> str:
+        if name in self.manifest:
+            return str(request.url_for("static", path=self.manifest[name]))
+        return str(request.url_for("static", path=name))
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves the .br or .gz copy of a file when the client accepts it, and marks
+    the fingerprinted files in dist as immutable
+    """
+
+    def file_response(
+            self,
+            full_path: os.PathLike,
+            stat_result: os.stat_result,
+            scope,
+            status_code: int = 200,
+            ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        encoding, compressed = self._compressed(full_path, request_headers.get("accept-encoding", ""))
+
+        if encoding is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+        else:
+            media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+            response = FileResponse(
+                compressed,
+                status_code=status_code,
+                stat_result=os.stat(compressed),
+                media_type=media_type,
+                headers={"Content-Encoding": encoding},
+                )
+            if self.is_not_modified(response.headers, request_headers):
+                response = NotModifiedResponse(response.headers)
+
+        if any(os.path.exists(full_path + suffix) for suffix in ENCODINGS.values()):
+            response.headers["Vary"] = "Accept-Encoding"
+        static_root = os.path.realpath(self.directory) if self.directory else ""
+        in_dist = os.path.realpath(full_path).startswith(os.path.join(static_root, DIST) + os.sep)
+        response.headers["Cache-Control"] = IMMUTABLE if in_dist else REVALIDATE
+        return response
+
+    def _compressed(self, full_path: str, accept_encoding: str) -> tuple[str | None, str | None]:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.partition(";")
+            # "gzip;q=0" means the client doesn't want it
+            try:
+                if params.strip().startswith("q=") and float(params.strip()[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding, suffix in ENCODINGS.items():
+            if encoding in accepted and os.path.exists(full_path + suffix):
+                return encoding, full_path + suffix
+        return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the static files.")
+    parser.add_argument("--no-fetch", action="store_true", help="don't download missing vendored scripts")
+    args = parser.parse_args()
+
+    try:
+        if not args.no_fetch:
+            for name in fetch_vendored():
+                print(f"Downloaded {name}")
+        check_vendored()
+    except (VendoredFileError, requests.RequestException) as e:
+        raise SystemExit(f"The vendored scripts aren't right: {e}")
+    manifest = build_static()
+    print(f"Built {len(manifest)} static files into {STATIC_DIR / DIST}" + ("" if brotli else " (no brotli installed, gzip only)"))
@@ -0,0 +1,60 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from fastapi import Request, Response
+
+# pages are per user and change with every message, so browsers may keep them but must check first
+CACHE_CONTROL = "private, no-cache"
+
+
+def templates_version(directory: Path) -> str:
+    """
+    hashes every template, so a deploy that changes how pages look also changes their ETags.
+    every worker computes the same value.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(directory.rglob("*.html")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: int | None = None) -> bool:
+    """
+    checks the request's validators against the current ones. If-None-Match wins when both
+    are sent, as RFC 9110 asks.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        # weak comparison: W/"x" and "x" are the same tag
+        return "*" in tags or _strip_weak(etag) in {_strip_weak(tag) for tag in tags}
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def not_modified(etag: str, last_modified: int | None = None) -> Response:
+    return add_validators(Response(status_code=304), etag=etag, last_modified=last_modified)
+
+
+def add_validators(response: Response, etag: str, last_modified: int | None = None) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return response
+
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
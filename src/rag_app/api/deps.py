@@ -1,11 +1,27 @@
-from functools import lru_cache
 from fastapi import Request
+from rag_app.app.core.config import Configurations
 from rag_app.app.services.session import Session
+from rag_app.app.services.container import Services
 from rag_app.api.session_manager import SessionManager
+from rag_app.api.turns import TurnTracker
+from rag_app.api.admission import AdmissionController
 
-# build this out later into a robust session manager:
-#   - create, get, delete, exists, cleanup_expired
 
-@lru_cache
-def get_session_manager() -> SessionManager:
-    return SessionManager()
\ No newline at end of file
+def get_session_manager(request: Request) -> SessionManager:
+    return request.app.state.session_manager
+
+
+def get_configs(request: Request) -> Configurations:
+    return request.app.state.configs
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def get_turn_tracker(request: Request) -> TurnTracker:
+    return request.app.state.turn_tracker
+
+
+def get_admission(request: Request) -> AdmissionController:
+    return request.app.state.admission
@@ -1,47 +1,121 @@
 import markdown
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from rag_app.app.core.config import Configurations
-from rag_app.app.core.errors import ConfigurationsError
+from rag_app.app.core.errors import ConfigurationsError, TurnRejectedError
 from rag_app.app.core.logging_setup import get_logger
-from rag_app.api.deps import get_session_manager
+from rag_app.app.services.container import Services
+from rag_app.app.services.session import Session
+from rag_app.app.services.retention import MaintenanceThread
+from rag_app.api.session_manager import SessionManager
+from rag_app.api.session_store import SessionStore
+from rag_app.api.turns import TurnTracker
+from rag_app.api.admission import AdmissionController
+from rag_app.api.rendering import MessageRenderer, TimedTemplates
+from rag_app.api.conditional import templates_version
+from rag_app.api.assets import PrecompressedStaticFiles, StaticAssets, STATIC_DIR
 from rag_app.api.routes import router
+from rag_app.api import api_v1
 
 
-def create_app():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the reaper only runs while the app is serving requests
+    app.state.session_manager.start_reaper()
+    app.state.maintenance.start()
+    yield
+    app.state.maintenance.stop()
+    app.state.session_manager.stop_reaper()
+    await app.state.services.aclose()
+
+
+async def turn_rejected(request: Request, exc: TurnRejectedError):
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def create_app(configs: Configurations | None = None):
     BASE_DIR = Path(__file__).resolve().parent
 
-    templates = Jinja2Templates(directory=BASE_DIR / "templates")
+    templates = TimedTemplates(directory=BASE_DIR / "templates")
+    assets = StaticAssets(STATIC_DIR)
+    templates.env.globals["static_url"] = assets.url
     templates.env.filters["markdown"] = lambda text: markdown.markdown(
         text,
         extensions=["fenced_code", "tables"]
     )
 
-    # sets up the SessionManager object to be loaded into FastAPI as a dependency 
-    get_session_manager()
-
     logger = get_logger()
 
     # instantiates the configurations by fetching them from a YAML file
-    # and logging any problems
-    try:
-        configs = Configurations.load(logger=logger)
-    except ConfigurationsError as e:
-        logger.error(f"The configurations didn't load correctly: {e}")
+    # and logging any problems, unless they are passed in (the tests do this)
+    if configs is None:
+        try:
+            configs = Configurations.load(logger=logger)
+        except ConfigurationsError as e:
+            logger.error(f"The configurations didn't load correctly: {e}")
+
+    # the database, LLM and tool clients are built once here and shared by every session
+    services = Services.build(configs=configs)
 
+    turn_tracker = TurnTracker()
 
-    app = FastAPI(root_path=configs.root_path)
+    # sets up the SessionManager object to be loaded into FastAPI as a dependency.
+    # session state lives in SQLite so that any worker can rebuild any session.
+    session_manager = SessionManager(
+        ttl_seconds=configs.session_ttl_seconds,
+        max_sessions=configs.max_sessions,
+        reap_interval=configs.session_reap_interval_seconds,
+        store=SessionStore(configs=configs),
+        session_factory=lambda session_id: Session(configs=configs, services=services, session_id=session_id),
+        busy=turn_tracker.busy,
+        logger=configs.logger,
+    )
+
+    app = FastAPI(root_path=configs.root_path, lifespan=lifespan)
     app.mount(
             "/static",
-            StaticFiles(directory=BASE_DIR / "static"),
+            PrecompressedStaticFiles(directory=STATIC_DIR),
             name="static",
         )
-    
+    # compresses the pages and JSON; the static files are compressed ahead of time and SSE
+    # streams are left alone, since they have to reach the browser as they are written
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+    app.add_exception_handler(TurnRejectedError, turn_rejected)
     app.include_router(router)
+    app.include_router(api_v1.router)
     app.state.templates = templates
+    # the pages link to the fingerprinted static files, so a rebuild changes their ETags too
+    app.state.templates_version = f"{templates_version(BASE_DIR / 'templates')}.{assets.version}"
     app.state.configs = configs
+    app.state.services = services
+    app.state.session_manager = session_manager
+    app.state.turn_tracker = turn_tracker
+    app.state.admission = AdmissionController(
+        max_running=configs.max_running_turns,
+        max_queued=configs.max_queued_turns,
+        max_queued_per_user=configs.max_queued_turns_per_user,
+        retry_after=configs.turn_retry_after_seconds,
+    )
+    # archives idle chats (when retention_idle_days is set) and reclaims free space
+    app.state.maintenance = MaintenanceThread(
+        db=services.db,
+        interval=configs.maintenance_interval_seconds,
+        idle_seconds=configs.retention_idle_days * 86400 if configs.retention_idle_days else None,
+        vacuum_step_pages=configs.vacuum_step_pages,
+        logger=configs.logger,
+    )
+    app.state.renderer = MessageRenderer(
+        templates=templates,
+        db=services.db,
+        max_entries=configs.render_cache_size,
+    )
 
     return app
-
@@ -1,11 +1,27 @@
+import argparse, os, tempfile
 import uvicorn
 from rag_app.api.factory import create_app
 
-def serve():
+def serve(workers: int | None = None):
+    """
+    starts the uvicorn server. every worker is a separate process with its own copy of the app;
+    they share sessions through the session store, so requests can land on any of them.
+    """
+    if workers is None:
+        parser = argparse.ArgumentParser(description="Serve the rag_app web interface.")
+        parser.add_argument("--workers", type=int, default=1, help="number of uvicorn worker processes")
+        workers = parser.parse_args().workers
+
+    # each worker keeps its own metrics, so /metrics can only add them up if they write them
+    # to a shared directory. the workers inherit the variable when they start.
+    if workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="rag_app_metrics_")
+
     uvicorn.run(
         "rag_app.api.main:app",
         host="0.0.0.0",
         port=8002,
+        workers=workers,
     )
     
 app = create_app()
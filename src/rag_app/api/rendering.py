@@ -0,0 +1,91 @@
+import hashlib, threading
+from collections import OrderedDict
+from pathlib import Path
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from rag_app.app.core.metrics import observe
+from rag_app.app.models import MessageDocuments
+from rag_app.app.services.db_manager import DatabaseManager
+
+
+class TimedTemplates(Jinja2Templates):
+    """
+    Jinja2Templates that observes how long each page or fragment takes to render
+    """
+
+    def TemplateResponse(self, *args, **kwargs):
+        with observe("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+class MessageRenderer:
+    """
+    Renders assistant messages, markdown and sources included, to HTML once and caches the result.
+
+    Messages never change after they are written, so the HTML is kept by message id in an
+    in-memory LRU of `max_entries` and stored alongside the message row in SQLite, where every
+    worker and every restart can reuse it. Cached HTML is tagged with a hash of the template, so
+    editing the template makes every message render again.
+    """
+
+    TEMPLATE = "assistant-message.html"
+
+    def __init__(self, templates: Jinja2Templates, db: DatabaseManager, max_entries: int = 2000):
+        self.template = templates.get_template(self.TEMPLATE)
+        self.db = db
+        self.max_entries = max_entries
+        self.version = hashlib.sha256(Path(self.template.filename).read_bytes()).hexdigest()[:16]
+        self._cache: OrderedDict[int, Markup] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, msg_docs: MessageDocuments) -> Markup:
+        return self.render_many([msg_docs])[0]
+
+    def render_many(self, messages: list[MessageDocuments]) -> list[Markup]:
+        """
+        returns the HTML of each message, in order. anything missing from memory is fetched from
+        SQLite in one query, and anything missing from both is rendered and saved in one transaction.
+        """
+        found: dict[int, Markup] = {}
+        with self._lock:
+            for msg_docs in messages:
+                if msg_docs.id in self._cache:
+                    self._cache.move_to_end(msg_docs.id)
+                    found[msg_docs.id] = self._cache[msg_docs.id]
+
+        missing = [msg_docs.id for msg_docs in messages if msg_docs.id is not None and msg_docs.id not in found]
+        if missing:
+            stored = self.db.get_rendered(message_ids=missing, version=self.version)
+            found.update((message_id, Markup(html)) for message_id, html in stored.items())
+
+        rendered: list[Markup] = []
+        new: dict[int, Markup] = {}
+        for msg_docs in messages:
+            html = found.get(msg_docs.id)
+            if html is None:
+                html = self._render(msg_docs)
+                # messages without an id, like error replies, were never stored and aren't cached
+                if msg_docs.id is not None:
+                    new[msg_docs.id] = html
+                    found[msg_docs.id] = html
+            rendered.append(html)
+
+        if new:
+            self.db.save_rendered(rendered=new, version=self.version)
+        self._remember(found)
+        return rendered
+
+    @observe("render_message")
+    def _render(self, msg_docs: MessageDocuments) -> Markup:
+        return Markup(self.template.render(
+            assistant_message=msg_docs.message,
+            documents=msg_docs.documents,
+            ))
+
+    def _remember(self, rendered: dict[int, Markup]):
+        with self._lock:
+            for message_id, html in rendered.items():
+                self._cache[message_id] = html
+                self._cache.move_to_end(message_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
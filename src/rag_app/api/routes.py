@@ -1,60 +1,104 @@
+import html
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 from dataclasses import dataclass
-from fastapi import APIRouter, Form, Request, Depends, Cookie
-from fastapi.responses import HTMLResponse, RedirectResponse
+from urllib.parse import urlencode
+from fastapi import APIRouter, Form, Request, Depends, Cookie, Header
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from rag_app.app.models import Message
+from rag_app.app.models import Message, MessageDocuments
 from rag_app.app.services.session import Session
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.container import Services
 from rag_app.app.core.config import Configurations
-from rag_app.app.core.errors import UserAlreadyExistsError
-from rag_app.api.deps import get_session_manager, SessionManager
+from rag_app.app.core.errors import UserAlreadyExistsError, TurnRejectedError
+from rag_app.api.rendering import MessageRenderer
+from rag_app.app.core.metrics import render_latest
+from rag_app.api.conditional import make_etag, is_not_modified, not_modified, add_validators
+from rag_app.api.deps import get_session_manager, get_turn_tracker, get_admission, SessionManager, TurnTracker, AdmissionController
+from rag_app.api.turns import chat_key
 
 # model and helper function for getting objects from app state
 @dataclass(frozen=True)
 class AppState:
     templates: Jinja2Templates
     configs: Configurations
+    services: Services
+    renderer: MessageRenderer
+    templates_version: str
 
 def get_state(request:Request) -> AppState:
     return AppState(
         templates=request.app.state.templates,
-        configs=request.app.state.configs
+        configs=request.app.state.configs,
+        services=request.app.state.services,
+        renderer=request.app.state.renderer,
+        templates_version=request.app.state.templates_version,
     )
 
 def get_root_path(request: Request) -> str:
     return request.scope.get("root_path", "")
 
+def chats_page(app: AppState, user_id: int, before: tuple[int, int] | None = None) -> dict:
+    """
+    one page of the sidebar's chat list, and whether there is another page after it. the first
+    page comes from the read model cache.
+    """
+    page_size = app.configs.chats_page_size
+    if before is None:
+        _, chats = app.services.db.read_models.chats(user_id=user_id)
+    else:
+        chats = app.services.db.get_chats(user_id=user_id, limit=page_size + 1, before=before)
+    return {"chats": chats[:page_size], "more_chats": len(chats) > page_size}
+
+def turn_owner(session: Session) -> str:
+    # who a turn is queued under for fair scheduling; the API uses the same user names
+    return session.user.name if session.user else session.id
+
+def turn_key(session: Session) -> str:
+    # a new chat has no id until its first turn creates it, so that turn is serialised per session
+    return chat_key(session.chat.id) if session.chat else session.id
+
 router = APIRouter()
 
+# the page routes are plain functions, so FastAPI runs them in its threadpool and their
+# SQLite work never blocks the event loop. the chat routes are async and push their blocking
+# calls to the threadpool explicitly.
+
 @router.get("/", response_class=HTMLResponse)
-async def main_page(
+def main_page(
     request: Request,
     flash_error: str | None = Cookie(default=None),
     session_id: str | None = Cookie(default=None),
     sm: SessionManager = Depends(get_session_manager)
 ):
-    print("cookie:", session_id)
-    print("sessions:", [session.id for session in sm.sessions])
-    
     app = get_state(request=request)
+    app.configs.logger.debug(f"cookie: {session_id}, live sessions: {sm.live}")
 
     root_path = get_root_path(request=request)
 
     invalid = not session_id or not sm.has_session(session_id)
 
     if invalid:
-        session = Session(configs=app.configs)
+        session = sm.add_session(Session(configs=app.configs, services=app.services))
 
-        sm.sessions.append(session)
-        
     else:
         session = sm.get_session(session_id)
 
-    users = [row[1] for row in session.db.get_users()]
+    # the page only changes when a user is added, but a new session or a flash message must always get through
+    users_version, user_rows = app.services.db.read_models.users()
+    etag = make_etag("main", *users_version, app.templates_version)
+    if not invalid and not flash_error and is_not_modified(request, etag):
+        return not_modified(etag)
+
+    users = [row[1] for row in user_rows]
 
     response = app.templates.TemplateResponse(
         "main.html",
         {"request": request, "users": users, "error": flash_error,},
     )
+    add_validators(response, etag)
 
     if flash_error:
         response.delete_cookie("flash_error", path=root_path)
@@ -73,7 +117,7 @@ async def main_page(
 
 
 @router.get("/users/{user_name}", name="user_page")
-async def get_user(
+def get_user(
     request: Request,
     user_name: str,
     session_id: str | None = Cookie(default=None),
@@ -81,35 +125,69 @@ async def get_user(
 ):
     app = get_state(request=request)
     root_path = get_root_path(request=request)
-    print("cookie:", session_id)
-    print("sessions:", [session.id for session in sm.sessions])
+    app.configs.logger.debug(f"cookie: {session_id}, live sessions: {sm.live}")
     if not session_id or not sm.has_session(session_id):
         redirect = RedirectResponse(f"{root_path}/", status_code=303)
         return redirect
 
     session = sm.get_session(session_id=session_id)
 
-    # clears the chat from the session 
-    session.chat = None
+    # clears the chat from the session, so the next prompt starts a new one.
+    # only written to the store when something actually changed.
+    if session.chat is not None or session.user is None or session.user.name != user_name:
+        session.chat = None
+        session.load_user(user_name=user_name)
+        sm.save(session)
 
-    session.load_user(user_name=user_name)
-    chats = session.user.get_chats()
+    chats_version, _ = app.services.db.read_models.chats(user_id=session.user.id)
+    etag = make_etag("user", user_name, *chats_version, app.templates_version)
+    if is_not_modified(request, etag, last_modified=chats_version[1]):
+        return not_modified(etag, last_modified=chats_version[1])
 
-    return app.templates.TemplateResponse(
+    response = app.templates.TemplateResponse(
         "main.html", 
-        {"request": request, "chats": chats, "user_name": user_name},
+        {"request": request, "user_name": user_name, **chats_page(app, user_id=session.user.id)},
     )
+    return add_validators(response, etag, last_modified=chats_version[1])
 
 
 @router.get("/user/{user_name}/chat/{chat_id}", name="individual_chat", response_class=HTMLResponse)
-async def get_chat(
+def get_chat(
     user_name: str,
-    chat_id: str,
+    chat_id: int,
     request: Request,
     sm: SessionManager = Depends(get_session_manager),
     flash_error: str | None = Cookie(default=None),
     session_id: str | None = Cookie(default=None),
 ):
+    return render_chat(request=request, sm=sm, session_id=session_id, user_name=user_name, chat_id=chat_id, template="main.html")
+
+
+@router.get("/user/{user_name}/chat/{chat_id}/panel", name="chat_panel", response_class=HTMLResponse)
+def get_chat_panel(
+    user_name: str,
+    chat_id: int,
+    request: Request,
+    sm: SessionManager = Depends(get_session_manager),
+    session_id: str | None = Cookie(default=None),
+):
+    """
+    HTMX partial: just the chat, for swapping into the page when a chat is picked from the sidebar
+    """
+    return render_chat(request=request, sm=sm, session_id=session_id, user_name=user_name, chat_id=chat_id, template="chat.html")
+
+
+def render_chat(
+        request: Request,
+        sm: SessionManager,
+        session_id: str | None,
+        user_name: str,
+        chat_id: int,
+        template: str,
+        ) -> Response:
+    """
+    loads the chat into the session and renders it, or answers 304 if the browser's copy is current
+    """
     app = get_state(request=request)
     if not session_id or not sm.has_session(session_id):
         root_path = get_root_path(request=request)
@@ -117,14 +195,181 @@ async def get_chat(
         return redirect
 
     session = sm.get_session(session_id=session_id)
+    if session.user is None or session.user.name != user_name:
+        session.load_user(user_name=user_name)
+    chat_version = app.services.db.get_chat_version(chat_id=chat_id)
+    if chat_version is None or chat_version[0] != session.user.id:
+        return HTMLResponse("Chat not found", status_code=404)
+
+    chats_version, _ = app.services.db.read_models.chats(user_id=session.user.id)
+    etag = make_etag(template, user_name, chat_id, *chat_version, *chats_version, app.templates_version)
+    last_modified = max(chat_version[1] or 0, chats_version[1] or 0)
+    if is_not_modified(request, etag, last_modified=last_modified):
+        # the page is unchanged, but the session still has to switch to this chat
+        if session.chat is None or session.chat.id != chat_id:
+            session.load_chat(chat_id=chat_id)
+            sm.save(session)
+        return not_modified(etag, last_modified=last_modified)
+
+    changed_chat = session.chat is None or session.chat.id != chat_id
     session.load_chat(chat_id=chat_id)
-    chats = session.user.get_chats()
+    if changed_chat:
+        sm.save(session)
+
+    # rendered once per message and cached, so reopening a long chat doesn't run the markdown filter again
+    assistant_messages = [
+        msg_docs for msg_docs in session.chat.messages
+        if msg_docs.message.role == "assistant" and msg_docs.message.content
+        ]
+    rendered = dict(zip(
+        (msg_docs.id for msg_docs in assistant_messages),
+        app.renderer.render_many(assistant_messages),
+        ))
+
+    # only the latest window of messages is loaded; older ones are fetched as the user scrolls up
+    older_url = None
+    if session.chat.has_older:
+        older_url = older_messages_url(request, user_name=user_name, chat_id=chat_id, before_id=session.chat.messages[1].id)
 
     response = app.templates.TemplateResponse(
-        "main.html",
-        {"request": request, "chat": session.chat.messages, "user_name": user_name, "chats": chats}
+        template,
+        {
+            "request": request,
+            "chat": session.chat.messages,
+            "rendered": rendered,
+            "older_url": older_url,
+            "user_name": user_name,
+            **chats_page(app, user_id=session.user.id),
+        }
     )
-    return response
+    return add_validators(response, etag, last_modified=last_modified)
+
+
+@router.get("/users/{user_name}/chats", name="sidebar_chats", response_class=HTMLResponse)
+def get_sidebar_chats(
+    request: Request,
+    user_name: str,
+    before_updated_at: int | None = None,
+    before_id: int | None = None,
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+):
+    """
+    HTMX partial: the sidebar's chat list, refreshed when a turn adds or renames a chat.
+    with a (before_updated_at, before_id) cursor it returns just the next page, for "load more".
+    """
+    app = get_state(request=request)
+    if not session_id or not sm.has_session(session_id):
+        return HTMLResponse("Session expired or invalid", status_code=400)
+
+    user_id = app.services.db.read_models.user_id(user_name)
+    if user_id is None:
+        return HTMLResponse("User not found", status_code=404)
+    before = (before_updated_at, before_id) if before_updated_at is not None and before_id is not None else None
+    chats_version, _ = app.services.db.read_models.chats(user_id=user_id)
+    etag = make_etag("chats", user_name, before, *chats_version, app.templates_version)
+    if is_not_modified(request, etag, last_modified=chats_version[1]):
+        return not_modified(etag, last_modified=chats_version[1])
+
+    response = app.templates.TemplateResponse(
+        "sidebar-chat-items.html" if before else "sidebar-chat-list.html",
+        {"request": request, "user_name": user_name, **chats_page(app, user_id=user_id, before=before)},
+    )
+    return add_validators(response, etag, last_modified=chats_version[1])
+
+
+@router.get("/user/{user_name}/chat/{chat_id}/messages", name="older_messages", response_class=HTMLResponse)
+def get_older_messages(
+    request: Request,
+    user_name: str,
+    chat_id: int,
+    before_id: int,
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+):
+    """
+    HTMX partial: the page of messages just before before_id, fetched when the top of the chat
+    scrolls into view. it reads straight from the database, so the session's chat stays the
+    same size however far back the user scrolls.
+    """
+    app = get_state(request=request)
+    if not session_id or not sm.has_session(session_id):
+        return HTMLResponse("Session expired or invalid", status_code=400)
+
+    chat_version = app.services.db.get_chat_version(chat_id=chat_id)
+    if chat_version is None or chat_version[0] != app.services.db.read_models.user_id(user_name):
+        return HTMLResponse("Chat not found", status_code=404)
+    page_size = app.configs.chat_window_messages
+    # what came before a message never changes
+    etag = make_etag("older", chat_id, before_id, page_size, app.templates_version)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # one extra row tells whether there is another page after this one
+    rows = app.services.db.get_messages(chat_id=chat_id, limit=page_size + 1, before_id=before_id) or []
+    messages = Chat.blobs_to_msg_docs(messages_docs=rows[-page_size:], db=app.services.db)
+    older_url = None
+    if len(rows) > page_size:
+        older_url = older_messages_url(request, user_name=user_name, chat_id=chat_id, before_id=messages[0].id)
+
+    assistant_messages = [
+        msg_docs for msg_docs in messages
+        if msg_docs.message.role == "assistant" and msg_docs.message.content
+        ]
+    rendered = dict(zip(
+        (msg_docs.id for msg_docs in assistant_messages),
+        app.renderer.render_many(assistant_messages),
+        ))
+
+    response = app.templates.TemplateResponse(
+        "chat-messages.html",
+        {"request": request, "messages": messages, "rendered": rendered, "older_url": older_url},
+    )
+    return add_validators(response, etag)
+
+
+def older_messages_url(request: Request, user_name: str, chat_id: int, before_id: int) -> str:
+    url = request.url_for("older_messages", user_name=user_name, chat_id=chat_id)
+    return str(url.include_query_params(before_id=before_id))
+
+
+@router.get("/user/{user_name}/chat/{chat_id}/messages/{message_id}", name="message_block", response_class=HTMLResponse)
+def get_message_block(
+    request: Request,
+    user_name: str,
+    chat_id: int,
+    message_id: int,
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+):
+    """
+    HTMX partial: a single message, rendered from the cache. messages never change, so the
+    ETag only depends on the message and the templates.
+    """
+    app = get_state(request=request)
+    if not session_id or not sm.has_session(session_id):
+        return HTMLResponse("Session expired or invalid", status_code=400)
+
+    chat_row = app.services.db.get_chat(chat_id=chat_id)
+    if chat_row is None or chat_row[1] != app.services.db.read_models.user_id(user_name):
+        return HTMLResponse("Chat not found", status_code=404)
+    etag = make_etag("message", chat_id, message_id, app.templates_version)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    row = app.services.db.get_message(chat_id=chat_id, message_id=message_id)
+    if row is None:
+        return HTMLResponse("Message not found", status_code=404)
+    msg_docs = Chat.blobs_to_msg_docs(messages_docs=[row], db=app.services.db)[0]
+
+    if msg_docs.message.role == "user":
+        response = app.templates.TemplateResponse("user-message.html", {"request": request, "user_message": msg_docs.message})
+    elif msg_docs.message.role == "assistant" and msg_docs.message.content:
+        response = HTMLResponse(app.renderer.render(msg_docs))
+    else:
+        # system prompts, tool calls and tool responses aren't shown in the chat
+        response = HTMLResponse("")
+    return add_validators(response, etag)
 
 
 @router.post("/chat", response_class=HTMLResponse, name="chat")
@@ -134,31 +379,161 @@ async def post_chat(
     tool_names: list[str] = Form([]),
     session_id: str | None = Cookie(default=None),
     chat_id: int | None = Form(default=None),
-    sm: SessionManager = Depends(get_session_manager)
+    idempotency_key: str | None = Header(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+    turns: TurnTracker = Depends(get_turn_tracker),
+    admission: AdmissionController = Depends(get_admission),
 ):
     app = get_state(request=request)
-    session = sm.get_session(session_id=session_id)
-
-    print("cookie:", session_id)
-    print("sessions:", [session.id for session in sm.sessions])
+    session = await run_in_threadpool(sm.get_session, session_id=session_id)
 
     if session is None:
         return HTMLResponse("Session expired or invalid", status_code=400)
     app.configs.logger.debug(f"chat_id_4: {chat_id}")
     user_message = Message(role="user", content=prompt)
-    msg_docs = session.process_prompt(prompt=prompt, tool_names=tool_names)
+
+    async def turn():
+        is_new_chat = session.chat is None
+        async with admission.admit(turn_owner(session)):
+            msg_docs = await session.aprocess_prompt(prompt=prompt, tool_names=tool_names)
+        if is_new_chat:
+            await run_in_threadpool(sm.save, session)
+        return msg_docs
+
+    # one turn at a time per chat; a form resubmitted with the same Idempotency-Key waits for
+    # the turn already running instead of asking again
+    msg_docs = await turns.run(key=turn_key(session), turn=turn, idempotency_key=idempotency_key, session_id=session.id)
     
     return app.templates.TemplateResponse("chat-box.html", {
         "request": request,
         "user_message": user_message,
-        "assistant_message": msg_docs.message,
-        "documents": msg_docs.documents,
+        "assistant_html": await run_in_threadpool(app.renderer.render, msg_docs),
         "chat_id": chat_id,
+        },
+        # tells the sidebar to refresh its chat list
+        headers={"HX-Trigger": "chats-changed"},
+    )
+
+@router.post("/chat/start", response_class=HTMLResponse, name="chat_start")
+async def post_chat_start(
+    request: Request,
+    prompt: str = Form(...),
+    tool_names: list[str] = Form([]),
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+):
+    """
+    renders the user's message and an empty assistant message that opens the SSE stream.
+    the prompt is kept in the session store under a new stream id, so any worker can serve
+    the stream and the URL only carries the id.
+    """
+    app = get_state(request=request)
+    if not await run_in_threadpool(sm.has_session, session_id):
+        return HTMLResponse("Session expired or invalid", status_code=400)
+
+    stream_id = await run_in_threadpool(sm.save_stream, session_id=session_id, prompt=prompt, tool_names=tool_names)
+    query = urlencode({"stream_id": stream_id})
+    return app.templates.TemplateResponse("chat-stream.html", {
+        "request": request,
+        "user_message": Message(role="user", content=prompt),
+        "stream_url": f"{request.url_for('chat_stream')}?{query}",
         }
     )
 
+@router.get("/chat/stream", name="chat_stream")
+async def get_chat_stream(
+    request: Request,
+    stream_id: str,
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+    turns: TurnTracker = Depends(get_turn_tracker),
+    admission: AdmissionController = Depends(get_admission),
+):
+    app = get_state(request=request)
+    session = await run_in_threadpool(sm.get_session, session_id=session_id)
+
+    # 204 tells the EventSource not to reconnect. the stream id can only be claimed once,
+    # so a reconnect, on this worker or another, doesn't send the prompt again
+    ticket = await run_in_threadpool(sm.claim_stream, session_id=session.id, stream_id=stream_id) if session else None
+    if ticket is None:
+        return Response(status_code=204)
+    prompt, tool_names = ticket
+
+    async def event_stream() -> AsyncIterator[str]:
+        async with turns.hold(key=turn_key(session), session_id=session.id):
+            try:
+                await admission.acquire(turn_owner(session))
+            except TurnRejectedError as e:
+                # nothing has been saved yet, so the user can simply send the prompt again
+                busy = Message(role="assistant", content=f"The server is busy. Please try again in {e.retry_after} seconds.")
+                yield sse_event("done", await run_in_threadpool(app.renderer.render, MessageDocuments(message=busy)))
+                return
+            try:
+                is_new_chat = session.chat is None
+                error = None
+                events = session.aprocess_prompt_streaming(prompt=prompt, tool_names=tool_names)
+                # aclosing() makes sure the LLM stream is closed, and the partial turn saved, when the client goes away
+                async with aclosing(events):
+                    async for event in events:
+                        if await request.is_disconnected():
+                            app.configs.logger.info(f"Client disconnected, stopping stream {stream_id}.")
+                            return
+                        if event.type == "token":
+                            yield sse_event("token", html.escape(event.content))
+                        elif event.type in ("tool_call", "retrieval"):
+                            yield sse_event("status", html.escape(event.content))
+                        elif event.type == "error":
+                            error = event.content
+                            break
+                        elif event.type == "done":
+                            break
+
+                if is_new_chat and session.chat is not None:
+                    await run_in_threadpool(sm.save, session)
+
+                if error:
+                    final = MessageDocuments(message=Message(role="assistant", content=f"LLM call failed: {error}"))
+                else:
+                    final = session.last_message()
+                yield sse_event("done", await run_in_threadpool(app.renderer.render, final))
+            finally:
+                admission.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # stops nginx from buffering the stream
+        },
+    )
+
+def sse_event(event: str, data: str) -> str:
+    # every line of a multi-line payload needs its own data: field
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
+
+@router.get("/chat/status", name="chat_status")
+async def get_chat_status(
+    session_id: str | None = Cookie(default=None),
+    sm: SessionManager = Depends(get_session_manager),
+    turns: TurnTracker = Depends(get_turn_tracker),
+):
+    session = await run_in_threadpool(sm.get_session, session_id=session_id, touch=False)
+    if session is None:
+        return JSONResponse({"error": "Session expired or invalid"}, status_code=400)
+    return JSONResponse(turns.status(turn_key(session)))
+
+@router.get("/metrics", name="metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus scrape endpoint
+    """
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
 @router.post("/create_user/", name="create_user")
-async def create_user(
+def create_user(
     request: Request,
     user_name: str = Form(...),
     session_id: str | None = Cookie(default=None),
@@ -173,6 +548,7 @@ async def create_user(
         session = sm.get_session(session_id)
         session.db.create_user(user_name=user_name)
         session.load_user(user_name=user_name)
+        sm.save(session)
     except UserAlreadyExistsError as e:
         app.configs.logger.error(f"There was an error creating the user: {e}")
         root_path = get_root_path(request=request)
@@ -189,117 +565,3 @@ async def create_user(
     
     url = request.url_for("user_page", user_name=user_name)
     return RedirectResponse(url, status_code=303)
-
-### old stuff
-
-# @app.get("/", response_class=HTMLResponse)
-# async def get_chat(
-#     request: Request,
-#     sm: SessionManager = Depends(get_session_manager)
-#     ):
-#     session = Session(configs=configs)
-
-#     # This is just for dev. maybe move it to a config.
-#     session.default_user()
-
-#     chat_id = session.chat.id
-#     session.logger.info(f"chat_id in GET: {chat_id}")
-#     sm.sessions[chat_id] = session
-#     session.logger.info(f"Sessions logged by session manager: {sm.sessions.keys()}")
-    
-#     return templates.TemplateResponse("chat.html", {
-#         "request": request,
-#         "user_message": None,
-#         "assistant_message": None,
-#         "chat_id": chat_id,
-#         }
-#     )
-
-
-
-############
-# streaming endpoints (doesn't work)
-############
-
-# @app.post("/chat/start", response_class=HTMLResponse)
-# async def post_chat(
-#     request: Request, 
-#     prompt: str = Form(...),
-#     chat_id: int | None = Form(default=None),
-#     sm: SessionManager = Depends(get_session_manager)
-#         ):
-#     session = sm.sessions.get(chat_id)
-#     if session is None:
-#         return HTMLResponse("Session expired or invalid", status_code=400)
-#     user_message = MessageDocuments(message=Message(role="user", content=prompt))
-#     message_id = session.chat.add_message(user_message)
-    
-#     return templates.TemplateResponse("chat-stream.html", {
-#         "request": request,
-#         "prompt": prompt,
-#         "message_id": message_id,
-#         "chat_id": chat_id,
-#         }
-#     )
-
-# this doesn't work yet, might never work. leaving for later.
-# @app.get("/chat/stream/{chat_id}/{message_id}")
-# async def get_chat_stream(
-#     request: Request,
-#     message_id: int,
-#     chat_id: int,
-#     sm: SessionManager = Depends(get_session_manager),
-# ):
-#     session = sm.sessions.get(chat_id)
-#     prompt = next(msg.message.content for msg in session.chat.messages if msg.id == message_id)
-
-#     async def event_stream() -> AsyncGenerator[str, None]:
-
-#         # assistant message start
-#         yield (
-#             "event: assistant_start\n"
-#             "data: \n\n"
-#         )
-
-#         try:
-#             prev_ended_space = False
-
-#             for event in session.process_prompt_streaming(prompt):
-#                 if await request.is_disconnected():
-#                     break
-
-#                 if event.type == "token":
-#                     text = event.content + " "
-#                     # if text and not text[0].isspace() and not prev_ended_space:
-#                     #     text = " " + text
-#                     #     prev_ended_space = text[-1].isspace()
-
-#                     yield (
-#                         "event: token\n"
-#                         f"data: {html.escape(text)}\n\n"
-#                     )
-
-#                 elif event.type == "error":
-#                     yield (
-#                         "event: error\n"
-#                         f"data: {html.escape(event.content)}\n\n"
-#                     )
-#                     return
-
-#                 elif event.type == "done":
-#                     break
-
-#         finally:
-#             yield (
-#                 "event: assistant_end\n"
-#                 "data: \n\n"
-#             )
-
-#     return StreamingResponse(
-#         event_stream(),
-#         media_type="text/event-stream",
-#         headers={
-#             "Cache-Control": "no-cache",
-#             "X-Accel-Buffering": "no",  # critical for nginx
-#         },
-#     )
\ No newline at end of file
@@ -1,19 +1,281 @@
-from typing import Dict
+import logging, threading, time
+from collections import OrderedDict
+from collections.abc import Callable
+from rag_app.app.core.errors import UserNotFoundError, ChatNotFoundError
+from rag_app.app.core.metrics import LIVE_SESSIONS
 from rag_app.app.services.session import Session
+from rag_app.api.session_store import SessionStore
 
-# build this out later into a robust session manager:
-#   - create, get, delete, exists, cleanup_expired
 
 class SessionManager:
-    def __init__(self):
-        self.sessions: list[Session] = []
-    
-    def has_session(self, session_id: str) -> bool:
-        return any(session.id == session_id for session in self.sessions)
-    
-    def get_session(self, session_id: str) -> Session | None:
-        return next(
-            (session for session in self.sessions if session.id == session_id),
-            None,
-        )
+    """
+    Keeps the live web sessions indexed by session id.
 
+    Sessions that sit idle for longer than `ttl_seconds` expire, and once `max_sessions`
+    is reached the least recently used session is evicted to make room for a new one.
+    A background reaper thread sweeps out expired sessions every `reap_interval` seconds.
+
+    With a `store`, the in-memory sessions are only a cache: the user and chat of every
+    session are saved to the store, and a session missing from memory or changed by another
+    worker is rebuilt from it with `session_factory`.
+    """
+
+    def __init__(
+            self,
+            ttl_seconds: float = 3600,
+            max_sessions: int = 1000,
+            reap_interval: float = 60,
+            store: SessionStore | None = None,
+            session_factory: Callable[[str], Session] | None = None,
+            busy: Callable[[str], bool] | None = None,
+            clock: Callable[[], float] = time.monotonic,
+            logger: logging.Logger | None = None,
+            ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.reap_interval = reap_interval
+        self.store = store
+        self.session_factory = session_factory
+        self.busy = busy
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+
+        # ordered from least to most recently used, so the LRU session is always first
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self._last_seen: dict[str, float] = {}
+        self._lock = threading.RLock()
+
+        # store version of each cached session, and when its idle timer was last written to the store
+        self._versions: dict[str, int] = {}
+        self._persisted_at: dict[str, float] = {}
+        self._touch_interval = min(60, ttl_seconds / 4)
+
+        # sessions released while one of their turns was running, waiting to be closed
+        self._closing: list[tuple[str, Session]] = []
+
+        self._stop = threading.Event()
+        self._reaper: threading.Thread | None = None
+
+        self.evicted = 0
+        self.expired = 0
+
+    @property
+    def live(self) -> int:
+        return len(self.sessions)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"live": self.live, "evicted": self.evicted, "expired": self.expired}
+
+    def add_session(self, session: Session) -> Session:
+        self._cache(session)
+        self.save(session)
+        return session
+
+    def save(self, session: Session):
+        """
+        writes the session's user and chat to the store so other workers see them.
+        call this after anything that changes which user or chat the session has loaded.
+        """
+        if self.store is None:
+            return
+        version = self.store.save(
+            session_id=session.id,
+            user_name=session.user.name if session.user else None,
+            chat_id=session.chat.id if session.chat else None,
+            )
+        with self._lock:
+            self._versions[session.id] = version
+            self._persisted_at[session.id] = time.time()
+
+    def save_stream(self, session_id: str, prompt: str, tool_names: list[str]) -> str:
+        """
+        keeps a streamed turn's prompt in the store and returns the id its stream is opened with
+        """
+        return self.store.save_stream(session_id=session_id, prompt=prompt, tool_names=tool_names)
+
+    def claim_stream(self, session_id: str, stream_id: str) -> tuple[str, list[str]] | None:
+        """
+        returns the (prompt, tool_names) of a stream the first time it is opened and None after that
+        """
+        return self.store.claim_stream(session_id=session_id, stream_id=stream_id)
+
+    def has_session(self, session_id: str | None) -> bool:
+        return self.get_session(session_id, touch=False) is not None
+
+    def get_session(self, session_id: str | None, touch: bool = True) -> Session | None:
+        """
+        returns the session, or None if it doesn't exist or has expired.
+        a successful lookup counts as activity unless touch is False.
+        """
+        if not session_id:
+            return None
+
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None and self._is_expired(session_id, now=self._clock()):
+                if self.store is None:
+                    self._expire(session_id)
+                else:
+                    # another worker may have kept it alive, so the store has the final word
+                    self._discard(session_id)
+                session = None
+
+        if self.store is not None:
+            session = self._sync(session_id, session)
+        if session is None:
+            return None
+
+        if touch:
+            self._touch(session_id)
+        return session
+
+    def remove_session(self, session_id: str) -> bool:
+        if self.store is not None:
+            self.store.delete(session_id)
+        with self._lock:
+            return self._discard(session_id)
+
+    def cleanup_expired(self) -> int:
+        """
+        removes every expired session and returns how many were removed.
+        """
+        self._close_released()
+        with self._lock:
+            now = self._clock()
+            expired_ids = [session_id for session_id in self.sessions if self._is_expired(session_id, now)]
+            if self.store is None:
+                for session_id in expired_ids:
+                    self._expire(session_id)
+                return len(expired_ids)
+            for session_id in expired_ids:
+                self._discard(session_id)
+
+        removed = self.store.delete_expired(ttl_seconds=self.ttl_seconds)
+        with self._lock:
+            self.expired += removed
+        return removed
+
+    def _cache(self, session: Session):
+        with self._lock:
+            while len(self.sessions) >= self.max_sessions:
+                session_id, evicted = self.sessions.popitem(last=False)
+                self._release(session_id, evicted)
+                self.evicted += 1
+            if session.id not in self.sessions:
+                LIVE_SESSIONS.inc()
+            self.sessions[session.id] = session
+            self._last_seen[session.id] = self._clock()
+
+    def _sync(self, session_id: str, session: Session | None) -> Session | None:
+        """
+        checks the cached session against the store, rebuilding it if it is missing or stale
+        """
+        row = self.store.load(session_id)
+        if row is None:
+            with self._lock:
+                self._discard(session_id)
+            return None
+
+        user_name, chat_id, version, updated_at = row
+        if time.time() - updated_at > self.ttl_seconds:
+            self.store.delete(session_id)
+            with self._lock:
+                self._discard(session_id)
+                self.expired += 1
+            return None
+
+        if session is not None and self._versions.get(session_id) == version:
+            return session
+
+        session = self._restore(session_id, user_name=user_name, chat_id=chat_id)
+        with self._lock:
+            self._discard(session_id)
+            self._cache(session)
+            self._versions[session_id] = version
+            self._persisted_at[session_id] = updated_at
+        return session
+
+    def _restore(self, session_id: str, user_name: str | None, chat_id: int | None) -> Session:
+        session = self.session_factory(session_id)
+        try:
+            if user_name:
+                session.load_user(user_name=user_name)
+            if chat_id and session.user:
+                session.load_chat(chat_id=chat_id)
+        except (UserNotFoundError, ChatNotFoundError) as e:
+            session.logger.warning(f"Session {session_id} restored without its user or chat: {e}")
+        return session
+
+    def _touch(self, session_id: str):
+        with self._lock:
+            if session_id not in self.sessions:
+                return
+            self._last_seen[session_id] = self._clock()
+            self.sessions.move_to_end(session_id)
+            stale = time.time() - self._persisted_at.get(session_id, 0) > self._touch_interval
+            if stale:
+                self._persisted_at[session_id] = time.time()
+        # the store only needs to know the session is alive once in a while, not on every request
+        if self.store is not None and stale:
+            self.store.touch(session_id)
+
+    def _is_expired(self, session_id: str, now: float) -> bool:
+        return now - self._last_seen[session_id] > self.ttl_seconds
+
+    def _expire(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        self._release(session_id, session)
+        self.expired += 1
+
+    def _discard(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._release(session_id, session)
+        return True
+
+    def _release(self, session_id: str, session: Session):
+        LIVE_SESSIONS.dec()
+        self._last_seen.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self._persisted_at.pop(session_id, None)
+        # a running turn still uses the session's clients, so it is closed once the turn is done
+        if self.busy is not None and self.busy(session_id):
+            self._closing.append((session_id, session))
+        else:
+            session.close()
+
+    def _close_released(self):
+        with self._lock:
+            if not self._closing:
+                return
+            done = [(session_id, session) for session_id, session in self._closing if not self.busy(session_id)]
+            self._closing = [pair for pair in self._closing if pair not in done]
+        for _, session in done:
+            session.close()
+
+    #---------------------#
+    ### background reaper ###
+    #---------------------#
+
+    def start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=self.reap_interval)
+            self._reaper = None
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            # one failed sweep, say a locked database, mustn't stop the sessions from expiring
+            try:
+                self.cleanup_expired()
+            except Exception as e:
+                self.logger.error(f"Session cleanup failed: {e}")
@@ -0,0 +1,163 @@
+import json, time, uuid
+from rag_app.app.core.config import Configurations
+from rag_app.app.services.sqlite_pool import get_pool
+
+
+class SessionStore:
+    """
+    Keeps the state of web sessions in SQLite, so every uvicorn worker can rebuild a
+    Session from it and sessions survive a restart.
+
+    A row holds the session id, the loaded user and chat, and a version number that is
+    bumped on every save, so a worker can tell when its in-memory copy has gone stale.
+
+    It also keeps the prompts of streamed turns between the POST that sends them and the
+    GET that opens the stream, as single-use stream tickets, so the prompt never goes in a URL.
+    """
+
+    def __init__(self, configs: Configurations):
+        self.configs = configs
+        self._init_db()
+
+    def _init_db(self):
+        with self._get_conn() as conn:
+            self._create_web_sessions_table(conn)
+            self._create_stream_tickets_table(conn)
+
+    def _get_conn(self):
+        # the same pool as the DatabaseManager's
+        return get_pool(self.configs).connection()
+
+    def _create_web_sessions_table(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS web_sessions (
+            id TEXT PRIMARY KEY,
+            user_name TEXT,
+            chat_id INTEGER,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER
+            )
+        """
+        )
+
+    def _create_stream_tickets_table(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stream_tickets (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            tool_names TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+            )
+        """
+        )
+
+    def save(self, session_id: str, user_name: str | None, chat_id: int | None) -> int:
+        """
+        inserts or updates a session and returns its new version
+        """
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO web_sessions (id, user_name, chat_id, version, updated_at)
+                VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    user_name = excluded.user_name,
+                    chat_id = excluded.chat_id,
+                    version = web_sessions.version + 1,
+                    updated_at = excluded.updated_at
+                RETURNING version
+                """, (session_id, user_name, chat_id, int(time.time()))
+            )
+            version = cursor.fetchone()[0]
+            conn.commit()
+        return version
+
+    def load(self, session_id: str) -> tuple[str | None, int | None, int, int] | None:
+        """
+        returns (user_name, chat_id, version, updated_at) for a session, or None if there is no such session
+        """
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT user_name, chat_id, version, updated_at
+                FROM web_sessions
+                WHERE id = ?
+                """,
+                (session_id,)
+            )
+            return cursor.fetchone()
+
+    def touch(self, session_id: str):
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE web_sessions
+                SET updated_at = ?
+                WHERE id = ?
+                """, (int(time.time()), session_id)
+            )
+            conn.commit()
+
+    def delete(self, session_id: str):
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM web_sessions WHERE id = ?", (session_id,))
+            conn.commit()
+
+    def delete_expired(self, ttl_seconds: float) -> int:
+        """
+        deletes sessions idle for longer than ttl_seconds and returns how many were deleted
+        """
+        cutoff = int(time.time() - ttl_seconds)
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM web_sessions WHERE updated_at < ?", (cutoff,))
+            removed = cursor.rowcount
+            # tickets whose stream was never opened
+            cursor.execute("DELETE FROM stream_tickets WHERE created_at < ?", (int(time.time() - self.configs.stream_ticket_ttl_seconds),))
+            conn.commit()
+            return removed
+
+    def save_stream(self, session_id: str, prompt: str, tool_names: list[str]) -> str:
+        """
+        keeps the prompt of a streamed turn until its stream is opened and returns the stream id
+        """
+        stream_id = uuid.uuid4().hex
+        with self._get_conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO stream_tickets (id, session_id, prompt, tool_names, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, (stream_id, session_id, prompt, json.dumps(tool_names), int(time.time()))
+            )
+            conn.commit()
+        return stream_id
+
+    def claim_stream(self, session_id: str, stream_id: str) -> tuple[str, list[str]] | None:
+        """
+        returns (prompt, tool_names) of a stream ticket and deletes it, in one statement, so only
+        the first request for a stream gets its prompt, on whichever worker it lands.
+        returns None for a ticket that was already claimed, has expired or is another session's.
+        """
+        cutoff = int(time.time() - self.configs.stream_ticket_ttl_seconds)
+        with self._get_conn() as conn:
+            row = conn.execute(
+                """
+                DELETE FROM stream_tickets
+                WHERE id = ? AND session_id = ? AND created_at >= ?
+                RETURNING prompt, tool_names
+                """, (stream_id, session_id, cutoff)
+            ).fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        prompt, tool_names = row
+        return prompt, json.loads(tool_names)
@@ -0,0 +1,135 @@
+import asyncio, threading, time
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any
+from rag_app.app.core.metrics import IN_FLIGHT_TURNS
+
+@dataclass
+class Turn:
+    session_id: str | None = None
+    idempotency_key: str | None = None
+    task: asyncio.Task | None = None
+    queued_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+
+
+def chat_key(chat_id: int) -> str:
+    # turns are serialised per chat, whether they come from a web session or the API
+    return f"chat:{chat_id}"
+
+
+class TurnTracker:
+    """
+    Serialises the chat turns of each chat, so two tabs, a double-submitted form or an API
+    client can't interleave their messages in the same chat.
+
+    Turns with the same key run one at a time, in the order they arrive. A turn sent with the
+    idempotency key of a turn already queued or running under that key joins it and gets its
+    result, instead of calling the LLM again. Turns without one never join, so asking the same
+    question twice gets two answers.
+
+    The locks are per process: with several workers, a chat's turns are only serialised
+    within the worker that receives them.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._turns: dict[str, list[Turn]] = {}
+        # the number of pending turns of each web session. the session reaper reads it from its
+        # own thread, so it has a lock, unlike _turns, which only the event loop touches.
+        self._sessions: dict[str, int] = {}
+        self._sessions_lock = threading.Lock()
+
+    async def run(
+            self,
+            key: str,
+            turn: Callable[[], Awaitable[Any]],
+            idempotency_key: str | None = None,
+            session_id: str | None = None,
+            ) -> Any:
+        pending = self._turns.setdefault(key, [])
+        existing = next((t for t in pending if idempotency_key and t.idempotency_key == idempotency_key), None)
+        if existing is not None:
+            # shielded, so a client that goes away doesn't cancel a turn someone else is waiting on
+            return await asyncio.shield(existing.task)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        record = Turn(session_id=session_id, idempotency_key=idempotency_key)
+        record.task = asyncio.create_task(self._run_locked(record, lock, turn))
+        pending.append(record)
+        self._count_session(record.session_id, 1)
+        IN_FLIGHT_TURNS.inc()
+        record.task.add_done_callback(lambda _: self._finish(key, record))
+        return await asyncio.shield(record.task)
+
+    @asynccontextmanager
+    async def hold(self, key: str, session_id: str | None = None):
+        """
+        serialises a turn that can't be handed over as a single awaitable, like a streamed response.
+        it queues and shows up in status() like any other turn, but nothing can join it.
+        """
+        record = Turn(session_id=session_id, task=asyncio.current_task())
+        self._turns.setdefault(key, []).append(record)
+        self._count_session(record.session_id, 1)
+        IN_FLIGHT_TURNS.inc()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                record.started_at = time.time()
+                yield
+        finally:
+            self._finish(key, record)
+
+    async def _run_locked(
+            self,
+            record: Turn,
+            lock: asyncio.Lock,
+            turn: Callable[[], Awaitable[Any]],
+            ) -> Any:
+        async with lock:
+            record.started_at = time.time()
+            return await turn()
+
+    def _finish(self, key: str, record: Turn):
+        pending = self._turns.get(key)
+        if pending is None:
+            return
+        if record in pending:
+            pending.remove(record)
+            self._count_session(record.session_id, -1)
+            IN_FLIGHT_TURNS.dec()
+        if not pending:
+            self._turns.pop(key, None)
+            self._locks.pop(key, None)
+
+    def _count_session(self, session_id: str | None, change: int):
+        if session_id is None:
+            return
+        with self._sessions_lock:
+            count = self._sessions.get(session_id, 0) + change
+            if count:
+                self._sessions[session_id] = count
+            else:
+                self._sessions.pop(session_id, None)
+
+    def busy(self, session_id: str) -> bool:
+        """
+        whether a turn of the web session is queued or running in this process, in any chat.
+        safe to call from any thread.
+        """
+        with self._sessions_lock:
+            return session_id in self._sessions
+
+    @property
+    def in_flight(self) -> int:
+        return sum(len(pending) for pending in self._turns.values())
+
+    def status(self, key: str) -> dict:
+        pending = self._turns.get(key, [])
+        running = next((turn for turn in pending if turn.started_at is not None), None)
+        return {
+            "in_progress": running is not None,
+            "queued": sum(1 for turn in pending if turn.started_at is None),
+            "started_at": running.started_at if running else None,
+        }
@@ -18,6 +18,12 @@ class ToolParseError(Exception):
 class LlmCallFailedError(Exception):
     pass
 
+class TurnRejectedError(Exception):
+    """Raised when a turn can't be queued because the server is at capacity"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 class RagClientFailedError(Exception):
     pass
 
@@ -25,4 +31,8 @@ class ConfigurationsError(Exception):
     pass
 
 class MetadataFilterError(Exception):
+    pass
+
+class VendoredFileError(Exception):
+    """Raised when a vendored static file is missing or does not match its pinned hash"""
     pass
\ No newline at end of file
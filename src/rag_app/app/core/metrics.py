@@ -0,0 +1,79 @@
+import os
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Prometheus metrics for the app, exposed at /metrics.
+#
+# With several uvicorn workers each one is a separate process, so the metrics are only complete
+# if PROMETHEUS_MULTIPROC_DIR points to a directory the workers share; rag-app-serve sets one up.
+
+# the stages of a chat turn, from a few ms (SQLite, rendering) to tens of seconds (LLM calls)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_SECONDS = Histogram(
+    "rag_app_stage_seconds",
+    "Time spent in each stage of serving a chat turn.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+TOOL_CALLS = Counter(
+    "rag_app_tool_calls_total",
+    "Tool calls made by the model, by tool name, or unknown for names that aren't tools.",
+    ["tool"],
+)
+RETRIES = Counter(
+    "rag_app_retries_total",
+    "LLM calls retried, by the cause of the retry.",
+    ["cause"],
+)
+ERRORS = Counter(
+    "rag_app_errors_total",
+    "Failures, by the component that failed.",
+    ["component"],
+)
+REJECTED_TURNS = Counter(
+    "rag_app_rejected_turns_total",
+    "Turns turned away because the admission queue was full.",
+)
+QUEUED_TURNS = Gauge(
+    "rag_app_queued_turns",
+    "Turns waiting for a free slot in the admission queue.",
+    multiprocess_mode="livesum",
+)
+LIVE_SESSIONS = Gauge(
+    "rag_app_live_sessions",
+    "Web sessions held in memory.",
+    multiprocess_mode="livesum",
+)
+IN_FLIGHT_TURNS = Gauge(
+    "rag_app_in_flight_turns",
+    "Chat turns running or queued.",
+    multiprocess_mode="livesum",
+)
+
+
+def observe(stage: str):
+    """
+    times a stage into STAGE_SECONDS. works as a context manager, also around awaits, or as a decorator.
+    """
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def render_latest() -> tuple[bytes, str]:
+    """
+    returns the current metrics in the Prometheus text format, with their content type
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
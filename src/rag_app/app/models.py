@@ -77,6 +77,34 @@ class ConfigurationsModel(BaseModel):
     rerank_top_n: int
     sqlite_path: str
     system_prompt: str
+    session_ttl_seconds: int = 3600
+    max_sessions: int = 1000
+    session_reap_interval_seconds: int = 60
+    stream_ticket_ttl_seconds: int = 300
+    context_token_budget: int = 12000
+    context_keep_turns: int = 2
+    chat_window_messages: int = 60
+    batch_max_prompts: int = 100
+    batch_concurrency: int = 4
+    render_cache_size: int = 2000
+    read_model_cache_size: int = 1000
+    chats_page_size: int = 20
+    max_running_turns: int = 8
+    max_queued_turns: int = 32
+    max_queued_turns_per_user: int = 4
+    turn_retry_after_seconds: int = 5
+    sqlite_pool_size: int = 8
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cached_statements: int = 256
+    sqlite_mmap_size: int = 268435456
+    sqlite_write_behind: bool = False
+    sqlite_shards: int = 1
+    blob_compression: Literal["zlib", "zstd", "none"] = "zlib"
+    blob_compression_min_bytes: int = 2048
+    retention_idle_days: int | None = None
+    archive_path: str | None = None
+    maintenance_interval_seconds: int = 3600
+    vacuum_step_pages: int = 2000
 
 # -----------------------------
 # Models for the API accessed by EmbeddingsClient.rerank
@@ -93,7 +121,7 @@ class RerankResponse(BaseModel):
 # Model for handling streaming
 # -----------------------------
 class StreamEvent(BaseModel):
-    type: Literal["token", "done", "error"]
+    type: Literal["token", "tool_call", "retrieval", "done", "error"]
     content: Optional[str] = None
 
 # -----------------------------
@@ -103,3 +131,39 @@ class UserModel(BaseModel):
     id: int
     name: str
 
+
+# -----------------------------
+# Models for the JSON API in api/api_v1.py
+# -----------------------------
+class ChatOut(BaseModel):
+    id: int
+    slug: str | None = None
+    created_at: int | None = None
+    updated_at: int | None = None
+
+class SearchHit(BaseModel):
+    chat_id: int
+    message_id: int
+    slug: str | None = None
+    role: str
+    snippet: str
+    rank: float
+
+class SearchResults(BaseModel):
+    hits: list[SearchHit]
+    next_after_rank: float | None = None
+    next_after_id: int | None = None
+
+class PromptRequest(BaseModel):
+    prompt: str
+    tool_names: list[str] = []
+
+class BatchRequest(BaseModel):
+    prompts: list[str]
+    tool_names: list[str] = []
+
+class BatchResult(BaseModel):
+    prompt: str
+    chat_id: int | None = None
+    response: MessageDocuments | None = None
+    error: str | None = None
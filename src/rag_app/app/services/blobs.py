@@ -0,0 +1,53 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:   # optional: without it blobs are compressed with zlib
+    zstandard = None
+
+# A compressed value is stored as a BLOB: one marker byte naming the codec, then the compressed
+# UTF-8 text. Values below the threshold, and every row written before compression existed,
+# stay TEXT, so SQLite's own type of the value tells the two apart.
+ZLIB = b"z"
+ZSTD = b"s"
+
+
+class BlobCodec:
+    """
+    Compresses the large text values the DatabaseManager stores, and reads back both the
+    compressed and the plain ones.
+    """
+
+    def __init__(self, codec: str = "zlib", min_bytes: int = 2048, logger=None):
+        if codec == "zstd" and zstandard is None:
+            if logger:
+                logger.warning("zstandard isn't installed, compressing blobs with zlib instead")
+            codec = "zlib"
+        self.codec = codec
+        self.min_bytes = min_bytes
+
+    def encode(self, text: str | None) -> str | bytes | None:
+        if text is None or self.codec == "none":
+            return text
+        data = text.encode()
+        if len(data) < self.min_bytes:
+            return text
+        if self.codec == "zstd":
+            compressed = ZSTD + zstandard.ZstdCompressor(level=9).compress(data)
+        else:
+            compressed = ZLIB + zlib.compress(data, level=6)
+        # JSON that doesn't shrink isn't worth the CPU to read back
+        return compressed if len(compressed) < len(data) else text
+
+    @staticmethod
+    def decode(value: str | bytes | None) -> str | None:
+        if value is None or isinstance(value, str):
+            return value
+        marker, payload = value[:1], value[1:]
+        if marker == ZLIB:
+            return zlib.decompress(payload).decode()
+        if marker == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("A blob is compressed with zstd, but zstandard isn't installed")
+            return zstandard.ZstdDecompressor().decompress(payload).decode()
+        raise ValueError(f"Unknown blob marker {marker!r}")
@@ -1,9 +1,12 @@
 import json
+from concurrent.futures import Future
+from contextlib import contextmanager
 from logging import Logger
 from rag_app.app.core.config import Configurations
 from rag_app.app.core.errors import ChatNotFoundError
 from rag_app.app.models import Message, ChromaDbResult, MessageDocuments, UserModel
 from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.document_store import document_keys, hydrate
 from rag_app.app.services.user import User
 
 
@@ -22,6 +25,11 @@ class Chat:
         self.db = db
         self.slug = None
         self.messages = [MessageDocuments(message=Message(role="system", content=configs.system_prompt))]
+        # True when messages holds only the recent window of a longer chat
+        self.has_older = False
+        # messages added during a turn, waiting for flush()
+        self._pending: list[MessageDocuments] | None = None
+        self._pending_slug: str | None = None
         
         if self.id:
             self._load_messages()
@@ -33,11 +41,55 @@ class Chat:
         it will save the chat to the database with the system message, set a chat_id,
         and add the user first message to the chat.
         """
+        self.create()
+        self.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
+
+    def create(self):
+        """
+        saves a new, empty chat to the database with just the system message and sets its chat_id.
+        """
         init_message = self.messages[0]
         self.id = self.db.create_chat(user_id=self.user.id, init_message=init_message)
-        self.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
+
+    def begin_turn(self):
+        """
+        from here until flush(), add_message() only adds messages in memory, without an id,
+        and flush() writes them all to the database in one transaction
+        """
+        if self._pending is None:
+            self._pending = []
+
+    def flush(self) -> Future | None:
+        """
+        writes the messages added since begin_turn() and ends the turn. returns the Future from
+        save_turn(), done once the messages have their ids, or None if there was nothing to write.
+        """
+        pending, self._pending = self._pending, None
+        slug, self._pending_slug = self._pending_slug, None
+        if pending or slug:
+            return self.db.save_turn(chat_id=self.id, msg_docs=pending or [], slug=slug)
+        return None
+
+    @contextmanager
+    def turn(self):
+        """
+        batches the writes of the block into a single transaction at the end of it, even if it fails
+        """
+        self.begin_turn()
+        try:
+            yield self
+        finally:
+            self.flush()
 
     def add_message(self, msg_docs: MessageDocuments):
+        if self._pending is not None:
+            self._pending.append(msg_docs)
+            self.messages.append(msg_docs)
+            if self.slug is None:
+                self.slug = self._pending_slug = self._make_slug(msg_docs.message.content)
+            self.logger.info(f"Message added to the turn, role: {msg_docs.message.role}")
+            return None
+
         message_id = self.db.insert_message(chat_id=self.id, msg_docs=msg_docs)
         msg_docs.id = message_id
         self.messages.append(msg_docs)
@@ -50,30 +102,77 @@ class Chat:
         return message_id
     
     def create_slug(self, content: str):
-        slug = content[:50] + "..."
+        slug = self._make_slug(content)
         self.db.add_slug(chat_id=self.id, slug=slug)
         self.logger.info(f"Added slug {slug} to chat {self.id}")
         return slug
     
+    @staticmethod
+    def _make_slug(content: str | None) -> str:
+        return (content or "")[:50] + "..."
+
     def dump_to_blob(self) -> str:
         return json.dumps([message.model_dump() for message in self.messages])
     
-    def blobs_to_msg_docs(self, messages_docs: list[tuple[str, str | None]]) -> list[MessageDocuments]:
+    @staticmethod
+    def blobs_to_msg_docs(messages_docs: list[tuple[dict, str | None, int]], db: DatabaseManager) -> list[MessageDocuments]:
+        """
+        turns (message, documents, id) rows into MessageDocuments, looking up the documents the
+        rows refer to in one go
+        """
+        entries = [json.loads(documents_blob) if documents_blob else None for _, documents_blob, _ in messages_docs]
+        keys = set().union(*(document_keys(item) for item in entries if item))
+        # rows of the same chat, so their documents are all in the same shard
+        stored = db.get_documents(sorted(keys), shard=db.shard_of(messages_docs[0][2])) if keys else {}
+
         messages = []
-        for message_blob, documents_blob in messages_docs:
+        for (message, _, message_id), item in zip(messages_docs, entries):
             msg_docs = MessageDocuments.model_validate({
-            "message": json.loads(message_blob),
-            "documents": json.loads(documents_blob) if documents_blob else None
+            "message": message,
+            "documents": hydrate(item, stored) if item else None,
+            "id": message_id,
             })
             messages.append(msg_docs)
         return messages
 
     def _load_messages(self):
-        messages_docs = self.db.get_messages(chat_id=self.id)
+        """
+        loads only the most recent window of the chat, keeping the system prompt at the front.
+        older messages can be pulled in with load_older().
+        """
+        messages_docs = self.db.get_messages(chat_id=self.id, limit=self.configs.chat_window_messages)
         if messages_docs is None:
             self.logger.warning(f"Chat {self.id} not found in the database.")
             raise ChatNotFoundError(f"Chat {self.id} not found in the database.")
-        self.messages = self.blobs_to_msg_docs(messages_docs=messages_docs)
+        messages = self.blobs_to_msg_docs(messages_docs=messages_docs, db=self.db)
+
+        # the system prompt is the first message of every chat, so if it isn't in the window there is more history
+        self.has_older = messages[0].message.role != "system"
+        if self.has_older:
+            first_message = self.db.get_first_message(chat_id=self.id)
+            messages.insert(0, self.blobs_to_msg_docs(messages_docs=[first_message], db=self.db)[0])
+        self.messages = messages
+
+    def load_older(self, limit: int | None = None) -> list[MessageDocuments]:
+        """
+        fetches the messages just before the loaded window, puts them back in place and returns them.
+        """
+        if not self.has_older:
+            return []
+        limit = limit or self.configs.chat_window_messages
+        messages_docs = self.db.get_messages(
+            chat_id=self.id,
+            limit=limit,
+            before_id=self.messages[1].id,
+            after_id=self.messages[0].id,
+            )
+        if messages_docs is None:
+            self.has_older = False
+            return []
+        older = self.blobs_to_msg_docs(messages_docs=messages_docs, db=self.db)
+        self.messages[1:1] = older
+        self.has_older = len(older) == limit
+        return older
 
     def _load_slug(self):
         self.slug = self.db.get_slug(chat_id=self.id)
\ No newline at end of file
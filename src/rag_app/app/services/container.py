@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from rag_app.app.core.config import Configurations
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.llm_client import LlmClient
+from rag_app.app.services.tool_handler import ToolHandler
+from rag_app.app.services.context import ContextBuilder
+
+
+@dataclass(frozen=True)
+class Services:
+    """
+    The stateless services a Session needs. Build these once per process and hand the
+    same object to every Session, so the database setup, tool chain validation and
+    the RAG clients' connections are shared by all users instead of rebuilt per session.
+    """
+    db: DatabaseManager
+    llm_client: LlmClient
+    tool_client: ToolHandler
+    context_builder: ContextBuilder
+
+    @classmethod
+    def build(cls, configs: Configurations) -> "Services":
+        db = DatabaseManager(configs=configs)
+        llm_client = LlmClient(configs=configs)
+        return cls(
+            db=db,
+            llm_client=llm_client,
+            tool_client=ToolHandler(configs=configs),
+            context_builder=ContextBuilder(configs=configs, db=db, llm_client=llm_client),
+        )
+
+    async def aclose(self):
+        self.context_builder.shutdown()
+        await self.tool_client.rag.emb_client.aclose()
+        self.db.close()
@@ -0,0 +1,199 @@
+import json, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import litellm
+from rag_app.app.core.config import Configurations
+from rag_app.app.core.errors import LlmCallFailedError
+from rag_app.app.core.metrics import observe
+from rag_app.app.models import Message, MessageDocuments
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.llm_client import LlmClient
+
+if TYPE_CHECKING:
+    from rag_app.app.services.chat import Chat   # type-checking only, no runtime import
+
+SUMMARY_PROMPT = (
+    "Summarise the conversation below between a user and an assistant researching the GDPR. "
+    "Keep the questions asked, the conclusions reached and any articles, chapters or guidelines cited. "
+    "Write at most a few short paragraphs."
+)
+
+# tool messages carry the full JSON of the retrieved documents; the summariser only needs a taste of them
+TOOL_EXCERPT_CHARS = 500
+TOKEN_CACHE_SIZE = 10_000
+
+
+class ContextBuilder:
+    """
+    Builds the list of messages sent to the LLM for a chat, so that it fits in a token budget.
+
+    The system prompt and the last `context_keep_turns` turns are always sent. Older turns are
+    added newest first while they fit in `context_token_budget`; whatever doesn't fit is replaced
+    by a rolling summary that is computed in the background and stored in SQLite, so it is
+    reused after a reload.
+    """
+
+    def __init__(self, configs: Configurations, db: DatabaseManager, llm_client: LlmClient):
+        self.configs = configs
+        self.logger = configs.logger
+        self.db = db
+        self.llm_client = llm_client
+        self._token_cache: OrderedDict[int, int] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summariser")
+        self._pending: set[int] = set()
+        self._lock = threading.Lock()
+
+    def build(self, chat: "Chat") -> list[MessageDocuments]:
+        system_message = chat.messages[0]
+        orphans, turns = self._split_turns(chat.messages[1:])
+
+        summary = self.db.get_summary(chat_id=chat.id) if chat.id else None
+        summarised_up_to = summary[0] if summary else 0
+        # turns already folded into the summary are never sent again
+        turns = [turn for turn in turns if turn[-1].id is None or turn[-1].id > summarised_up_to]
+
+        keep_turns = max(self.configs.context_keep_turns, 1)
+        kept, older = turns[-keep_turns:], turns[:-keep_turns]
+
+        summary_message = self._summary_message(summary[1]) if summary else None
+        budget = self.configs.context_token_budget - self.count_tokens(system_message)
+        if summary_message:
+            budget -= self.count_tokens(summary_message)
+        budget -= sum(self._turn_tokens(turn) for turn in kept)
+
+        while older and self._turn_tokens(older[-1]) <= budget:
+            turn = older.pop()
+            budget -= self._turn_tokens(turn)
+            kept.insert(0, turn)
+
+        # whatever is dropped gets folded into the summary: turns that didn't fit, a partial turn
+        # at the start of the loaded window, and history that was never loaded at all
+        if older:
+            up_to_message_id = older[-1][-1].id
+        elif orphans:
+            up_to_message_id = orphans[-1].id
+        elif chat.has_older:
+            up_to_message_id = chat.messages[1].id - 1
+        else:
+            up_to_message_id = None
+        if chat.id and up_to_message_id and up_to_message_id > summarised_up_to:
+            self._schedule_summary(chat_id=chat.id, up_to_message_id=up_to_message_id)
+
+        context = [system_message]
+        if summary_message:
+            context.append(summary_message)
+        for turn in kept:
+            context.extend(turn)
+        return context
+
+    def count_tokens(self, msg_docs: MessageDocuments) -> int:
+        """
+        counts the tokens of a single message, caching the result for stored messages
+        since they never change once written
+        """
+        if msg_docs.id is not None and msg_docs.id in self._token_cache:
+            self._token_cache.move_to_end(msg_docs.id)
+            return self._token_cache[msg_docs.id]
+
+        message = msg_docs.message.model_dump(exclude_none=True, exclude={"id"})
+        try:
+            tokens = litellm.token_counter(model=self.configs.model, messages=[message])
+        except Exception as e:
+            self.logger.warning(f"Token counting failed, estimating from length instead: {e}")
+            tokens = len(json.dumps(message)) // 4
+
+        if msg_docs.id is not None:
+            self._token_cache[msg_docs.id] = tokens
+            if len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+    def _turn_tokens(self, turn: list[MessageDocuments]) -> int:
+        return sum(self.count_tokens(msg_docs) for msg_docs in turn)
+
+    def _split_turns(
+            self, 
+            messages: list[MessageDocuments],
+            ) -> tuple[list[MessageDocuments], list[list[MessageDocuments]]]:
+        """
+        groups messages into turns, each starting with a user message, so that tool calls are
+        never separated from their tool responses.
+        messages before the first user message belong to a turn that started outside the loaded
+        window; they can't be sent on their own, so they are returned separately.
+        """
+        orphans: list[MessageDocuments] = []
+        turns: list[list[MessageDocuments]] = []
+        for msg_docs in messages:
+            if msg_docs.message.role == "user":
+                turns.append([])
+            if turns:
+                turns[-1].append(msg_docs)
+            else:
+                orphans.append(msg_docs)
+        return orphans, turns
+
+    def _summary_message(self, summary: str) -> MessageDocuments:
+        return MessageDocuments(
+            message=Message(role="system", content=f"Summary of the earlier conversation:\n{summary}")
+            )
+
+    #---------------------#
+    ### background summaries ###
+    #---------------------#
+
+    def _schedule_summary(self, chat_id: int, up_to_message_id: int):
+        with self._lock:
+            if chat_id in self._pending:
+                return
+            self._pending.add(chat_id)
+        self._executor.submit(self._summarise, chat_id, up_to_message_id)
+
+    def _summarise(self, chat_id: int, up_to_message_id: int):
+        try:
+            summary = self.db.get_summary(chat_id=chat_id)
+            previous_up_to, previous_summary = summary if summary else (0, None)
+            if up_to_message_id <= previous_up_to:
+                return
+
+            # only what the transcript shows, without putting whole messages back together
+            rows = self.db.get_message_texts(
+                chat_id=chat_id,
+                after_id=previous_up_to,
+                before_id=up_to_message_id + 1,
+                )
+            if not rows:
+                return
+            transcript = self._transcript(rows)
+            if previous_summary:
+                transcript = f"Summary so far:\n{previous_summary}\n\nConversation since then:\n{transcript}"
+
+            request = [
+                MessageDocuments(message=Message(role="system", content=SUMMARY_PROMPT)),
+                MessageDocuments(message=Message(role="user", content=transcript)),
+                ]
+            with observe("llm_summary"):
+                response = self.llm_client.send_request(messages=request)
+            new_summary = self.llm_client.get_messsage(response=response).content
+            self.db.upsert_summary(chat_id=chat_id, up_to_message_id=up_to_message_id, summary=new_summary)
+            self.logger.info(f"Summarised chat {chat_id} up to message {up_to_message_id}.")
+        except LlmCallFailedError as e:
+            self.logger.error(f"Summarising chat {chat_id} failed: {e}")
+        except Exception as e:
+            self.logger.error(f"Unexpected error while summarising chat {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(chat_id)
+
+    def _transcript(self, rows: list[tuple[str, str | None]]) -> str:
+        lines = []
+        for role, content in rows:
+            if role == "system" or not content:
+                continue
+            if role == "tool":
+                content = content[:TOOL_EXCERPT_CHARS]
+            lines.append(f"{role}: {content}")
+        return "\n".join(lines)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,8 +1,19 @@
-import sqlite3, time, json
+import time, json, threading
+from concurrent.futures import Future
 from rag_app.app.core.config import Configurations
 from typing import TYPE_CHECKING
 from rag_app.app.core.errors import *
+from rag_app.app.core.metrics import observe
 from rag_app.app.models import MessageDocuments
+from rag_app.app.services.sqlite_pool import get_pool, close_pool, WriteBehindQueue
+from rag_app.app.services.migrations import migrate
+from rag_app.app.services.document_store import DocumentKey, content_hash, document_keys, store_documents
+from rag_app.app.services.blobs import BlobCodec
+from rag_app.app.services.search_index import SNIPPET_TOKENS, index_messages, match_query
+from rag_app.app.services.retention import ChatArchive
+from rag_app.app.services.read_models import USERS, ReadModelCache, chats_key
+from rag_app.app.services.shards import next_ids, shard_path
+from rag_app.app.services.message_store import MESSAGE_COLUMNS, load_tool_calls, message_dict, write_messages
 
 if TYPE_CHECKING:
     from rag_app.app.services.chat import Chat   # type-checking only, no runtime import
@@ -11,78 +22,99 @@ class DatabaseManager:
 
     def __init__(self, configs: Configurations):
         self.configs = configs
+        self.shards = configs.sqlite_shards
+        self.blobs = BlobCodec(codec=configs.blob_compression, min_bytes=configs.blob_compression_min_bytes, logger=configs.logger)
         self._init_db()
+        self.read_models = ReadModelCache(self, max_entries=configs.read_model_cache_size)
+        # optional: the turns' writes are committed by a background thread after the response
+        self._write_behind = WriteBehindQueue(logger=configs.logger) if configs.sqlite_write_behind else None
+        # opened the first time a chat is archived or restored
+        self._archive: ChatArchive | None = None
+        self._archive_lock = threading.Lock()
     
     def _init_db(self):
-        """ Run DB setup once, using a temporary connection """
-        with self._get_conn() as conn:
-            conn.execute("PRAGMA foreign_keys = ON;")
-            self._create_users_table(conn)
-            self._create_chats_table(conn)
-            self._create_messages_table(conn)
-
-    def _get_conn(self):
-        return sqlite3.connect(self.configs.sqlite_path, check_same_thread=False, uri=True)
+        """ Run DB setup once """
+        for shard in range(self.shards):
+            with self._get_conn(shard) as conn:
+                migrate(conn, logger=self.configs.logger)
+        self._check_shards()
 
-    def _create_users_table(self, conn):
+    def _check_shards(self):
         """
-        creates the users table for the first time
-        """
-        cursor = conn.cursor()
-        cursor.execute(
+        records the number of shards the first time, and refuses to open the database with
+        another number: the chats would no longer be found where their ids say they are
         """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            user_name TEXT UNIQUE,
-            created_at INTEGER
-            )
-        """)
-    
-    def _create_chats_table(self, conn):
+        with self._get_conn() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'sqlite_shards'").fetchone()
+            if row is None:
+                if self.shards > 1 and conn.execute("SELECT 1 FROM chats LIMIT 1").fetchone():
+                    raise ConfigurationsError(
+                        f"{self.configs.sqlite_path} already holds chats that aren't sharded. Export them, "
+                        "and import them into a new database with sqlite_shards set."
+                        )
+                conn.execute("INSERT INTO settings (key, value) VALUES ('sqlite_shards', ?)", (str(self.shards),))
+            elif int(row[0]) != self.shards:
+                raise ConfigurationsError(
+                    f"{self.configs.sqlite_path} was set up with sqlite_shards: {row[0]}, not {self.shards}. "
+                    "Export the chats and import them into a new database to change it."
+                    )
+
+    def _get_conn(self, shard: int = 0):
         """
-        creates chats table for the first time 
+        borrows a pooled connection to a shard for a `with` block, committing at the end of it.
+        shard 0, the default, is the sqlite_path database, which also holds the users.
         """
-        cursor = conn.cursor()
-        cursor.execute(
+        return get_pool(self.configs, path=shard_path(self.configs.sqlite_path, shard)).connection()
+
+    def shard_of(self, id: int) -> int:
         """
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            slug TEXT,
-            created_at INTEGER,
-            updated_at INTEGER,
-            FOREIGN KEY (user_id)
-                REFERENCES users(id)
-                ON DELETE CASCADE
-            )
+        the shard holding a user's chats, or a chat or message, from its id
         """
-        )
+        return id % self.shards
+
+    def close(self):
+        # the queued writes go in before the connections close
+        if self._write_behind is not None:
+            self._write_behind.close()
+            self._write_behind = None
+        for shard in range(self.shards):
+            close_pool(shard_path(self.configs.sqlite_path, shard))
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
 
-    def _create_messages_table(self, conn):
+    def wait_for_writes(self):
+        if self._write_behind is not None:
+            self._write_behind.join()
+
+    def _bump_read_model(self, cursor, key: str):
         """
-        creates a table where the messages and associated documents are stored
+        marks a cached read model as changed, in the transaction of the write that changed it
         """
-        cursor = conn.cursor()
         cursor.execute(
+            """
+            INSERT INTO read_model_versions (key, version) VALUES (?, 1)
+            ON CONFLICT(key) DO UPDATE SET version = version + 1
+            """, (key,)
+        )
+
+    def _bump_chats_of(self, cursor, chat_id: int):
         """
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER,
-            message TEXT,
-            documents TEXT,
-            created_at INTEGER,
-            FOREIGN KEY (chat_id)
-                REFERENCES chats(id)
-                ON DELETE CASCADE
-            )
+        marks the chat list holding chat_id as changed
         """
+        cursor.execute(
+            """
+            INSERT INTO read_model_versions (key, version)
+            SELECT 'chats:' || user_id, 1 FROM chats WHERE id = ?
+            ON CONFLICT(key) DO UPDATE SET version = version + 1
+            """, (chat_id,)
         )
 
-
     #---------------------#
     ### CRUD operations ###
     #---------------------#
 
+    @observe("sqlite_write")
     def create_user(self, user_name):
         """
         inserts a user into the users table.
@@ -100,6 +132,7 @@ class DatabaseManager:
                 """,
                 (user_name, created_at)
             )
+            self._bump_read_model(cursor, USERS)
 
     def check_user(self, user_name: str):
         """
@@ -125,62 +158,63 @@ class DatabaseManager:
         return row[0]
 
     
+    @observe("sqlite_write")
     def create_chat(self, user_id: int, init_message: MessageDocuments) -> int:
         """
         instantiates a new chat record, returning the chat id.
         """
         created_at = int(time.time())
-        with self._get_conn() as conn:
+        shard = self.shard_of(user_id)
+        with self._get_conn(shard) as conn:
             cursor = conn.cursor()
+            [chat_id] = next_ids(conn, "chats", shard=shard, shards=self.shards)
             cursor.execute(
                     """
-                    INSERT INTO chats (user_id, created_at)
-                    VALUES (?, ?)
+                    INSERT INTO chats (id, user_id, created_at, updated_at)
+                    VALUES (?, ?, ?, ?)
                     """,
-                    (user_id, created_at)
+                    (chat_id, user_id, created_at, created_at)
                 )
-            conn.commit()
-            chat_id = cursor.lastrowid
-        self.insert_message(chat_id=chat_id, msg_docs=init_message)
+            self._bump_read_model(cursor, chats_key(user_id))
+            # on the same pooled connection, so the chat and its first message are one transaction,
+            # timed once as this write
+            self._insert_message(chat_id=chat_id, msg_docs=init_message)
         return chat_id
     
+    @observe("sqlite_write")
     def add_slug(self, chat_id: int, slug: str):
         
-        with self._get_conn() as conn:
+        with self._get_conn(self.shard_of(chat_id)) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
                 UPDATE chats
-                SET slug = ?
+                SET slug = ?, updated_at = ?
                 WHERE id = ?
-                """, (slug, chat_id,)
+                """, (slug, int(time.time()), chat_id,)
             )
+            self._bump_chats_of(cursor, chat_id)
 
     
-    def update_message(
-            self,
-            message_id: int,
-            chat_id: int,
-            msg_docs: MessageDocuments
-    ):
-        message = json.dumps(msg_docs.message.model_dump())
-        if msg_docs.documents:
-            documents = json.dumps([document.model_dump() for document in msg_docs.documents])
-        else:
-            documents = None
+    @observe("sqlite_write")
+    def insert_message(
+            self, 
+            chat_id: int, 
+            msg_docs: MessageDocuments):
+        """
+        inserts a message and associated documents (if present) into the messages table
+        """
+        return self._insert_message(chat_id=chat_id, msg_docs=msg_docs)
+
+    def _insert_message(self, chat_id: int, msg_docs: MessageDocuments) -> int:
         time_stamp = int(time.time())
-        
-        with self._get_conn() as conn:
+        shard = self.shard_of(chat_id)
+        with self._get_conn(shard) as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO messages (chat_id, message, documents)
-                VALUES (?, ?, ?)
-                WHERE id = ?
-                """, (chat_id, message, documents, message_id)
-            )
-
-            message_id = cursor.lastrowid
+            [message_id] = next_ids(conn, "messages", shard=shard, shards=self.shards)
+            documents = self._store_documents(cursor, msg_docs)
+            write_messages(cursor, [(message_id, chat_id, msg_docs.message.model_dump(), documents, time_stamp)], encode=self.blobs.encode)
+            index_messages(cursor, [(message_id, chat_id, msg_docs.message.role, msg_docs.message.content)])
 
             cursor.execute(
                 """
@@ -189,42 +223,478 @@ class DatabaseManager:
                 WHERE id = ?
                 """, (time_stamp, chat_id)
             )
+            self._bump_chats_of(cursor, chat_id)
             conn.commit()
+            
+            return message_id
 
-    def insert_message(
-            self, 
-            chat_id: int, 
-            msg_docs: MessageDocuments):
+    def save_turn(self, chat_id: int, msg_docs: list[MessageDocuments], slug: str | None = None) -> Future:
         """
-        inserts a message and associated documents (if present) into the messages table
+        writes the messages of a turn, and the chat's slug if it is new, in a single transaction,
+        setting the id of each MessageDocuments once it is stored. returns a Future that is done
+        when they are: with sqlite_write_behind the write is only queued, and the ids are None
+        until it is committed.
         """
-        message = json.dumps(msg_docs.message.model_dump())
-        if msg_docs.documents:
-            documents = json.dumps([document.model_dump() for document in msg_docs.documents])
-        else:
-            documents = None
+        if self._write_behind is not None:
+            return self._write_behind.submit(self._save_turn, chat_id, msg_docs, slug)
+        written = Future()
+        written.set_result(self._save_turn(chat_id, msg_docs, slug))
+        return written
+
+    @observe("sqlite_write")
+    def _save_turn(self, chat_id: int, msg_docs: list[MessageDocuments], slug: str | None):
         time_stamp = int(time.time())
-        with self._get_conn() as conn:
+        shard = self.shard_of(chat_id)
+        with self._get_conn(shard) as conn:
             cursor = conn.cursor()
+            message_ids = next_ids(conn, "messages", shard=shard, shards=self.shards, count=len(msg_docs))
+            write_messages(cursor, [
+                (message_id, chat_id, item.message.model_dump(), self._store_documents(cursor, item), time_stamp)
+                for item, message_id in zip(msg_docs, message_ids)
+                ], encode=self.blobs.encode)
+            index_messages(cursor, [
+                (message_id, chat_id, item.message.role, item.message.content)
+                for item, message_id in zip(msg_docs, message_ids)
+                ])
+
             cursor.execute(
                 """
-                INSERT INTO messages (chat_id, message, documents, created_at)
-                VALUES (?, ?, ?, ?)
-                """, (chat_id, message, documents, time_stamp)
+                UPDATE chats
+                SET updated_at = ?, slug = COALESCE(?, slug)
+                WHERE id = ?
+                """, (time_stamp, slug, chat_id)
             )
+            self._bump_chats_of(cursor, chat_id)
+        # only once the transaction has committed
+        for item, message_id in zip(msg_docs, message_ids):
+            item.id = message_id
 
-            message_id = cursor.lastrowid
+    def _store_documents(self, cursor, msg_docs: MessageDocuments) -> str | bytes | None:
+        documents = [document.model_dump() for document in msg_docs.documents or []]
+        return self.blobs.encode(store_documents(cursor, documents, encode=self.blobs.encode))
 
+    @observe("sqlite_write")
+    def upsert_summary(self, chat_id: int, up_to_message_id: int, summary: str):
+        """
+        stores the rolling summary of a chat, replacing the previous one
+        """
+        created_at = int(time.time())
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
             cursor.execute(
                 """
-                UPDATE chats
-                SET updated_at = ?
-                WHERE id = ?
-                """, (time_stamp, chat_id)
+                INSERT INTO summaries (chat_id, up_to_message_id, summary, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    up_to_message_id = excluded.up_to_message_id,
+                    summary = excluded.summary,
+                    created_at = excluded.created_at
+                """, (chat_id, up_to_message_id, summary, created_at)
             )
             conn.commit()
-            
-            return message_id
+
+    def compress_existing(self, batch_size: int = 500) -> dict[str, int]:
+        """
+        compresses the values written before compression was turned on, or while they were below
+        the threshold, one batch per transaction so the app can go on writing in between.
+        returns how many values were compressed, and their size in bytes before and after.
+        """
+        stats = {"compressed": 0, "bytes_before": 0, "bytes_after": 0}
+        for shard in range(self.shards):
+            for table, columns in (("messages", ("content", "documents")), ("documents", ("document",))):
+                last_id = 0
+                while True:
+                    with self._get_conn(shard) as conn:
+                        cursor = conn.cursor()
+                        rows = cursor.execute(
+                            f"""
+                            SELECT rowid, {", ".join(columns)}
+                            FROM {table}
+                            WHERE rowid > ?
+                            ORDER BY rowid
+                            LIMIT ?
+                            """, (last_id, batch_size)
+                        ).fetchall()
+                        if not rows:
+                            break
+                        for rowid, *values in rows:
+                            for column, value in zip(columns, values):
+                                if not isinstance(value, str):
+                                    continue
+                                encoded = self.blobs.encode(value)
+                                if isinstance(encoded, str):
+                                    continue
+                                cursor.execute(f"UPDATE {table} SET {column} = ? WHERE rowid = ?", (encoded, rowid))
+                                stats["compressed"] += 1
+                                stats["bytes_before"] += len(value.encode())
+                                stats["bytes_after"] += len(encoded)
+                        last_id = rows[-1][0]
+        return stats
+
+    #---------------------#
+    ### retention ###
+    #---------------------#
+
+    @property
+    def archive(self) -> ChatArchive:
+        with self._archive_lock:
+            if self._archive is None:
+                self._archive = ChatArchive(self.configs.archive_path or f"{self.configs.sqlite_path}.archive")
+            return self._archive
+
+    def archive_idle_chats(self, idle_seconds: int, batch_size: int = 100) -> dict[str, int]:
+        """
+        moves the chats nobody has touched for idle_seconds to the archive, one chat per
+        transaction, and returns how many chats and messages went and the archive's bytes for them
+        """
+        cutoff = int(time.time()) - idle_seconds
+        stats = {"archived_chats": 0, "archived_messages": 0, "archive_bytes": 0}
+        for shard in range(self.shards):
+            while True:
+                with self._get_conn(shard) as conn:
+                    chat_ids = [row[0] for row in conn.execute(
+                        """
+                        SELECT id
+                        FROM chats
+                        WHERE updated_at < ?
+                        ORDER BY updated_at
+                        LIMIT ?
+                        """, (cutoff, batch_size)
+                    )]
+                if not chat_ids:
+                    break
+                for chat_id in chat_ids:
+                    messages, size = self._archive_chat(chat_id=chat_id, cutoff=cutoff)
+                    stats["archived_chats"] += 1 if size else 0
+                    stats["archived_messages"] += messages
+                    stats["archive_bytes"] += size
+        return stats
+
+    @observe("sqlite_write")
+    def _archive_chat(self, chat_id: int, cutoff: int) -> tuple[int, int]:
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            # holds the write lock from the first read, so no message can slip in before the delete
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            chat = cursor.execute(
+                "SELECT id, user_id, slug, created_at, updated_at FROM chats WHERE id = ? AND updated_at < ?",
+                (chat_id, cutoff)
+            ).fetchone()
+            if chat is None:
+                return 0, 0   # touched since it was picked
+            rows = cursor.execute(
+                f"SELECT {MESSAGE_COLUMNS}, documents, id, created_at FROM messages WHERE chat_id = ? ORDER BY id",
+                (chat_id,)
+            ).fetchall()
+            # the archive keeps each message as JSON, as it always has
+            messages = [
+                (message_id, json.dumps(message), documents, created_at)
+                for message, documents, message_id, created_at in self._messages(conn, rows)
+                ]
+            summary = cursor.execute(
+                "SELECT up_to_message_id, summary, created_at FROM summaries WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            # committed to the archive before the chat leaves this database. if the process dies in
+            # between, the chat is in both, and archiving or restoring it again sorts that out.
+            size = self.archive.put(chat=chat, messages=messages, summary=summary)
+
+            self._bump_read_model(cursor, chats_key(chat[1]))
+            cursor.executemany("DELETE FROM messages_fts WHERE rowid = ?", [(row[0],) for row in messages])
+            cursor.executemany("DELETE FROM tool_calls WHERE message_id = ?", [(row[0],) for row in messages])
+            cursor.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            cursor.execute("DELETE FROM summaries WHERE chat_id = ?", (chat_id,))
+            cursor.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        return len(messages), size
+
+    @observe("sqlite_write")
+    def restore_chat(self, chat_id: int, user_id: int | None = None) -> bool:
+        """
+        brings an archived chat back, under its old ids, and marks it as just updated so the next
+        retention run leaves it alone. returns False if the chat isn't in the archive, or belongs
+        to someone other than user_id.
+        """
+        data = self.archive.get(chat_id)
+        if data is None or (user_id is not None and data["chat"][1] != user_id):
+            return False
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            if cursor.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone() is None:
+                _, owner, slug, created_at, _ = data["chat"]
+                cursor.execute(
+                    "INSERT INTO chats (id, user_id, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, owner, slug, created_at, int(time.time()))
+                )
+                self._bump_read_model(cursor, chats_key(owner))
+                messages = [
+                    (message_id, chat_id, json.loads(message), self.blobs.encode(documents), created_at)
+                    for message_id, message, documents, created_at in data["messages"]
+                    ]
+                write_messages(cursor, messages, encode=self.blobs.encode)
+                index_messages(cursor, [
+                    (message_id, chat_id, message.get("role"), message.get("content"))
+                    for message_id, chat_id, message, _, _ in messages
+                    ])
+                if data["summary"] is not None:
+                    cursor.execute(
+                        "INSERT INTO summaries (chat_id, up_to_message_id, summary, created_at) VALUES (?, ?, ?, ?)",
+                        (chat_id, *data["summary"])
+                    )
+        self.archive.delete(chat_id)
+        return True
+
+    def get_archived_chats(self, user_id: int) -> list[tuple[int, str | None, int]]:
+        return self.archive.list_chats(user_id=user_id)
+
+    def space_stats(self) -> dict[str, int]:
+        """
+        the size of the database in pages and bytes, and how much of it is free pages, added up
+        over the shards. incremental_vacuum is only 1 if it is on in all of them.
+        """
+        stats = {"size_bytes": 0, "free_bytes": 0, "incremental_vacuum": 1}
+        for shard in range(self.shards):
+            with self._get_conn(shard) as conn:
+                page_size, page_count, free_pages, auto_vacuum = (
+                    conn.execute(f"PRAGMA {name}").fetchone()[0]
+                    for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+                    )
+            stats["size_bytes"] += page_size * page_count
+            stats["free_bytes"] += page_size * free_pages
+            stats["incremental_vacuum"] &= int(auto_vacuum == 2)
+        return stats
+
+    def incremental_vacuum(self, step_pages: int = 2000) -> dict[str, int]:
+        """
+        gives the database's free pages back to the filesystem, step_pages at a time. each step
+        is a short transaction of its own, so writers only ever wait for one step.
+        does nothing until incremental vacuum is on, see enable_incremental_vacuum().
+        """
+        freed = freed_bytes = 0
+        for shard in range(self.shards):
+            with self._get_conn(shard) as conn:
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    while (free := conn.execute("PRAGMA freelist_count").fetchone()[0]):
+                        # the pages are only freed as the pragma's rows are read
+                        conn.execute(f"PRAGMA incremental_vacuum({min(free, int(step_pages))})").fetchall()
+                        left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                        if left >= free:
+                            break
+                        freed += free - left
+                        freed_bytes += (free - left) * page_size
+        return {"freed_pages": freed, "freed_bytes": freed_bytes}
+
+    def enable_incremental_vacuum(self):
+        """
+        turns on incremental vacuum for a database created before it was the default. this runs
+        a full VACUUM, which rewrites the whole file and blocks every writer while it does.
+        """
+        for shard in range(self.shards):
+            with self._get_conn(shard) as conn:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+
+    def take_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """
+        takes or renews the lease on a job for seconds, as a row of the settings table, so only
+        one of the workers sharing the database runs it. returns False while another holder's
+        lease hasn't run out.
+        """
+        now = time.time()
+        with self._get_conn() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                WHERE json_extract(settings.value, '$.holder') = ?
+                    OR json_extract(settings.value, '$.expires_at') < ?
+                """, (f"lease:{name}", json.dumps({"holder": holder, "expires_at": now + seconds}), holder, now)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, name: str, holder: str):
+        """
+        gives a lease back, if holder still has it, so another worker can take it right away
+        """
+        with self._get_conn() as conn:
+            conn.execute(
+                "DELETE FROM settings WHERE key = ? AND json_extract(value, '$.holder') = ?",
+                (f"lease:{name}", holder)
+            )
+
+    #---------------------#
+    ### export and import ###
+    #---------------------#
+
+    def iter_export_rows(
+            self,
+            user_name: str | None = None,
+            since: int | None = None,
+            until: int | None = None,
+            batch_size: int = 1000,
+            ):
+        """
+        yields a (chat, message) pair for every message matching the filters, chat by chat and
+        oldest message first. chat is (id, user name, slug, created_at, updated_at) and message
+        is (id, message as a dict, documents, created_at), decompressed. since and until bound the
+        messages' created_at, from since up to but not including until.
+
+        the rows are read batch_size at a time on a connection of the export's own, so memory
+        use stays flat however many messages there are.
+        """
+        # the users are in the first shard and the chats in theirs, so names are matched up here
+        user_names = dict(self.get_users())
+        chats_query = "SELECT id, user_id, slug, created_at, updated_at FROM chats"
+        chats_params: list = []
+        shards = range(self.shards)
+        if user_name is not None:
+            user_id = self.check_user(user_name=user_name)
+            if user_id is None:
+                return
+            chats_query += " WHERE user_id = ?"
+            chats_params.append(user_id)
+            shards = [self.shard_of(user_id)]
+        chats_query += " ORDER BY id"
+
+        messages_query = f"SELECT {MESSAGE_COLUMNS}, documents, id, created_at FROM messages WHERE chat_id = ?"
+        bounds: list = []
+        if since is not None:
+            messages_query += " AND created_at >= ?"
+            bounds.append(since)
+        if until is not None:
+            messages_query += " AND created_at < ?"
+            bounds.append(until)
+        messages_query += " ORDER BY id"
+
+        for shard in shards:
+            with get_pool(self.configs, path=shard_path(self.configs.sqlite_path, shard)).dedicated() as conn:
+                chats = conn.execute(chats_query, chats_params)
+                while chat_rows := chats.fetchmany(batch_size):
+                    for chat_id, owner, *rest in chat_rows:
+                        if owner not in user_names:
+                            continue
+                        chat = (chat_id, user_names[owner], *rest)
+                        messages = conn.execute(messages_query, (chat_id, *bounds))
+                        while message_rows := messages.fetchmany(batch_size):
+                            for message, documents, message_id, created_at in self._messages(conn, message_rows):
+                                yield chat, (message_id, message, documents, created_at)
+
+    @observe("sqlite_write")
+    def import_batch(self, items: list[dict], chat_ids: dict[int, int]) -> None:
+        """
+        writes a batch of exported chats, documents and messages, in one transaction per shard.
+        chats get new ids, and their owners are created if they don't exist yet; chat_ids maps
+        each exported chat id to its new one, and is filled in as chats are added, so later
+        batches can use it.
+        """
+        owners: dict[str, int] = {}
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            for item in items:
+                if item["type"] != "chat" or item["user"] in owners:
+                    continue
+                cursor.execute(
+                    "INSERT OR IGNORE INTO users (user_name, created_at) VALUES (?, ?)",
+                    (item["user"], int(time.time()))
+                )
+                if cursor.rowcount:
+                    self._bump_read_model(cursor, USERS)
+                owners[item["user"]] = cursor.execute("SELECT id FROM users WHERE user_name = ?", (item["user"],)).fetchone()[0]
+
+        # chats and messages go to the shard of the chat's owner
+        new_chats = {item["id"]: self.shard_of(owners[item["user"]]) for item in items if item["type"] == "chat"}
+        by_shard: dict[int, list[dict]] = {}
+        for item in items:
+            if item["type"] == "chat":
+                shard = new_chats[item["id"]]
+            elif item["type"] == "message":
+                if item["chat_id"] in new_chats:
+                    shard = new_chats[item["chat_id"]]
+                elif item["chat_id"] in chat_ids:
+                    shard = self.shard_of(chat_ids[item["chat_id"]])
+                else:
+                    raise ValueError(f"Message {item['id']} comes before its chat {item['chat_id']}")
+            else:
+                continue
+            by_shard.setdefault(shard, []).append(item)
+
+        documents = {
+            (item["id"], content_hash(item["document"], item["metadata"])): item
+            for item in items if item["type"] == "document"
+            }
+        referenced: set[DocumentKey] = set()
+        for shard, shard_items in sorted(by_shard.items()):
+            referenced |= self._import_into_shard(shard, shard_items, owners=owners, chat_ids=chat_ids, documents=documents)
+        # documents only referred to by messages of a later batch wait in the first shard, and
+        # are copied from there to the shards that need them
+        waiting = [item for key, item in documents.items() if key not in referenced]
+        if waiting:
+            with self._get_conn() as conn:
+                store_documents(conn.cursor(), waiting, encode=self.blobs.encode)
+
+    def _import_into_shard(
+            self,
+            shard: int,
+            items: list[dict],
+            owners: dict[str, int],
+            chat_ids: dict[int, int],
+            documents: dict[DocumentKey, dict],
+            ) -> set[DocumentKey]:
+        """
+        writes a shard's part of an import batch, and returns the keys of the documents its
+        messages refer to
+        """
+        with self._get_conn(shard) as conn:
+            cursor = conn.cursor()
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+
+            chats = [item for item in items if item["type"] == "chat"]
+            for item, chat_id in zip(chats, next_ids(conn, "chats", shard=shard, shards=self.shards, count=len(chats))):
+                user_id = owners[item["user"]]
+                cursor.execute(
+                    "INSERT INTO chats (id, user_id, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, user_id, item["slug"], item["created_at"], item["updated_at"])
+                )
+                chat_ids[item["id"]] = chat_id
+                self._bump_read_model(cursor, chats_key(user_id))
+
+            # the ids are handed out here, so the inserts can go in one go and the search index
+            # still knows each message's id
+            messages = [item for item in items if item["type"] == "message"]
+            keys: set[DocumentKey] = set()
+            rows, index = [], []
+            for item, message_id in zip(messages, next_ids(conn, "messages", shard=shard, shards=self.shards, count=len(messages))):
+                chat_id = chat_ids[item["chat_id"]]
+                entries = item["documents"]
+                if entries and all(isinstance(entry, dict) for entry in entries):
+                    documents_blob = store_documents(cursor, entries, encode=self.blobs.encode)
+                else:
+                    documents_blob = json.dumps(entries) if entries else None
+                    keys |= document_keys(entries or [])
+                rows.append((message_id, chat_id, item["message"], self.blobs.encode(documents_blob), item["created_at"]))
+                index.append((message_id, chat_id, item["message"].get("role"), item["message"].get("content")))
+            self._import_documents(cursor, shard, keys=keys, documents=documents)
+            write_messages(cursor, rows, encode=self.blobs.encode)
+            index_messages(cursor, index)
+        return keys
+
+    def _import_documents(self, cursor, shard: int, keys: set[DocumentKey], documents: dict[DocumentKey, dict]):
+        """
+        stores the documents a shard's imported messages refer to and it doesn't have yet, taken
+        from the batch or, when an earlier batch left them in another shard, from there
+        """
+        missing = keys.difference(self.get_documents(sorted(keys), shard=shard))
+        found = [documents[key] for key in missing if key in documents]
+        missing.difference_update(documents)
+        for other in range(self.shards):
+            if not missing:
+                break
+            if other != shard:
+                stored = self.get_documents(sorted(missing), shard=other)
+                found.extend(stored.values())
+                missing.difference_update(stored)
+        store_documents(cursor, found, encode=self.blobs.encode)
 
     #---------------------#
     ### query operations ###
@@ -245,47 +715,350 @@ class DatabaseManager:
             rows = cursor.fetchall()
             return rows
 
-    def get_messages(self, chat_id: int) -> list[tuple[str, str | None]]:
+    def get_messages(
+            self, 
+            chat_id: int, 
+            limit: int | None = None, 
+            before_id: int | None = None, 
+            after_id: int | None = None,
+            ) -> list[tuple[dict, str | None, int]]:
         """
-        gets messages and documents from the SQLite messages table...
+        gets messages and documents from the SQLite messages table, oldest first, as
+        (message, documents, id) rows, the message as a dict Message.model_validate() takes.
+        before_id and after_id restrict the rows to message ids strictly inside that range,
+        and limit keeps only the most recent rows, so callers can load a chat one window at a time.
         """
-        with self._get_conn() as conn:
+        query = f"""
+            SELECT {MESSAGE_COLUMNS}, documents, id
+            FROM messages
+            WHERE chat_id = ?
+            """
+        params: list = [chat_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        if after_id is not None:
+            query += " AND id > ?"
+            params.append(after_id)
+        # message ids only ever grow, so they order a chat on their own and make a stable cursor
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+
+            rows = cursor.fetchall()[::-1]
+
+            # add error handling/logging here
+            if not rows:
+                return None  # no chat with that ID
+            return self._messages(conn, rows)
+
+    def get_message_texts(self, chat_id: int, after_id: int = 0, before_id: int | None = None) -> list[tuple[str, str | None]]:
+        """
+        the (role, content) of a chat's messages, oldest first, for readers that need nothing
+        else. after_id and before_id work as in get_messages().
+        """
+        query = "SELECT role, content FROM messages WHERE chat_id = ? AND id > ?"
+        params: list = [chat_id, after_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id"
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            return [(role, self.blobs.decode(content)) for role, content in conn.execute(query, params)]
+
+    def _messages(self, conn, rows: list[tuple]) -> list[tuple]:
+        """
+        (role, content, tool_call_id, extra, documents, id, ...) rows as (message, documents, id, ...),
+        the message put back together as a dict with its tool calls, and the compressed values
+        decompressed
+        """
+        tool_calls = load_tool_calls(conn, [row[5] for row in rows if row[0] == "assistant"])
+        return [
+            (
+                message_dict(role, self.blobs.decode(content), tool_call_id, extra, tool_calls.get(message_id)),
+                self.blobs.decode(documents),
+                message_id,
+                *rest,
+            )
+            for role, content, tool_call_id, extra, documents, message_id, *rest in rows
+            ]
+    
+    def search_messages(
+            self,
+            user_id: int,
+            text: str,
+            limit: int = 20,
+            after: tuple[float, int] | None = None,
+            ) -> list[tuple[int, int, str | None, str, str, float]]:
+        """
+        full-text search over a user's messages, best match first, as
+        (message id, chat id, chat slug, role, snippet, rank) rows. the matched words in the
+        snippet are wrapped in **. to get the next page, pass the (rank, message id) of the last
+        row as after.
+        """
+        query = match_query(text, owner=user_id)
+        if query is None:
+            return []
+        page = "AND (messages_fts.rank, messages_fts.rowid) > (?, ?)" if after else ""
+        with self._get_conn(self.shard_of(user_id)) as conn:
             cursor = conn.cursor()
             cursor.execute(
-                """
-                SELECT message, documents
+                f"""
+                SELECT
+                    messages_fts.rowid,
+                    chats.id,
+                    chats.slug,
+                    messages_fts.role,
+                    snippet(messages_fts, 0, '**', '**', '...', {SNIPPET_TOKENS}),
+                    messages_fts.rank
+                FROM messages_fts
+                JOIN chats ON chats.id = messages_fts.chat_id
+                WHERE messages_fts MATCH ? {page}
+                ORDER BY messages_fts.rank, messages_fts.rowid
+                LIMIT ?
+                """,
+                (query, *(after or ()), limit)
+            )
+            return cursor.fetchall()
+
+    def get_rendered(self, message_ids: list[int], version: str) -> dict[int, str]:
+        """
+        returns the cached HTML of the given messages, keyed by message id, leaving out
+        messages that have none or were rendered by a different version of the template
+        """
+        rendered = {}
+        for shard, shard_ids in self._by_shard(message_ids).items():
+            with self._get_conn(shard) as conn:
+                cursor = conn.cursor()
+                # stays well under SQLite's limit on the number of query parameters
+                for start in range(0, len(shard_ids), 500):
+                    batch = shard_ids[start:start + 500]
+                    placeholders = ", ".join("?" for _ in batch)
+                    cursor.execute(
+                        f"""
+                        SELECT id, rendered_html
+                        FROM messages
+                        WHERE id IN ({placeholders}) AND rendered_version = ?
+                        """,
+                        (*batch, version)
+                    )
+                    rendered.update(cursor.fetchall())
+        return rendered
+
+    def _by_shard(self, ids) -> dict[int, list[int]]:
+        groups: dict[int, list[int]] = {}
+        for id in ids:
+            groups.setdefault(self.shard_of(id), []).append(id)
+        return groups
+
+    def get_documents(self, keys: list[DocumentKey], shard: int = 0) -> dict[DocumentKey, dict]:
+        """
+        looks up stored documents by (chroma_id, content_hash), returning them as
+        {"id", "document", "metadata"} dicts keyed the same way. unknown keys are left out.
+        documents are stored in the shard of the messages that refer to them.
+        """
+        documents = {}
+        with self._get_conn(shard) as conn:
+            cursor = conn.cursor()
+            # two parameters a key, so 250 keys stay well under SQLite's limit
+            for start in range(0, len(keys), 250):
+                batch = keys[start:start + 250]
+                placeholders = ", ".join("(?, ?)" for _ in batch)
+                cursor.execute(
+                    f"""
+                    SELECT chroma_id, content_hash, document, metadata
+                    FROM documents
+                    WHERE (chroma_id, content_hash) IN (VALUES {placeholders})
+                    """,
+                    [value for key in batch for value in key]
+                )
+                for chroma_id, digest, document, metadata in cursor.fetchall():
+                    documents[(chroma_id, digest)] = {
+                        "id": chroma_id,
+                        "document": self.blobs.decode(document),
+                        "metadata": json.loads(metadata),
+                        }
+        return documents
+
+    @observe("sqlite_write")
+    def save_rendered(self, rendered: dict[int, str], version: str):
+        """
+        stores the HTML rendered for each message id, in one transaction per shard
+        """
+        for shard, message_ids in self._by_shard(rendered).items():
+            with self._get_conn(shard) as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    """
+                    UPDATE messages
+                    SET rendered_html = ?, rendered_version = ?
+                    WHERE id = ?
+                    """,
+                    [(rendered[message_id], version, message_id) for message_id in message_ids]
+                )
+                conn.commit()
+
+    def get_first_message(self, chat_id: int) -> tuple[dict, str | None, int] | None:
+        """
+        gets the first message of a chat, i.e. its system prompt
+        """
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT {MESSAGE_COLUMNS}, documents, id
                 FROM messages
                 WHERE chat_id = ?
-                ORDER BY created_at ASC
+                ORDER BY id ASC
+                LIMIT 1
                 """,
                 (chat_id,)
             )
+            row = cursor.fetchone()
+            return self._messages(conn, [row])[0] if row else None
 
-            rows = cursor.fetchall()
+    def get_summary(self, chat_id: int) -> tuple[int, str] | None:
+        """
+        gets the rolling summary of a chat as (up_to_message_id, summary)
+        """
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT up_to_message_id, summary
+                FROM summaries
+                WHERE chat_id = ?
+                """,
+                (chat_id,)
+            )
+            return cursor.fetchone()
 
-            # add error handling/logging here
-            if not rows:
-                return None  # no chat with that ID
-        return rows
+    def get_chats(
+            self, 
+            user_id: int, 
+            limit: int = 20, 
+            before: tuple[int, int] | None = None,
+            ) -> list[tuple[int, str, int]]:
+        """
+        gets a page of a user's chats as (id, slug, updated_at) rows, most recently updated first.
+        before is the (updated_at, id) of the last chat on the previous page; the next page
+        starts right after it, so every page costs the same however many chats there are.
+        """
+        query = """
+            SELECT id, slug, updated_at
+            FROM chats
+            WHERE user_id = ?
+            """
+        params: list = [user_id]
+        if before is not None:
+            query += " AND (updated_at, id) < (?, ?)"
+            params.extend(before)
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._get_conn(self.shard_of(user_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+
+            return cursor.fetchall()
     
-    def get_chats(self, user_id: int) -> list[tuple[int, str]]:
-        with self._get_conn() as conn:
+    def get_chat(self, chat_id: int) -> tuple[int, int, str | None, int, int | None] | None:
+        """
+        returns (id, user_id, slug, created_at, updated_at) for a chat, or None if there is no such chat
+        """
+        with self._get_conn(self.shard_of(chat_id)) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                SELECT id, slug
+                SELECT id, user_id, slug, created_at, updated_at
+                FROM chats
+                WHERE id = ?
+                """,
+                (chat_id,)
+            )
+
+            return cursor.fetchone()
+
+    def get_chat_version(self, chat_id: int) -> tuple[int, int | None, int | None] | None:
+        """
+        returns (user_id, updated_at, id of the latest message) for a chat, or None if there is no such chat.
+        updated_at and the latest message id change whenever the chat does, so pages can be cached against them.
+        """
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT
+                    user_id,
+                    COALESCE(updated_at, created_at),
+                    (SELECT MAX(id) FROM messages WHERE chat_id = chats.id)
+                FROM chats
+                WHERE id = ?
+                """,
+                (chat_id,)
+            )
+
+            return cursor.fetchone()
+
+    def get_chats_version(self, user_id: int) -> tuple[int, int | None]:
+        """
+        returns (number of chats, latest updated_at) for a user's chats
+        """
+        with self._get_conn(self.shard_of(user_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT COUNT(*), MAX(updated_at)
                 FROM chats
                 WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 20 
                 """,
                 (user_id,)
             )
 
-            return cursor.fetchall()
-    
-    def get_slug(self, chat_id: int) -> str:
+            return cursor.fetchone()
+
+    def get_users_version(self) -> tuple[int, int | None]:
+        """
+        returns (number of users, latest user id), which changes whenever a user is added
+        """
         with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*), MAX(id) FROM users")
+            return cursor.fetchone()
+
+    def get_read_model_version(self, key: str, shard: int = 0) -> int:
+        """
+        the counter a read model is cached against, 0 until the first write that changes it.
+        the counter of a user's chats is in the user's shard.
+        """
+        with self._get_conn(shard) as conn:
+            row = conn.execute("SELECT version FROM read_model_versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def get_message(self, chat_id: int, message_id: int) -> tuple[dict, str | None, int] | None:
+        """
+        gets a single (message, documents, id) row from a chat
+        """
+        with self._get_conn(self.shard_of(chat_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT {MESSAGE_COLUMNS}, documents, id
+                FROM messages
+                WHERE chat_id = ? AND id = ?
+                """,
+                (chat_id, message_id)
+            )
+            row = cursor.fetchone()
+            return self._messages(conn, [row])[0] if row else None
+
+    def get_slug(self, chat_id: int) -> str:
+        with self._get_conn(self.shard_of(chat_id)) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -0,0 +1,61 @@
+import hashlib, json, time
+from collections.abc import Callable
+
+# The documents retrieved for a message are stored once each in the documents table, keyed by
+# their Chroma id and a hash of their content, and the message's documents column only holds
+# the keys: [["<chroma id>", "<hash>"], ...]. A document that changes in Chroma gets a new hash,
+# so older chats still show what they were answered from.
+#
+# Messages written before the documents table existed hold the documents themselves, as
+# {"id", "document", "metadata"} objects; readers accept both.
+
+DocumentKey = tuple[str, str]
+
+
+def content_hash(document: str, metadata: dict) -> str:
+    canonical = json.dumps({"document": document, "metadata": metadata}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def store_documents(cursor, documents: list[dict], encode: Callable | None = None) -> str | None:
+    """
+    adds the documents that aren't stored yet to the documents table, and returns the keys to
+    put in the message's documents column. encode, if given, is applied to the document text.
+    """
+    if not documents:
+        return None
+    created_at = int(time.time())
+    rows, keys = [], []
+    for document in documents:
+        key = (document["id"], content_hash(document["document"], document["metadata"]))
+        keys.append(key)
+        text = encode(document["document"]) if encode else document["document"]
+        rows.append((*key, text, json.dumps(document["metadata"]), created_at))
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO documents (chroma_id, content_hash, document, metadata, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """, rows
+    )
+    return json.dumps(keys)
+
+
+def document_keys(entries: list) -> set[DocumentKey]:
+    """
+    the keys among the entries of a documents column, leaving out documents stored inline
+    """
+    return {tuple(entry) for entry in entries if not isinstance(entry, dict)}
+
+
+def hydrate(entries: list, stored: dict[DocumentKey, dict]) -> list[dict]:
+    """
+    swaps the keys among the entries of a documents column for the documents themselves.
+    a key with no stored document is left out.
+    """
+    documents = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            documents.append(entry)
+        elif tuple(entry) in stored:
+            documents.append(stored[tuple(entry)])
+    return documents
@@ -1,11 +1,27 @@
 import requests, time
+import httpx
 from rag_app.app.core.config import Configurations
+from rag_app.app.core.metrics import observe
 from rag_app.app.models import ChromaDbResult, RerankItem, RerankResponse
 
 class EmbeddingsClient:
     def __init__(self, configs: Configurations):
         self.configs = configs
         self.logger = configs.logger
+        self._async_client: httpx.AsyncClient | None = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        one AsyncClient per EmbeddingsClient, so its connection pool is shared by every request
+        """
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.configs.embeddings_url, timeout=20)
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
 
     def embed(self, text: str) -> list[float]:
         """
@@ -15,11 +31,12 @@ class EmbeddingsClient:
 
         url = f"{self.configs.embeddings_url}/embeddings"
 
-        resp = requests.post(
-            url,
-            json={"text": text},
-            timeout=20
-        )
+        with observe("embed"):
+            resp = requests.post(
+                url,
+                json={"text": text},
+                timeout=20
+            )
         resp.raise_for_status()
 
         data = resp.json()
@@ -47,6 +64,21 @@ class EmbeddingsClient:
         self.logger.debug(f"Embedding returned by embeddings.embed: {embedding}")
         return embedding
 
+    async def aembed(self, text: str) -> list[float]:
+        """
+        async version of embed()
+        """
+        start = time.time()
+        with observe("embed"):
+            resp = await self._get_async_client().post("/embeddings", json={"text": text})
+        resp.raise_for_status()
+        embedding = resp.json().get("embedding", [])
+
+        self.logger.info("Successfully fetched embedding.")
+        self.logger.info(f"RESPONSE TIME: {time.time() - start:.3f}s")
+        self.logger.info(f"EMBED FETCH STATUS: {resp.status_code}")
+        return embedding
+
     def _build_rerank_payload(self, query_text: str, results: list[ChromaDbResult]) -> dict:
         items = [ {"id": r.id, "text": r.document} for r in results ]
         return {
@@ -76,11 +108,12 @@ class EmbeddingsClient:
         endpoint = f"{self.configs.embeddings_url}/reranking"
         start = time.time()
         request_payload = self._build_rerank_payload(query_text, results)
-        resp = requests.post(
-            endpoint, 
-            json=request_payload, 
-            timeout=20
-        )
+        with observe("rerank"):
+            resp = requests.post(
+                endpoint, 
+                json=request_payload, 
+                timeout=20
+            )
 
         logger.info("Successfully reranked.")
         logger.info(f"RESPONSE TIME: {time.time() - start:.3f}s")
@@ -93,3 +126,26 @@ class EmbeddingsClient:
             results=data["results"],
         )
 
+    async def arerank(
+        self,
+        query_text: str, 
+        results: list[ChromaDbResult],
+        ) -> RerankResponse:
+        """
+        async version of rerank()
+        """
+        start = time.time()
+        request_payload = self._build_rerank_payload(query_text, results)
+        with observe("rerank"):
+            resp = await self._get_async_client().post("/reranking", json=request_payload)
+
+        self.logger.info("Successfully reranked.")
+        self.logger.info(f"RESPONSE TIME: {time.time() - start:.3f}s")
+        self.logger.info(f"RERANK STATUS: {resp.status_code}")
+
+        data = resp.json()
+
+        return RerankResponse(
+            query=query_text,
+            results=data["results"],
+        )
@@ -1,12 +1,14 @@
-import time
-from collections.abc import Iterator
-from litellm import completion, RateLimitError, APIError
+import asyncio, time
+from collections.abc import AsyncIterator, Iterator
+from litellm import acompletion, completion, RateLimitError, APIError
 from rag_app.app.core.config import Configurations
 from rag_app.app.models import Tool, Message, Parameters, MessageDocuments
 from rag_app.app.core.errors import LlmCallFailedError
+from rag_app.app.core.metrics import ERRORS, RETRIES
 from requests.exceptions import ConnectionError
 
 TRANSIENT_ERRORS = (ConnectionError, TimeoutError)
+MAX_RETRIES = 5
 
 class LlmClient:
     def __init__(
@@ -23,17 +25,10 @@ class LlmClient:
 
         start = time.time()
         self.logger.info(f"Sending streaming request to {self.configs.model}...")
-        messages = [obj.message for obj in messages]
-
-        params = Parameters(
-            model=self.configs.model,
-            messages=messages,
-            tools=tools if tools is not None else None,
-            stream=True,
-        )
+        params = self._params(messages=messages, tools=tools, stream=True)
 
         try:
-            stream = completion(**params.model_dump(exclude_none=True))
+            stream = completion(**params)
 
             for chunk in stream:
                 yield chunk
@@ -43,6 +38,7 @@ class LlmClient:
             )
 
         except Exception as e:
+            ERRORS.labels(component="llm").inc()
             self.logger.error(f"Streaming LLM error: {e}")
             raise LlmCallFailedError("Streaming LLM error") from e
 
@@ -56,67 +52,141 @@ class LlmClient:
         start = time.time()
         self.logger.info(f"Sending request to {self.configs.model}...")
 
-        messages = [obj.message for obj in messages]
-        max_retries = 5
+        params = self._params(messages=messages, tools=tools)
         backoff = 2
 
-        for attempt in range(1, max_retries+1):
+        for attempt in range(1, MAX_RETRIES+1):
             try:
-                params = Parameters(
-                        model=self.configs.model, 
-                        messages=messages,
-                        tools=tools if tools is not None else None,
-                        )
-                response = completion(**params.model_dump(exclude_none=True))
+                response = completion(**params)
                 self.logger.info(f"Successfully queried {self.configs.model}.")
                 self.logger.info(f"RESPONSE TIME: {time.time() - start:.3f}s")
                 return response
-            
-            except RateLimitError as e:
-                if attempt == max_retries:
-                    self.logger.error(f"Rate limit persisted after {attempt} attempts: {e}")
-                    raise LlmCallFailedError("Rate-limit exhaustion") from e
-                self.logger.warning(
-                    f"Rate limited. Attempt {attempt}/{max_retries}. "
-                    f"Retrying in {backoff}s..."
-                )
+            except Exception as e:
+                self._check_retry(e, attempt=attempt, backoff=backoff)
                 time.sleep(backoff)
                 backoff = min(backoff * 2, 30)
 
-            except APIError as e:
-                if getattr(e, "status_code", None) in (500, 502, 503, 504):
-                    if attempt == max_retries:
-                        self.logger.error(f"Server error {e.status_code} after retries: {e}")
-                        raise LlmCallFailedError("Server error retries exhausted") from e
+    async def asend_request(
+            self, 
+            messages: list[MessageDocuments],
+            tools: list[Tool] | None = None
+        ) -> Message:
+        """
+        async version of send_request(), for the web app: the retries back off with
+        asyncio.sleep so other requests keep being served while this one waits
+        """
+        start = time.time()
+        self.logger.info(f"Sending request to {self.configs.model}...")
 
-                    self.logger.warning(
-                        f"Server error {e.status_code}. Attempt {attempt}/{max_retries}. "
-                        f"Retrying in {backoff}s..."
-                    )
-                    time.sleep(backoff)
-                    backoff = min(backoff * 2, 30)
-                    continue
+        params = self._params(messages=messages, tools=tools)
+        backoff = 2
 
-                self.logger.error(f"Unrecoverable API error: {e}")
-                raise LlmCallFailedError("Unrecoverable API error") from e
+        for attempt in range(1, MAX_RETRIES+1):
+            try:
+                response = await acompletion(**params)
+                self.logger.info(f"Successfully queried {self.configs.model}.")
+                self.logger.info(f"RESPONSE TIME: {time.time() - start:.3f}s")
+                return response
+            except Exception as e:
+                self._check_retry(e, attempt=attempt, backoff=backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    async def asend_request_stream(
+            self, 
+            messages: list[MessageDocuments],
+            tools: list[Tool] | None = None
+        ) -> AsyncIterator[dict]:
+
+        start = time.time()
+        self.logger.info(f"Sending streaming request to {self.configs.model}...")
+        params = self._params(messages=messages, tools=tools, stream=True)
 
-            except TRANSIENT_ERRORS as e:
-                if attempt == max_retries:
-                    self.logger.error(f"Network error after {attempt} attempts: {e}")
-                    raise LlmCallFailedError("Network retries exhausted") from e
+        try:
+            stream = await acompletion(**params)
+
+            async for chunk in stream:
+                yield chunk
+
+            self.logger.info(
+                f"Streaming completed in {time.time() - start:.3f}s"
+            )
+
+        except Exception as e:
+            ERRORS.labels(component="llm").inc()
+            self.logger.error(f"Streaming LLM error: {e}")
+            raise LlmCallFailedError("Streaming LLM error") from e
+
+    def _params(
+            self, 
+            messages: list[MessageDocuments], 
+            tools: list[Tool] | None = None, 
+            stream: bool = False,
+        ) -> dict:
+        params = Parameters(
+                model=self.configs.model, 
+                messages=[obj.message for obj in messages],
+                tools=tools if tools is not None else None,
+                stream=stream,
+                )
+        return params.model_dump(exclude_none=True)
+
+    def _check_retry(self, e: Exception, attempt: int, backoff: float):
+        """
+        decides what to do about an exception raised by a completion call.
+        returns if the call should be retried after `backoff` seconds, raises LlmCallFailedError if not.
+        """
+        try:
+            cause = self._retry_cause(e, attempt=attempt, backoff=backoff)
+        except LlmCallFailedError:
+            ERRORS.labels(component="llm").inc()
+            raise
+        RETRIES.labels(cause=cause).inc()
+
+    def _retry_cause(self, e: Exception, attempt: int, backoff: float) -> str:
+        """
+        logs the exception and returns the cause of the retry, or raises LlmCallFailedError if there is none
+        """
+        if isinstance(e, RateLimitError):
+            if attempt == MAX_RETRIES:
+                self.logger.error(f"Rate limit persisted after {attempt} attempts: {e}")
+                raise LlmCallFailedError("Rate-limit exhaustion") from e
+            self.logger.warning(
+                f"Rate limited. Attempt {attempt}/{MAX_RETRIES}. "
+                f"Retrying in {backoff}s..."
+            )
+            return "rate_limit"
+
+        elif isinstance(e, APIError):
+            if getattr(e, "status_code", None) in (500, 502, 503, 504):
+                if attempt == MAX_RETRIES:
+                    self.logger.error(f"Server error {e.status_code} after retries: {e}")
+                    raise LlmCallFailedError("Server error retries exhausted") from e
 
                 self.logger.warning(
-                    f"Transient network error. Attempt {attempt}/{max_retries}. "
+                    f"Server error {e.status_code}. Attempt {attempt}/{MAX_RETRIES}. "
                     f"Retrying in {backoff}s..."
                 )
-                time.sleep(backoff)
-                backoff = min(backoff * 2, 30)
- 
-            except Exception as e:
-                self.logger.error(f"Unrecoverable LLM error: {e}")
-                raise LlmCallFailedError("Unrecoverable LLM error") from e
+                return "server_error"
+            else:
+                self.logger.error(f"Unrecoverable API error: {e}")
+                raise LlmCallFailedError("Unrecoverable API error") from e
+
+        elif isinstance(e, TRANSIENT_ERRORS):
+            if attempt == MAX_RETRIES:
+                self.logger.error(f"Network error after {attempt} attempts: {e}")
+                raise LlmCallFailedError("Network retries exhausted") from e
+
+            self.logger.warning(
+                f"Transient network error. Attempt {attempt}/{MAX_RETRIES}. "
+                f"Retrying in {backoff}s..."
+            )
+            return "network"
+
+        else:
+            self.logger.error(f"Unrecoverable LLM error: {e}")
+            raise LlmCallFailedError("Unrecoverable LLM error") from e
 
-    
     def get_messsage(self, response):
         lite_msg = response.choices[0].message
         return Message.model_validate(lite_msg.model_dump())
\ No newline at end of file
@@ -0,0 +1,90 @@
+import json
+from collections.abc import Callable
+
+# Messages are stored as columns rather than one JSON blob: role, content (compressed like any
+# other large value), tool_call_id, and extra, a JSON object holding the rarer fields the
+# message had set, such as function_call or provider_specific_fields, or NULL. The tool calls of
+# an assistant message are rows of the tool_calls table, in order. Readers select the columns
+# they need, and a message only goes back to being a dict when all of it is asked for.
+
+MESSAGE_COLUMNS = "role, content, tool_call_id, extra"
+_COLUMN_FIELDS = ("role", "content", "tool_call_id", "tool_calls")
+
+
+def message_columns(message: dict, encode: Callable | None = None) -> tuple[tuple, list[tuple]]:
+    """
+    splits a message, as Message.model_dump() has it, into the values of MESSAGE_COLUMNS and
+    its tool calls as (position, id, type, name, arguments) rows. encode, if given, is applied
+    to the content.
+    """
+    extra = {key: value for key, value in message.items() if key not in _COLUMN_FIELDS and value is not None}
+    content = message.get("content")
+    tool_calls = [
+        (position, call["id"], call.get("type"), call["function"].get("name"), call["function"].get("arguments"))
+        for position, call in enumerate(message.get("tool_calls") or [])
+        ]
+    columns = (
+        message["role"],
+        encode(content) if encode else content,
+        message.get("tool_call_id"),
+        json.dumps(extra) if extra else None,
+        )
+    return columns, tool_calls
+
+
+def write_messages(cursor, rows: list[tuple[int, int, dict, str | bytes | None, int]], encode: Callable | None = None):
+    """
+    inserts (id, chat id, message, documents, created_at) rows, the message as a dict, and
+    their tool calls
+    """
+    values, calls = [], []
+    for message_id, chat_id, message, documents, created_at in rows:
+        columns, tool_calls = message_columns(message, encode=encode)
+        values.append((message_id, chat_id, *columns, documents, created_at))
+        calls.extend((message_id, *call) for call in tool_calls)
+    cursor.executemany(
+        f"""
+        INSERT INTO messages (id, chat_id, {MESSAGE_COLUMNS}, documents, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, values
+    )
+    cursor.executemany(
+        """
+        INSERT INTO tool_calls (message_id, position, id, type, name, arguments)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, calls
+    )
+
+
+def load_tool_calls(cursor, message_ids: list[int]) -> dict[int, list[dict]]:
+    """
+    the tool calls of the given messages, in order, keyed by message id. messages without any
+    are left out.
+    """
+    tool_calls: dict[int, list[dict]] = {}
+    # stays well under SQLite's limit on the number of query parameters
+    for start in range(0, len(message_ids), 500):
+        batch = message_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        for message_id, call_id, call_type, name, arguments in cursor.execute(
+            f"""
+            SELECT message_id, id, type, name, arguments
+            FROM tool_calls
+            WHERE message_id IN ({placeholders})
+            ORDER BY message_id, position
+            """, batch
+        ):
+            tool_calls.setdefault(message_id, []).append(
+                {"id": call_id, "type": call_type, "function": {"name": name, "arguments": arguments}}
+            )
+    return tool_calls
+
+
+def message_dict(role: str, content: str | None, tool_call_id: str | None, extra: str | None, tool_calls: list[dict] | None) -> dict:
+    """
+    puts a message stored as columns back together, the way Message.model_validate() takes it
+    """
+    message = {"role": role, "content": content, "tool_calls": tool_calls or None, "tool_call_id": tool_call_id}
+    if extra:
+        message.update(json.loads(extra))
+    return message
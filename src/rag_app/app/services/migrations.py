@@ -0,0 +1,338 @@
+import json, sqlite3
+from collections.abc import Callable
+from dataclasses import dataclass
+from rag_app.app.services.blobs import BlobCodec
+from rag_app.app.services.document_store import store_documents
+from rag_app.app.services.message_store import message_columns
+from rag_app.app.services.search_index import INDEXED_ROLES, index_messages, message_fields
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+def _baseline(conn: sqlite3.Connection):
+    """
+    the schema as it was before it had a version. it is written so it also runs on the databases
+    created back then, which are already (partly) there.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        user_name TEXT UNIQUE,
+        created_at INTEGER
+        )
+    """)
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        slug TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        FOREIGN KEY (user_id)
+            REFERENCES users(id)
+            ON DELETE CASCADE
+        )
+    """)
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        message TEXT,
+        documents TEXT,
+        created_at INTEGER,
+        FOREIGN KEY (chat_id)
+            REFERENCES chats(id)
+            ON DELETE CASCADE
+        )
+    """)
+    # one rolling summary per chat, covering every message up to and including up_to_message_id
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        chat_id INTEGER PRIMARY KEY,
+        up_to_message_id INTEGER,
+        summary TEXT,
+        created_at INTEGER,
+        FOREIGN KEY (chat_id)
+            REFERENCES chats(id)
+            ON DELETE CASCADE
+        )
+    """)
+    # each message's cached HTML, added after the first databases were made
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+    if "rendered_html" not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN rendered_html TEXT")
+    if "rendered_version" not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN rendered_version TEXT")
+    # chats from before updated_at was always set, so they sort and paginate like the rest
+    cursor.execute("UPDATE chats SET updated_at = created_at WHERE updated_at IS NULL")
+
+
+def _indexes(conn: sqlite3.Connection):
+    """
+    indexes for the ways the app reads its tables
+    """
+    cursor = conn.cursor()
+    # a chat's messages. the index carries the rowid (the message id) after chat_id, so
+    # ORDER BY id, the before/after cursors and MAX(id) are all answered from it without a sort
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id)")
+    # the sidebar: a user's chats newest first. it holds every column get_chats() reads, so the
+    # table itself is never touched
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats (user_id, updated_at, id, slug)")
+
+
+def _documents_table(conn: sqlite3.Connection):
+    """
+    stores each retrieved document once, and replaces the copies held by the messages with keys
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        chroma_id TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        document TEXT,
+        metadata TEXT,
+        created_at INTEGER,
+        PRIMARY KEY (chroma_id, content_hash)
+        )
+    """)
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT id, documents
+            FROM messages
+            WHERE id > ? AND documents IS NOT NULL
+            ORDER BY id
+            LIMIT 500
+            """, (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for message_id, blob in rows:
+            entries = json.loads(blob)
+            if entries and all(isinstance(entry, dict) for entry in entries):
+                updates.append((store_documents(cursor, entries), message_id))
+        cursor.executemany("UPDATE messages SET documents = ? WHERE id = ?", updates)
+        last_id = rows[-1][0]
+
+
+def _messages_fts(conn: sqlite3.Connection):
+    """
+    the full-text index over message content, filled from the messages already stored
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        chat_id UNINDEXED,
+        role UNINDEXED,
+        tokenize = 'porter unicode61',
+        -- the last word of a search is a prefix; these keep short prefixes fast
+        prefix = '2 3'
+        )
+    """)
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT id, chat_id, message
+            FROM messages
+            WHERE id > ?
+            ORDER BY id
+            LIMIT 500
+            """, (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        # the index as it was at this version, before it had an owner column
+        cursor.executemany(
+            "INSERT INTO messages_fts (rowid, content, chat_id, role) VALUES (?, ?, ?, ?)",
+            [
+                (message_id, content, chat_id, role)
+                for message_id, chat_id, message in rows
+                for role, content in [message_fields(BlobCodec.decode(message))]
+                if role in INDEXED_ROLES and content
+                ]
+        )
+        last_id = rows[-1][0]
+
+
+def _read_model_versions(conn: sqlite3.Connection):
+    """
+    a counter for each cached list, bumped by the writes that change it
+    """
+    conn.execute(
+    """
+    CREATE TABLE IF NOT EXISTS read_model_versions (
+        key TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+        )
+    """)
+
+
+def _settings(conn: sqlite3.Connection):
+    """
+    settings the database was set up with, which the app checks its configuration against
+    """
+    conn.execute(
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+        )
+    """)
+
+
+def _message_columns(conn: sqlite3.Connection):
+    """
+    splits each message's JSON into columns, moves its tool calls to a table of their own, and
+    drops the JSON
+    """
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+    for column in ("role", "content", "tool_call_id", "extra"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {column} TEXT")
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS tool_calls (
+        message_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        id TEXT,
+        type TEXT,
+        name TEXT,
+        arguments TEXT,
+        PRIMARY KEY (message_id, position)
+        ) WITHOUT ROWID
+    """)
+    if "message" not in columns:
+        return
+    codec = BlobCodec()
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT id, message
+            FROM messages
+            WHERE id > ?
+            ORDER BY id
+            LIMIT 500
+            """, (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        updates, calls = [], []
+        for message_id, blob in rows:
+            message = json.loads(BlobCodec.decode(blob) or "{}")
+            # content stays compressed if the message was
+            values, tool_calls = message_columns(
+                {"role": None, **message},
+                encode=codec.encode if isinstance(blob, bytes) else None,
+                )
+            updates.append((*values, message_id))
+            calls.extend((message_id, *call) for call in tool_calls)
+        cursor.executemany("UPDATE messages SET role = ?, content = ?, tool_call_id = ?, extra = ? WHERE id = ?", updates)
+        cursor.executemany(
+            "INSERT OR REPLACE INTO tool_calls (message_id, position, id, type, name, arguments) VALUES (?, ?, ?, ?, ?, ?)",
+            calls
+        )
+        last_id = rows[-1][0]
+    cursor.execute("ALTER TABLE messages DROP COLUMN message")
+
+
+def _messages_fts_owner(conn: sqlite3.Connection):
+    """
+    rebuilds the full-text index with the owner of each message, so searches match the user's
+    messages only
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS messages_fts")
+    cursor.execute(
+    """
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        content,
+        chat_id UNINDEXED,
+        role UNINDEXED,
+        owner,
+        tokenize = 'porter unicode61',
+        -- the last word of a search is a prefix; these keep short prefixes fast
+        prefix = '2 3'
+        )
+    """)
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT id, chat_id, role, content
+            FROM messages
+            WHERE id > ?
+            ORDER BY id
+            LIMIT 500
+            """, (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        index_messages(cursor, [
+            (message_id, chat_id, role, BlobCodec.decode(content))
+            for message_id, chat_id, role, content in rows
+            ])
+        last_id = rows[-1][0]
+
+
+MIGRATIONS = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(2, "indexes on messages.chat_id and chats.user_id", _indexes),
+    Migration(3, "content-addressed documents table", _documents_table),
+    Migration(4, "full-text index over messages", _messages_fts),
+    Migration(5, "version counters for the cached read models", _read_model_versions),
+    Migration(6, "settings table", _settings),
+    Migration(7, "messages as columns, with a tool_calls table", _message_columns),
+    Migration(8, "owner column in the full-text index", _messages_fts_owner),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, logger=None, migrations: list[Migration] = MIGRATIONS) -> int:
+    """
+    brings the database up to the latest schema version, applying the migrations it hasn't had
+    yet in order, and returns the version it ended on. the version is kept in PRAGMA user_version.
+
+    everything runs in one write transaction, so a migration that fails leaves the database as it
+    was, and workers starting at the same time wait for each other instead of both migrating.
+    """
+    latest = max((migration.version for migration in migrations), default=0)
+    if schema_version(conn) >= latest:
+        return latest
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # read once the write lock is held: another worker may have just migrated
+        current = schema_version(conn)
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+            if logger:
+                logger.info(f"Migrating the database to version {migration.version}: {migration.description}")
+            migration.apply(conn)
+            current = migration.version
+            conn.execute(f"PRAGMA user_version = {int(current)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return current
@@ -1,7 +1,8 @@
-import json
+import asyncio, json
 import chromadb
 from rag_app.app.core.config import Configurations
 from rag_app.app.core.errors import RagClientFailedError, MetadataFilterError
+from rag_app.app.core.metrics import ERRORS, observe
 from rag_app.app.models import ChromaDbResult, Message, MessageDocuments, RerankResponse
 from rag_app.app.services.embeddings import EmbeddingsClient
 
@@ -11,6 +12,12 @@ class RagClient:
         self.configs = configs
         self.emb_client = EmbeddingsClient(configs=configs)
         self.logger = configs.logger
+        self._chroma_client = None
+        self._collections = {}
+        self._async_chroma_client = None
+        self._async_collections = {}
+        # concurrent tool calls would otherwise each open a client of their own on the first query
+        self._async_lock = asyncio.Lock()
 
     def chroma_query(
             self, 
@@ -28,16 +35,33 @@ class RagClient:
             chroma_docs = self._query(query_embedding=vec_query, collection=collection)
             reranked = self.emb_client.rerank(query_text=query, results=chroma_docs)
             documents = self._filter_results(results=chroma_docs, reranked=reranked)
-            json_str = json.dumps([obj.model_dump() for obj in documents])
-            return MessageDocuments(
-                message=Message(
-                    role='tool', 
-                    tool_call_id=tool_call_id, 
-                    content=json_str
-                    ), 
-                documents=documents
-                )
+            return self._tool_message(documents=documents, tool_call_id=tool_call_id)
+        except Exception as e:
+            ERRORS.labels(component="rag").inc()
+            self.logger.error(f"Something went wrong with the RAG process: {e}")
+            raise RagClientFailedError("The RAG client failed while sending a query for vector embeddings") from e
+
+    async def achroma_query(
+            self, 
+            arguments: dict, 
+            collection: str, 
+            tool_call_id: str
+        ) -> MessageDocuments:
+        """
+        async version of chroma_query()
+        """
+        query = arguments.get("query_text", "")
+
+        try:
+            vec_query = await self.emb_client.aembed(text=query)
+            if not vec_query:
+                raise ValueError("Empty embedding")
+            chroma_docs = await self._aquery(query_embedding=vec_query, collection=collection)
+            reranked = await self.emb_client.arerank(query_text=query, results=chroma_docs)
+            documents = self._filter_results(results=chroma_docs, reranked=reranked)
+            return self._tool_message(documents=documents, tool_call_id=tool_call_id)
         except Exception as e:
+            ERRORS.labels(component="rag").inc()
             self.logger.error(f"Something went wrong with the RAG process: {e}")
             raise RagClientFailedError("The RAG client failed while sending a query for vector embeddings") from e
 
@@ -48,21 +72,55 @@ class RagClient:
             tool_call_id: str
         ) -> MessageDocuments:
         self.logger.debug(f"Arguments used to call chroma_get(): {arguments}")
-        try:
-            if "metadata_filter" not in arguments:
-                arguments = {"metadata_filter": arguments}
-            metadata_filter = self._validate_filter(arguments)
-        except (ValueError, TypeError) as e:
-            self.logger.error(f"Problem with the metadata filter: {e}")
-            raise MetadataFilterError(f"The metadata filter is invalid") from e
+        metadata_filter = self._parse_filter(arguments)
 
         try:
             documents = self._get(collection=collection, metadata_filter=metadata_filter)
-            json_str = json.dumps([obj.model_dump() for obj in documents])
-            return MessageDocuments(message=Message(role='tool', tool_call_id=tool_call_id, content=json_str), documents=documents)
+            return self._tool_message(documents=documents, tool_call_id=tool_call_id)
+        except Exception as e:
+            ERRORS.labels(component="rag").inc()
+            self.logger.error(f"Something went wrong with the RAG: {e}")
+            raise RagClientFailedError("The RAG client failed") from e
+
+    async def achroma_get(
+            self,
+            arguments: dict,
+            collection: str,
+            tool_call_id: str
+        ) -> MessageDocuments:
+        """
+        async version of chroma_get()
+        """
+        self.logger.debug(f"Arguments used to call achroma_get(): {arguments}")
+        metadata_filter = self._parse_filter(arguments)
+
+        try:
+            documents = await self._aget(collection=collection, metadata_filter=metadata_filter)
+            return self._tool_message(documents=documents, tool_call_id=tool_call_id)
         except Exception as e:
+            ERRORS.labels(component="rag").inc()
             self.logger.error(f"Something went wrong with the RAG: {e}")
             raise RagClientFailedError("The RAG client failed") from e
+
+    def _tool_message(self, documents: list[ChromaDbResult], tool_call_id: str) -> MessageDocuments:
+        json_str = json.dumps([obj.model_dump() for obj in documents])
+        return MessageDocuments(
+            message=Message(
+                role='tool', 
+                tool_call_id=tool_call_id, 
+                content=json_str
+                ), 
+            documents=documents
+            )
+
+    def _parse_filter(self, arguments: dict) -> dict:
+        try:
+            if "metadata_filter" not in arguments:
+                arguments = {"metadata_filter": arguments}
+            return self._validate_filter(arguments)
+        except (ValueError, TypeError) as e:
+            self.logger.error(f"Problem with the metadata filter: {e}")
+            raise MetadataFilterError(f"The metadata filter is invalid") from e
     
     def _validate_filter(self, arguments: dict):
         raw_metadata_filter = arguments.get("metadata_filter")
@@ -84,21 +142,32 @@ class RagClient:
 
         return metadata_filter
 
+    def _get_collection(self, name: str):
+        """
+        returns the Chroma collection, connecting to the server and fetching the collection
+        only the first time, so every query after that reuses the same client.
+        """
+        if name not in self._collections:
+            if self._chroma_client is None:
+                self._chroma_client = chromadb.HttpClient(
+                    host=self.configs.chromadb_host, 
+                    port=self.configs.chromadb_port
+                    )
+            self._collections[name] = self._chroma_client.get_collection(name=name)
+        return self._collections[name]
+
     def _query(
         self,
         query_embedding: list[float],
         collection: str, 
         ) -> list[ChromaDbResult]:
-        chroma_client = chromadb.HttpClient(
-            host=self.configs.chromadb_host, 
-            port=self.configs.chromadb_port
-            )
-        col = chroma_client.get_collection(name=collection)
-        raw = col.query(
-            query_embeddings=[query_embedding], 
-            n_results=self.configs.chroma_top_n,
-            include=["documents", "metadatas",]
-            )
+        col = self._get_collection(name=collection)
+        with observe("chroma_query"):
+            raw = col.query(
+                query_embeddings=[query_embedding], 
+                n_results=self.configs.chroma_top_n,
+                include=["documents", "metadatas",]
+                )
         return self._format_query_result(raw)
     
     def _get(
@@ -106,15 +175,54 @@ class RagClient:
         metadata_filter: dict,
         collection: str, 
         ) -> list[ChromaDbResult]:
-        chroma_client = chromadb.HttpClient(
-            host=self.configs.chromadb_host, 
-            port=self.configs.chromadb_port
-            )
-        col = chroma_client.get_collection(name=collection)
-        raw = col.get(
-            where=metadata_filter,
-            include=["documents", "metadatas",]
-            )
+        col = self._get_collection(name=collection)
+        with observe("chroma_get"):
+            raw = col.get(
+                where=metadata_filter,
+                include=["documents", "metadatas",]
+                )
+        return self._format_get_result(raw)
+
+    async def _aget_collection(self, name: str):
+        """
+        async version of _get_collection()
+        """
+        if name not in self._async_collections:
+            async with self._async_lock:
+                if self._async_chroma_client is None:
+                    self._async_chroma_client = await chromadb.AsyncHttpClient(
+                        host=self.configs.chromadb_host,
+                        port=self.configs.chromadb_port
+                        )
+                if name not in self._async_collections:
+                    self._async_collections[name] = await self._async_chroma_client.get_collection(name=name)
+        return self._async_collections[name]
+
+    async def _aquery(
+        self,
+        query_embedding: list[float],
+        collection: str, 
+        ) -> list[ChromaDbResult]:
+        col = await self._aget_collection(name=collection)
+        with observe("chroma_query"):
+            raw = await col.query(
+                query_embeddings=[query_embedding], 
+                n_results=self.configs.chroma_top_n,
+                include=["documents", "metadatas",]
+                )
+        return self._format_query_result(raw)
+
+    async def _aget(
+        self,
+        metadata_filter: dict,
+        collection: str, 
+        ) -> list[ChromaDbResult]:
+        col = await self._aget_collection(name=collection)
+        with observe("chroma_get"):
+            raw = await col.get(
+                where=metadata_filter,
+                include=["documents", "metadatas",]
+                )
         return self._format_get_result(raw)
 
     def _format_query_result(self, raw: dict) -> list[ChromaDbResult]:
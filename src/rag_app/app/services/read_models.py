@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rag_app.app.services.db_manager import DatabaseManager   # type-checking only, no runtime import
+
+USERS = "users"
+
+
+def chats_key(user_id: int) -> str:
+    return f"chats:{user_id}"
+
+
+class ReadModelCache:
+    """
+    Keeps the small, read-mostly lists every page shows in memory: the user list, and the first
+    page of each user's chat list with its (count, latest updated_at) version.
+
+    Each list has a counter in the read_model_versions table, which the DatabaseManager bumps
+    in the same transaction as any write that changes the list. A read costs one lookup of the
+    counters instead of the queries behind the list, and since the counters live in the
+    database, a write made by another worker is seen as soon as it is committed.
+
+    User ids are cached for good once found, since users are never renamed or deleted.
+    """
+
+    def __init__(self, db: "DatabaseManager", max_entries: int = 1000):
+        self.db = db
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[int, object]] = OrderedDict()
+        self._user_ids: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def user_id(self, user_name: str) -> int | None:
+        user_id = self._user_ids.get(user_name)
+        if user_id is None:
+            user_id = self.db.check_user(user_name=user_name)
+            if user_id is not None:
+                self._user_ids[user_name] = user_id
+        return user_id
+
+    def users(self) -> tuple[tuple[int, int | None], list[tuple[int, str]]]:
+        """
+        returns the users version, as get_users_version() has it, and the (id, user_name) rows
+        """
+        return self._get(USERS, lambda: (self.db.get_users_version(), self.db.get_users()))
+
+    def chats(self, user_id: int) -> tuple[tuple[int, int | None], list[tuple[int, str, int]]]:
+        """
+        returns the version of the user's chats, as get_chats_version() has it, and the first
+        page of the sidebar: chats_page_size (id, slug, updated_at) rows, plus one more if
+        there is another page
+        """
+        limit = self.db.configs.chats_page_size + 1
+        return self._get(
+            chats_key(user_id),
+            lambda: (self.db.get_chats_version(user_id=user_id), self.db.get_chats(user_id=user_id, limit=limit)),
+            shard=self.db.shard_of(user_id),
+            )
+
+    def _get(self, key: str, load, shard: int = 0):
+        current = self.db.get_read_model_version(key, shard=shard)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == current:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        # loaded outside the lock; a write landing in between only bumps the counter again,
+        # so the next read reloads
+        value = load()
+        with self._lock:
+            self._entries[key] = (current, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
@@ -0,0 +1,129 @@
+import json, sqlite3, threading, time, uuid, zlib
+
+
+class ChatArchive:
+    """
+    A separate SQLite database holding the chats moved out of the main one, each as a single
+    zlib-compressed JSON document with its messages and summary. Chats keep their ids, so they
+    go back where they were when restored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, uri=True, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archived_chats (
+                chat_id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                slug TEXT,
+                updated_at INTEGER,
+                archived_at INTEGER,
+                payload BLOB
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_user ON archived_chats (user_id, updated_at)")
+
+    def put(self, chat: tuple, messages: list[tuple], summary: tuple | None) -> int:
+        """
+        stores a chat, replacing any earlier copy, and returns the size of its compressed payload
+        """
+        chat_id, user_id, slug, _, updated_at = chat
+        payload = zlib.compress(json.dumps({"chat": chat, "messages": messages, "summary": summary}).encode(), level=9)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO archived_chats (chat_id, user_id, slug, updated_at, archived_at, payload)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, (chat_id, user_id, slug, updated_at, int(time.time()), payload)
+            )
+        return len(payload)
+
+    def get(self, chat_id: int) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM archived_chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def delete(self, chat_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM archived_chats WHERE chat_id = ?", (chat_id,))
+
+    def list_chats(self, user_id: int) -> list[tuple[int, str | None, int]]:
+        """
+        a user's archived chats as (id, slug, updated_at) rows, most recently updated first
+        """
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT chat_id, slug, updated_at
+                FROM archived_chats
+                WHERE user_id = ?
+                ORDER BY updated_at DESC
+                """, (user_id,)
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MaintenanceThread:
+    """
+    Runs the database upkeep in the background every `interval` seconds: archives the chats
+    idle for longer than `idle_seconds` (if set), then gives the free pages back to the
+    filesystem with incremental vacuum steps.
+
+    Every worker process starts one, but only the one holding the maintenance lease in the
+    database does the work; the others wait for it to run out, which happens when its holder
+    stops or dies without renewing it.
+    """
+
+    LEASE = "maintenance"
+
+    def __init__(self, db, interval: float, idle_seconds: int | None, vacuum_step_pages: int, logger):
+        self.db = db
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.vacuum_step_pages = vacuum_step_pages
+        self.logger = logger
+        self.holder = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+        self.db.release_lease(self.LEASE, holder=self.holder)
+
+    def run_once(self) -> dict[str, int] | None:
+        """
+        one round of upkeep, or None if another worker holds the lease. the lease lasts two
+        intervals, so a holder that is a bit late renewing it doesn't lose it.
+        """
+        if not self.db.take_lease(self.LEASE, holder=self.holder, seconds=2 * self.interval):
+            return None
+        report = {}
+        if self.idle_seconds is not None:
+            report.update(self.db.archive_idle_chats(idle_seconds=self.idle_seconds))
+        report.update(self.db.incremental_vacuum(step_pages=self.vacuum_step_pages))
+        return report
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.run_once()
+                if report and (report.get("archived_chats") or report.get("freed_bytes")):
+                    self.logger.info(f"Database maintenance: {report}")
+            except Exception as e:
+                self.logger.error(f"Database maintenance failed: {e}")
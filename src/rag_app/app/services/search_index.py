@@ -0,0 +1,51 @@
+import json
+
+# Full-text index over what users and the assistant wrote, in the messages_fts FTS5 table. Each
+# row's rowid is the message id, and it keeps its own copy of the text, so searches and their
+# snippets never touch the (maybe compressed) message content. The writes that add messages
+# add them here too, in the same transaction.
+#
+# The owner column holds the id of the user whose chat the message is in, and is part of every
+# search, so FTS5 only ever looks at the user's own messages instead of matching everyone's and
+# leaving the others out afterwards.
+
+INDEXED_ROLES = ("user", "assistant")
+SNIPPET_TOKENS = 16
+
+
+def index_messages(cursor, rows: list[tuple[int, int, str, str | None]]):
+    """
+    adds (message id, chat id, role, content) rows to the index, skipping the roles and empty
+    messages there's no point in searching. the owner is looked up from the chat, which has to
+    be written first.
+    """
+    cursor.executemany(
+        """
+        INSERT INTO messages_fts (rowid, content, chat_id, role, owner)
+        SELECT ?, ?, id, ?, user_id FROM chats WHERE id = ?
+        """,
+        [
+            (message_id, content, role, chat_id)
+            for message_id, chat_id, role, content in rows
+            if role in INDEXED_ROLES and content
+            ]
+    )
+
+
+def match_query(text: str, owner: int) -> str | None:
+    """
+    turns what the user typed into an FTS5 query matching the owner's messages that hold every
+    word, the last one as a prefix so results show up while typing. quoting every word keeps FTS5
+    syntax (quotes, AND/OR, column filters) from leaking in.
+    """
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += "*"
+    return f'owner : "{int(owner)}" AND content : ({" ".join(terms)})'
+
+
+def message_fields(message_blob: str) -> tuple[str, str | None]:
+    message = json.loads(message_blob)
+    return message.get("role"), message.get("content")
@@ -1,6 +1,6 @@
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Iterator
 
-import uuid
+import asyncio, uuid
 from rag_app.app.core.config import Configurations
 from rag_app.app.services.user import User
 from rag_app.app.services.db_manager import DatabaseManager
@@ -8,24 +8,50 @@ from rag_app.app.services.chat import Chat
 from rag_app.app.services.llm_client import LlmClient
 from rag_app.app.models import *
 from rag_app.app.core.errors import *
+from rag_app.app.core.metrics import observe
 from rag_app.app.services.tool_handler import ToolHandler
+from rag_app.app.services.container import Services
+from rag_app.app.services.context import ContextBuilder
 
 
 class Session:
-    def __init__(self, configs: Configurations):
-        self.id = str(uuid.uuid4())
+    def __init__(
+            self, 
+            configs: Configurations, 
+            services: Services | None = None, 
+            session_id: str | None = None,
+            ):
+        # the web app passes in the process-wide services; the CLI and tests can let the session build its own
+        if services is None:
+            services = Services.build(configs=configs)
+        # session_id is given when a session is rebuilt from the session store
+        self.id = session_id or str(uuid.uuid4())
         self.configs: Configurations = configs
-        self.db: DatabaseManager = DatabaseManager(configs=configs)
+        self.db: DatabaseManager = services.db
         self.logger = self.configs.logger
         self.user: User = None
         self.chat: Chat = None
-        self.llm_client: LlmClient = LlmClient(configs=configs)
-        self.tool_client: ToolHandler = ToolHandler(configs=configs)
+        self.llm_client: LlmClient = services.llm_client
+        self.tool_client: ToolHandler = services.tool_client
+        self.context_builder: ContextBuilder = services.context_builder
         self._log_configs()
 
     def _log_configs(self):
         self.logger.debug(f"System prompt: {self.configs.system_prompt}")
 
+    def close(self):
+        """
+        drops the chat history, user and the session's references to the clients so they can be garbage collected.
+        the clients themselves are shared, so they are not closed here.
+        called by the SessionManager when the session expires or is evicted.
+        """
+        self.chat = None
+        self.user = None
+        self.llm_client = None
+        self.tool_client = None
+        self.context_builder = None
+        self.db = None
+
     def default_user(self,):
         try:
             self.db.create_user(user_name="default")
@@ -71,7 +97,9 @@ class Session:
 
         # send the query with the context gathered from the RAG client
         try:
-            tool_response = self.llm_client.send_request(messages=self.chat.messages)
+            messages = self.context_builder.build(self.chat)
+            with observe("llm_after_tool"):
+                tool_response = self.llm_client.send_request(messages=messages)
         except LlmCallFailedError as e:
             return self._fail(f"LLM call failed: {e}")
 
@@ -113,13 +141,20 @@ class Session:
         # check if this is the first message in the chat
         if self.chat is None:
             self.chat = Chat(user=self.user, db=self.db, configs=self.configs)
-            self.chat.init_chat(prompt)
-        else:
-            self.chat.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
+            self.chat.create()
+
+        # the turn's messages are written in one transaction when it ends
+        with self.chat.turn():
+            return self._process_turn(prompt=prompt, tools=tools)
+
+    def _process_turn(self, prompt: str, tools: list[Tool] | None) -> MessageDocuments:
+        self.chat.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
 
         # intial call to the LLM
         try:
-            response = self.llm_client.send_request(messages=self.chat.messages, tools=tools)
+            messages = self.context_builder.build(self.chat)
+            with observe("llm_first"):
+                response = self.llm_client.send_request(messages=messages, tools=tools)
         except LlmCallFailedError as e:
             return self._fail(f"LLM call failed: {e}")
         response_message = self.llm_client.get_messsage(response=response)
@@ -130,6 +165,88 @@ class Session:
 
         return self._run_tool_flow(response_message)
     
+    async def aprocess_prompt(
+            self, 
+            prompt: str, 
+            tool_names: list[str] = []
+        ) -> MessageDocuments:
+        """
+        async version of process_prompt(), used by the web app. the LLM, embeddings and Chroma calls
+        are awaited, and the SQLite work runs in worker threads, so the event loop stays free
+        to serve other users while this turn waits.
+        """
+        if tool_names:
+            tools = self._get_tools(tool_names=tool_names)
+        else:
+            tools = None
+
+        # check if this is the first message in the chat
+        if self.chat is None:
+            self.chat = Chat(user=self.user, db=self.db, configs=self.configs)
+            await asyncio.to_thread(self.chat.create)
+
+        # the turn's messages are only kept in memory until it ends, and then written in one transaction
+        self.chat.begin_turn()
+        try:
+            return await self._aprocess_turn(prompt=prompt, tools=tools)
+        finally:
+            written = await asyncio.to_thread(self.chat.flush)
+            # with sqlite_write_behind the write is only queued; the reply is rendered and cached
+            # by message id, so the turn waits for the ids without holding up the event loop
+            if written is not None:
+                await asyncio.wrap_future(written)
+
+    async def _aprocess_turn(self, prompt: str, tools: list[Tool] | None) -> MessageDocuments:
+        self.chat.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
+
+        # intial call to the LLM
+        try:
+            messages = await asyncio.to_thread(self.context_builder.build, self.chat)
+            with observe("llm_first"):
+                response = await self.llm_client.asend_request(messages=messages, tools=tools)
+        except LlmCallFailedError as e:
+            return self._fail(f"LLM call failed: {e}")
+        response_message = self.llm_client.get_messsage(response=response)
+
+        if not response_message.tool_calls:
+            msg_docs = MessageDocuments(message=response_message)
+            self.chat.add_message(msg_docs)
+            return msg_docs
+
+        return await self._arun_tool_flow(response_message)
+
+    async def _arun_tool_flow(self, response_message: Message) -> MessageDocuments:
+
+        # add the model's tool_call message to the chat
+        self.chat.add_message(MessageDocuments(message=response_message))
+
+        for tool_call in response_message.tool_calls:
+            self.logger.info(f"Tool call! name: {tool_call.function.name}, arguments: {tool_call.function.arguments}")
+        try:
+            tool_responses = await self.tool_client.ahandle(response_message)
+        except RagClientFailedError as e:
+            return self._fail(f"RAG client failed: {e}")
+
+        documents = []
+        for msg_docs in tool_responses:
+            self.logger.info("Tool call added to chat.")
+            self.logger.info(f"tool_call_id: {msg_docs.message.tool_call_id}")
+            documents.extend(msg_docs.documents or [])
+            self.chat.add_message(msg_docs)
+
+        # send the query with the context gathered from the RAG client
+        try:
+            messages = await asyncio.to_thread(self.context_builder.build, self.chat)
+            with observe("llm_after_tool"):
+                tool_response = await self.llm_client.asend_request(messages=messages)
+        except LlmCallFailedError as e:
+            return self._fail(f"LLM call failed: {e}")
+
+        final_response_message = self.llm_client.get_messsage(response=tool_response)
+        msg_docs = MessageDocuments(message=final_response_message, documents=documents)
+        self.chat.add_message(msg_docs)
+        return msg_docs
+
 ########################################
 ### Methods for the CLI interface.
 ### Might need work.
@@ -175,49 +292,39 @@ class Session:
                 tool_list.append(self.tool_client.tool_chain[tool_name])
         return prompt, tool_list
     
+    
 ########################################
 ### the following are methods for 
 ### handling LLM responses as a stream
 ########################################
-    def process_prompt_streaming(self, prompt: str):
-        prompt, tools = self._parse_prompt(prompt)
+    def process_prompt_streaming(self, prompt: str) -> Iterator[StreamEvent]:
+        prompt, tools = self.cli_parse_prompt(prompt)
+        with self.chat.turn():
+            yield from self._process_turn_streaming(prompt=prompt, tools=tools)
+
+    def _process_turn_streaming(self, prompt: str, tools: list[Tool] | None) -> Iterator[StreamEvent]:
         self.chat.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
 
         content_parts: list[str] = []
-        tool_calls: list[ToolCall] = []
-        tool_call_flag: bool = False
+        tool_calls: dict[int, ToolCall] = {}
 
         try:
-            stream = self.llm_client.send_request_stream(messages=self.chat.messages, tools=tools)
+            stream = self.llm_client.send_request_stream(messages=self.context_builder.build(self.chat), tools=tools)
             for chunk in stream:
-                delta = chunk["choices"][0]["delta"]
-
-                if "content" in delta:
-                    token = delta["content"]
-                    if token is not None:
-                        content_parts.append(token)
-                        yield StreamEvent(type="token", content=token)
-
-                if "tool_calls" in delta and delta["tool_calls"] is not None:
-                    tool_call_flag = True
-                    self.logger.info(f"tool calls in delta: {delta["tool_calls"]}")
-                    self._accumulate_tool_calls(tool_calls, delta["tool_calls"])
-                    self.logger.info(f"tool_calls after _accumulate_tool_calls: {tool_calls}")
-
-            finish_reason = chunk["choices"][0].get("finish_reason")
-            self.logger.info(f"final chunk: {chunk}")
-
-            if tool_call_flag is True:
-                response_message = Message(role="assistant", tool_calls=tool_calls)
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield StreamEvent(type="token", content=delta.content)
+                if delta.tool_calls:
+                    self._accumulate_tool_calls(tool_calls, delta.tool_calls)
+
+            if tool_calls:
+                response_message = Message(role="assistant", tool_calls=list(tool_calls.values()))
                 yield from self._run_tool_flow_stream(response_message=response_message)
                 return
-            else:
-                final_message = Message(
-                        role="assistant",
-                        content="".join(content_parts),
-                        )
-                self.chat.add_message(MessageDocuments(message=final_message))
 
+            final_message = Message(role="assistant", content="".join(content_parts))
+            self.chat.add_message(MessageDocuments(message=final_message))
             yield StreamEvent(type="done")
 
         except LlmCallFailedError as e:
@@ -226,8 +333,8 @@ class Session:
 
     def _accumulate_tool_calls(
             self,
-            tool_calls: list[ToolCall],
-            delta_tool_calls: list[dict],
+            tool_calls: dict[int, ToolCall],
+            delta_tool_calls: list,
         ) -> None:
         """
         Incrementally builds ToolCall objects from streamed tool_call deltas.
@@ -236,80 +343,160 @@ class Session:
         """
 
         for call in delta_tool_calls:
-            # this is a little tricky because the delta chunks only use the call ID in the first chunk and it's None after that
-            # so you have to grab the index of the call and add it to the pydantic model object as "_index" using .setattr()
-            # then when you get an existing tool_call object from tool_calls to write the next chunk to, find it by "_index"
-            call_id = call["id"]
-            call_index = call["index"]
-
-            tool_call = next(
-                (tc for tc in tool_calls if getattr(tc, "_index", None) == call_index),
-                None
-            )
+            # the delta chunks only carry the call ID and function name in the first chunk of each call,
+            # so the calls are keyed by their index, which every chunk has
+            tool_call = tool_calls.get(call.index)
 
             if tool_call is None:
                 tool_call = ToolCall(
-                    id=call_id,
+                    id=call.id,
                     type="function",
-                    function=FunctionCall(
-                        name=call["function"].get("name"),
-                        arguments=""
-                    ),
+                    function=FunctionCall(name=call.function.name, arguments=""),
                 )
+                tool_calls[call.index] = tool_call
 
-                setattr(tool_call, "_index", call_index)
-                tool_calls.append(tool_call)
+            if call.function.arguments:
+                tool_call.function.arguments += call.function.arguments
 
-            args_fragment = call["function"].get("arguments")
-            if args_fragment:
-                tool_call.function.arguments += args_fragment
-
-    def _run_tool_flow_stream(self, response_message: Message) -> Iterator[dict]:
+    def _run_tool_flow_stream(self, response_message: Message) -> Iterator[StreamEvent]:
         
         # add the model's tool_call message to the chat
         self.chat.add_message(msg_docs=MessageDocuments(message=response_message))
 
-        # call the tool (RAG client), get: 
-        #   1) the message to return to the LLM, 
-        #   2) the documents returned by the RAG client
-        # they will be a list of MessageDocuments objects
         for tool_call in response_message.tool_calls:
             self.logger.info(f"Tool call! name: {tool_call.function.name}, arguments: {tool_call.function.arguments}")
-        try:
-            tool_responses = self.tool_client.handle(response_message)
-        except RagClientFailedError as e:
-            return self._fail(f"RAG client failed: {e}")
+        tool_responses = self.tool_client.handle(response_message)
         
-        # TODO: i think there's a problem with the logic here.
         documents = []
         for msg_docs in tool_responses:
-            self.logger.info("Tool call added to chat.")
-            self.logger.info(f"tool_call_id: {msg_docs.message.tool_call_id}")
-            documents.extend(msg_docs.documents)
+            documents.extend(msg_docs.documents or [])
             self.chat.add_message(msg_docs=msg_docs)
 
-        # send the query with the context gathered from the RAG client
-        try:
-            stream = self.llm_client.send_request_stream(messages=self.chat.messages)
-        except LlmCallFailedError as e:
-            return self._fail(f"LLM call failed: {e}")
-        
-        content_parts: list = []
-
-        for chunk in stream:
-            token = chunk["choices"][0]["delta"]["content"]
-            if token is not None:
+        # stream the answer with the context gathered from the RAG client
+        content_parts: list[str] = []
+        for chunk in self.llm_client.send_request_stream(messages=self.context_builder.build(self.chat)):
+            token = chunk.choices[0].delta.content
+            if token:
                 content_parts.append(token)
-            yield StreamEvent(type="token", content=token)
+                yield StreamEvent(type="token", content=token)
 
         # then combine the streamed tokens, create the message, and add it to the chat as a MessageDocuments
         # containing the documents/metadata returned by the RAG client.
-        final_response_message = Message(
-                role="assistant",
-                content="".join(content_parts),
-            )
-        msg_docs = MessageDocuments(message=final_response_message, documents=documents)
-        self.chat.add_message(msg_docs=msg_docs)
+        final_response_message = Message(role="assistant", content="".join(content_parts))
+        self.chat.add_message(msg_docs=MessageDocuments(message=final_response_message, documents=documents))
+        yield StreamEvent(type="done")
 
-        # and close the stream.
-        yield StreamEvent(type="done")
\ No newline at end of file
+    async def aprocess_prompt_streaming(
+            self, 
+            prompt: str, 
+            tool_names: list[str] = []
+        ) -> AsyncIterator[StreamEvent]:
+        """
+        async, streaming version of process_prompt(), used by the web app's SSE endpoint.
+        yields the answer's tokens as they arrive, a tool_call event for each tool the model calls and
+        retrieval events around the RAG lookup, then done (or error). the finished answer and its
+        documents end up as the chat's last message.
+        if the caller stops early, for example because the client disconnected, the tool calls are
+        closed off and the partial answer is saved, so the chat can still be sent to the LLM.
+        """
+        if tool_names:
+            tools = self._get_tools(tool_names=tool_names)
+        else:
+            tools = None
+
+        if self.chat is None:
+            self.chat = Chat(user=self.user, db=self.db, configs=self.configs)
+            await asyncio.to_thread(self.chat.create)
+        # the turn's messages are written in one transaction, before done is sent or once the turn stops
+        self.chat.begin_turn()
+        self.chat.add_message(MessageDocuments(message=Message(role="user", content=prompt)))
+
+        content_parts: list[str] = []
+        unanswered: list[ToolCall] = []
+        documents: list[ChromaDbResult] = []
+        finished = False
+        try:
+            tool_calls: dict[int, ToolCall] = {}
+            async for token in self._astream_tokens(tools=tools, tool_calls=tool_calls, stage="llm_first"):
+                content_parts.append(token)
+                yield StreamEvent(type="token", content=token)
+
+            if tool_calls:
+                response_message = Message(
+                    role="assistant",
+                    content="".join(content_parts) or None,
+                    tool_calls=list(tool_calls.values()),
+                    )
+                self.chat.add_message(MessageDocuments(message=response_message))
+                unanswered = list(response_message.tool_calls)
+                content_parts = []
+
+                for tool_call in response_message.tool_calls:
+                    self.logger.info(f"Tool call! name: {tool_call.function.name}, arguments: {tool_call.function.arguments}")
+                    yield StreamEvent(type="tool_call", content=f"{tool_call.function.name}({tool_call.function.arguments})")
+                yield StreamEvent(type="retrieval", content="Searching the sources...")
+
+                tool_responses = await self.tool_client.ahandle(response_message)
+                for msg_docs in tool_responses:
+                    documents.extend(msg_docs.documents or [])
+                    self.chat.add_message(msg_docs)
+                unanswered = []
+                yield StreamEvent(type="retrieval", content=f"Found {len(documents)} documents.")
+
+                async for token in self._astream_tokens(tools=None, tool_calls={}, stage="llm_after_tool"):
+                    content_parts.append(token)
+                    yield StreamEvent(type="token", content=token)
+
+            final_message = Message(role="assistant", content="".join(content_parts))
+            self.chat.add_message(MessageDocuments(message=final_message, documents=documents or None))
+            finished = True
+            written = await asyncio.to_thread(self.chat.flush)
+            # with sqlite_write_behind the write is only queued; done is rendered by message id,
+            # so it waits for the ids without holding up the event loop
+            if written is not None:
+                await asyncio.wrap_future(written)
+            yield StreamEvent(type="done")
+
+        except (LlmCallFailedError, RagClientFailedError) as e:
+            self.logger.error(f"Streaming failed: {e}")
+            yield StreamEvent(type="error", content=str(e))
+
+        finally:
+            if not finished:
+                self._close_interrupted_turn(unanswered=unanswered, content="".join(content_parts))
+            await asyncio.to_thread(self.chat.flush)
+
+    async def _astream_tokens(
+            self, 
+            tools: list[Tool] | None, 
+            tool_calls: dict[int, ToolCall],
+            stage: str,
+        ) -> AsyncIterator[str]:
+        """
+        streams one LLM call over the chat's context, yielding its text tokens and collecting
+        any tool calls into `tool_calls`. the time until the stream ends is observed under `stage`.
+        """
+        messages = await asyncio.to_thread(self.context_builder.build, self.chat)
+        with observe(stage):
+            async for chunk in self.llm_client.asend_request_stream(messages=messages, tools=tools):
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    self._accumulate_tool_calls(tool_calls, delta.tool_calls)
+                if delta.content:
+                    yield delta.content
+
+    def _close_interrupted_turn(self, unanswered: list[ToolCall], content: str):
+        """
+        keeps the chat valid after a streamed turn stopped part way: every tool call needs a tool
+        response before the LLM will accept the chat again, and whatever was generated is kept
+        """
+        if self.chat is None:
+            return
+        for tool_call in unanswered:
+            self.chat.add_message(MessageDocuments(message=Message(
+                role="tool",
+                tool_call_id=tool_call.id,
+                content="The tool call was interrupted.",
+                )))
+        if content:
+            self.chat.add_message(MessageDocuments(message=Message(role="assistant", content=content)))
@@ -0,0 +1,43 @@
+import sqlite3
+
+# With sqlite_shards > 1 the chats are spread over that many SQLite files, so turns of users in
+# different shards are written in parallel instead of queueing for the one write lock. A user's
+# chats, with their messages, summaries, documents and search index, all go to shard
+# user_id % sqlite_shards. Shard 0 is the sqlite_path file itself, which also keeps the tables
+# shared by everyone: users, web sessions and settings.
+#
+# Chat and message ids are handed out so that id % sqlite_shards is the shard the row is in, so
+# every call that comes with a chat or message id finds its shard without a lookup.
+
+
+def shard_path(path: str, shard: int) -> str:
+    """
+    the file of a shard: sqlite_path for shard 0, and sqlite_path with a .shard<n> suffix for the
+    others, before the query string if sqlite_path is a URI
+    """
+    if shard == 0:
+        return path
+    name, query = path.split("?", 1) if "?" in path else (path, None)
+    name = f"{name}.shard{shard}"
+    return f"{name}?{query}" if query is not None else name
+
+
+def next_ids(conn: sqlite3.Connection, table: str, shard: int, shards: int, count: int = 1) -> list[int]:
+    """
+    allocates count ids for new rows of table, all in the shard, in the transaction the rows are
+    written in. like AUTOINCREMENT, they start after the highest id ever given, so the ids of
+    archived chats never come back.
+    """
+    # the write lock from here on, so no other writer takes the same ids
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    last = conn.execute(
+        f"""
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),
+            COALESCE((SELECT MAX(id) FROM {table}), 0)
+            )
+        """, (table,)
+    ).fetchone()[0]
+    first = last + 1 + (shard - last - 1) % shards
+    return [first + i * shards for i in range(count)]
@@ -0,0 +1,202 @@
+import queue, sqlite3, threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from contextlib import contextmanager
+from rag_app.app.core.config import Configurations
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of SQLite connections, shared by every thread of the process.
+
+    The connections run in WAL mode, so readers don't block the writer or each other, with
+    synchronous=NORMAL (durable at every checkpoint, and still consistent after a crash), a busy
+    timeout so concurrent writers wait their turn instead of failing with "database is locked",
+    a bigger prepared-statement cache and memory-mapped reads. New databases are created with
+    incremental vacuum on, so the space of deleted rows can be given back a bit at a time.
+
+    connection() hands out a connection for the length of a `with` block and commits (or rolls
+    back) at the end of it. A thread that asks again while it already holds one gets the same
+    connection, inside the same transaction, so helpers can call each other freely.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            size: int = 8,
+            busy_timeout_ms: int = 5000,
+            cached_statements: int = 256,
+            mmap_size: int = 256 * 1024 * 1024,
+            ):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.mmap_size = mmap_size
+
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def dedicated(self):
+        """
+        a connection of its own, outside the pool, for long reads such as exports. a generator
+        that held a pooled connection could be resumed on other threads, and would tie up a slot
+        for as long as it is read.
+        """
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        closes the idle connections, and any in use as they come back
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _acquire(self) -> sqlite3.Connection:
+        # waits as long as a busy database would, then fails the same way
+        if not self._slots.acquire(timeout=self.busy_timeout_ms / 1000):
+            raise sqlite3.OperationalError(f"No free connection in the pool after {self.busy_timeout_ms} ms")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._lock:
+            closed = self._closed
+        if closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            uri=True,
+            check_same_thread=False,   # connections move between threads, but only one uses them at a time
+            timeout=self.busy_timeout_ms / 1000,   # sets SQLite's busy timeout
+            cached_statements=self.cached_statements,
+            )
+        # only takes effect on a brand new database, and has to come before anything writes to
+        # it, WAL mode included. older databases get it from `rag-app-db vacuum --enable`
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # an in-memory database stays in "memory" journal mode, which is fine
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+
+class WriteBehindQueue:
+    """
+    Runs database writes on a background thread, in the order they were submitted, so a request
+    can answer before its writes are committed. submit() returns a Future for whoever does need
+    to wait. close() waits for every queued write, so nothing is lost on a clean shutdown; writes
+    still queued when the process is killed are.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._queue: queue.Queue[tuple[Callable, tuple, Future] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, write: Callable, *args) -> Future:
+        """
+        queues the write and returns a Future of its result, set once it is committed
+        """
+        future = Future()
+        self._queue.put((write, args, future))
+        return future
+
+    def join(self):
+        """
+        waits until everything submitted so far is written
+        """
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                write, args, future = item
+                future.set_result(write(*args))
+            except Exception as e:
+                self.logger.error(f"Write-behind write failed: {e}")
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+
+# one pool per database per process, shared by the DatabaseManager and the SessionStore
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(configs: Configurations, path: str | None = None) -> ConnectionPool:
+    """
+    the pool of the database at path, sqlite_path by default
+    """
+    path = path or configs.sqlite_path
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(
+                    path=path,
+                    size=configs.sqlite_pool_size,
+                    busy_timeout_ms=configs.sqlite_busy_timeout_ms,
+                    cached_statements=configs.sqlite_cached_statements,
+                    mmap_size=configs.sqlite_mmap_size,
+                    )
+                _pools[path] = pool
+    return pool
+
+
+def close_pool(path: str):
+    with _pools_lock:
+        pool = _pools.pop(path, None)
+    if pool is not None:
+        pool.close()
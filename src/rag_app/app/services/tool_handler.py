@@ -1,11 +1,22 @@
-import json
+import asyncio, json
+from collections.abc import Callable
+from functools import partial
 from rag_app.app.core.config import Configurations
 from rag_app.app.core.errors import MetadataFilterError, RagClientFailedError
-from rag_app.app.models import Tool, Message, FunctionDefinition
+from rag_app.app.core.metrics import ERRORS, TOOL_CALLS
+from rag_app.app.models import Tool, Message, FunctionDefinition, ToolCall
 from rag_app.app.services.rag import RagClient
 from rag_app.app.tools.registry import TOOLS
 from rag_app.app.models import MessageDocuments
 
+# the Chroma collection and the RagClient methods, sync and async, that answer each tool.
+# every name in tool_names needs an entry here.
+TOOL_METHODS: dict[str, tuple[str, str, str]] = {
+    "gdpr_query": ("gdpr", "chroma_query", "achroma_query"),
+    "gdpr_get": ("gdpr", "chroma_get", "achroma_get"),
+    "edpb_query": ("edpb_guidance", "chroma_query", "achroma_query"),
+}
+
 class ToolHandler:
 
     def __init__(self, configs: Configurations):
@@ -20,66 +31,71 @@ class ToolHandler:
         return {tool.function.name: tool for tool in tools}
 
     def handle(self, message: Message) -> list[MessageDocuments]:
-        tool_messages = []
-        for tool_call in message.tool_calls:
+        return [self._handle_call(tool_call) for tool_call in message.tool_calls]
+
+    async def ahandle(self, message: Message) -> list[MessageDocuments]:
+        """
+        async version of handle(). the tool calls in the message run concurrently,
+        and the responses come back in the same order as the calls.
+        """
+        return list(await asyncio.gather(*(self._ahandle_call(tool_call) for tool_call in message.tool_calls)))
+
+    def _handle_call(self, tool_call: ToolCall) -> MessageDocuments:
+        call = self._prepare_call(tool_call, asynchronous=False)
+        if isinstance(call, MessageDocuments):
+            return call
+        try:
+            return call()
+        except (MetadataFilterError, RagClientFailedError) as e:
+            return self._call_failed(tool_call, e)
+
+    async def _ahandle_call(self, tool_call: ToolCall) -> MessageDocuments:
+        call = self._prepare_call(tool_call, asynchronous=True)
+        if isinstance(call, MessageDocuments):
+            return call
+        try:
+            return await call()
+        except (MetadataFilterError, RagClientFailedError) as e:
+            return self._call_failed(tool_call, e)
+
+    def _prepare_call(self, tool_call: ToolCall, asynchronous: bool) -> Callable | MessageDocuments:
+        """
+        looks the tool up in TOOL_METHODS and returns the RagClient call that answers it, with
+        its arguments bound, or the tool message to answer with if there is no such tool
+        """
+        if tool_call.function.name not in self.tool_names:
+            # the name comes from the model, so it isn't used as a label as it is
+            TOOL_CALLS.labels(tool="unknown").inc()
+            return self._unknown_tool(tool_call)
+        TOOL_CALLS.labels(tool=tool_call.function.name).inc()
+        if tool_call.function.name not in TOOL_METHODS:
+            return self._unhandled_tool(tool_call)
+
+        collection, method, amethod = TOOL_METHODS[tool_call.function.name]
+        arguments = json.loads(tool_call.function.arguments)
+        self.logger.info(f"Call for tool {tool_call.function.name}: {arguments}")
+        return partial(
+            getattr(self.rag, amethod if asynchronous else method),
+            arguments=arguments,
+            tool_call_id=tool_call.id,
+            collection=collection,
+            )
+
+    def _call_failed(self, tool_call: ToolCall, e: Exception) -> MessageDocuments:
+        if isinstance(e, MetadataFilterError):
+            self.logger.error(f"Problem with the metadata filter: {e}")
+        return self._tool_error(tool_call, e)
+
+    def _unknown_tool(self, tool_call: ToolCall) -> MessageDocuments:
+        self.logger.error(f"The model tried to call tool {tool_call.function.name}, which is not in the list of tool names: {self.tool_names} ")
+        return MessageDocuments(message=Message(role='tool', tool_call_id=tool_call.id, content='There is no tool with that name.'))
 
-            if tool_call.function.name not in self.tool_names:
-                self.logger.error(f"The model tried to call tool {tool_call.function.name}, which is not in the list of tool names: {self.tool_names} ")
-                msg_docs = MessageDocuments(message=Message(role='tool', tool_call_id=tool_call.id, content='There is no tool with that name.'))
-                tool_messages.append(msg_docs)
-            
-            # need an elif block for each name in tool_names
-            elif tool_call.function.name == "gdpr_query":
-                arguments = json.loads(tool_call.function.arguments)
-                self.logger.info(f"Call for tool {tool_call.function.name}: {arguments}")
-                try:
-                    msg_docs = self.rag.chroma_query( 
-                        arguments=arguments,
-                        tool_call_id=tool_call.id,
-                        collection="gdpr")
-                except RagClientFailedError as e:
-                    msg_docs = MessageDocuments(
-                        message=Message(
-                            role="tool", tool_call_id=tool_call.id, content=str(e),))
-                tool_messages.append(msg_docs)
-            
-            elif tool_call.function.name == "gdpr_get":
-                arguments = json.loads(tool_call.function.arguments)
-                self.logger.info(f"Call for tool {tool_call.function.name}: {arguments}")
-                try:
-                    msg_docs = self.rag.chroma_get( 
-                        arguments=arguments,
-                        tool_call_id=tool_call.id,
-                        collection="gdpr")
-                except MetadataFilterError as e:
-                    self.logger.error(f"Problem with the metadata filter: {e}")
-                    msg_docs = MessageDocuments(
-                        message=Message(
-                            role="tool", tool_call_id=tool_call.id, content=str(e),))
-                except RagClientFailedError as e:
-                    msg_docs = MessageDocuments(
-                        message=Message(
-                            role="tool", tool_call_id=tool_call.id, content=str(e),))
-                tool_messages.append(msg_docs)
-            
-            elif tool_call.function.name == "edpb_query":
-                arguments = json.loads(tool_call.function.arguments)
-                self.logger.info(f"Call for tool {tool_call.function.name}: {arguments}")
-                try:
-                    msg_docs = self.rag.chroma_query( 
-                        arguments=arguments,
-                        tool_call_id=tool_call.id,
-                        collection="edpb_guidance")
-                except RagClientFailedError as e:
-                    msg_docs = MessageDocuments(
-                        message=Message(
-                            role="tool", tool_call_id=tool_call.id, content=str(e),))
-                tool_messages.append(msg_docs)
+    def _unhandled_tool(self, tool_call: ToolCall) -> MessageDocuments:
+        self.logger.error(f"Tool call for {tool_call.function.name} not handled. Have you added handling for it yet??")
+        return MessageDocuments(message=Message(role='tool', tool_call_id=tool_call.id, content='Tool not found.'))
 
-            # logs an error if a tool exists but handling hasn't been added yet
-            else:
-                self.logger.error(f"Tool call for {tool_call.function.name} not handled. Have you added handling for it yet??")
-                msg_docs = MessageDocuments(message=Message(role='tool', tool_call_id=tool_call.id, content='Tool not found.'))
-                tool_messages.append(msg_docs)
-        
-        return tool_messages
\ No newline at end of file
+    def _tool_error(self, tool_call: ToolCall, e: Exception) -> MessageDocuments:
+        ERRORS.labels(component="tool").inc()
+        return MessageDocuments(
+            message=Message(
+                role="tool", tool_call_id=tool_call.id, content=str(e),))
@@ -0,0 +1,71 @@
+import json
+from collections.abc import Iterable, Iterator
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.document_store import document_keys
+
+# Chats are exported as JSON Lines, one object per line, each with a "type":
+#
+#   {"type": "chat", "id", "user", "slug", "created_at", "updated_at"}
+#       before the first message of each chat
+#   {"type": "document", "id", "document", "metadata"}
+#       the first time a message refers to a retrieved document
+#   {"type": "message", "id", "chat_id", "created_at", "message", "documents"}
+#       one per message, oldest first within a chat. "message" is the message as
+#       Message.model_dump() has it, and "documents" holds [chroma id, content hash] keys, the
+#       same as in the database
+#
+# The ids are those of the exporting database; an import gives the chats and messages new ones.
+
+
+def export_lines(
+        db: DatabaseManager,
+        user_name: str | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        ) -> Iterator[str]:
+    """
+    yields the export of the chats matching the filters, one line at a time. nothing but the
+    keys of the documents already written is kept in memory.
+    """
+    written: set[tuple[str, str]] = set()
+    chat_id = None
+    for chat, (message_id, message, documents, created_at) in db.iter_export_rows(user_name=user_name, since=since, until=until):
+        if chat[0] != chat_id:
+            chat_id, user, slug, chat_created_at, updated_at = chat
+            yield json.dumps({"type": "chat", "id": chat_id, "user": user, "slug": slug, "created_at": chat_created_at, "updated_at": updated_at}) + "\n"
+
+        if documents:
+            new_keys = document_keys(json.loads(documents)) - written
+            if new_keys:
+                for document in db.get_documents(sorted(new_keys), shard=db.shard_of(message_id)).values():
+                    yield json.dumps({"type": "document", **document}) + "\n"
+                written |= new_keys
+
+        yield (
+            f'{{"type": "message", "id": {message_id}, "chat_id": {chat_id}, "created_at": {json.dumps(created_at)}, '
+            f'"message": {json.dumps(message)}, "documents": {documents or "null"}}}\n'
+        )
+
+
+def import_lines(db: DatabaseManager, lines: Iterable[str], batch_size: int = 1000) -> dict[str, int]:
+    """
+    adds the chats of an export to the database, batch_size lines per transaction, and returns
+    how many chats, documents and messages were read
+    """
+    counts = {"chat": 0, "document": 0, "message": 0}
+    chat_ids: dict[int, int] = {}
+    batch: list[dict] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if item.get("type") not in counts:
+            raise ValueError(f"Not an export line: {line[:100]}")
+        counts[item["type"]] += 1
+        batch.append(item)
+        if len(batch) >= batch_size:
+            db.import_batch(items=batch, chat_ids=chat_ids)
+            batch = []
+    if batch:
+        db.import_batch(items=batch, chat_ids=chat_ids)
+    return {"chats": counts["chat"], "documents": counts["document"], "messages": counts["message"]}
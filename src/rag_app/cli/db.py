@@ -0,0 +1,114 @@
+import argparse, sys
+from datetime import datetime
+from rag_app.app.core.config import Configurations
+from rag_app.app.core.logging_setup import get_logger
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.transfer import export_lines, import_lines
+
+
+def compress(db: DatabaseManager, args: argparse.Namespace):
+    stats = db.compress_existing(batch_size=args.batch_size)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"Compressed {stats['compressed']} values: {stats['bytes_before']} -> {stats['bytes_after']} bytes ({saved} saved)")
+    print("Run `rag-app-db vacuum` to give the freed pages back to the filesystem.")
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def archive(db: DatabaseManager, args: argparse.Namespace):
+    before = db.space_stats()
+    stats = db.archive_idle_chats(idle_seconds=args.idle_days * 86400)
+    print(f"Archived {stats['archived_chats']} chats ({stats['archived_messages']} messages, {megabytes(stats['archive_bytes'])} compressed) to {db.archive.path}")
+    vacuum(db, args, before=before)
+
+
+def restore(db: DatabaseManager, args: argparse.Namespace):
+    if db.restore_chat(chat_id=args.chat_id):
+        print(f"Restored chat {args.chat_id}")
+    else:
+        print(f"Chat {args.chat_id} isn't in the archive")
+
+
+def vacuum(db: DatabaseManager, args: argparse.Namespace, before: dict[str, int] | None = None):
+    before = before or db.space_stats()
+    if getattr(args, "enable", False) and not before["incremental_vacuum"]:
+        print("Turning on incremental vacuum, with a full VACUUM. Writes wait until it's done.")
+        db.enable_incremental_vacuum()
+    elif not before["incremental_vacuum"]:
+        print(f"Incremental vacuum is off for this database, so {megabytes(before['free_bytes'])} of free pages stay in the file. Turn it on with `rag-app-db vacuum --enable`.")
+        return
+    db.incremental_vacuum(step_pages=args.step_pages)
+    after = db.space_stats()
+    print(f"Database: {megabytes(before['size_bytes'])} -> {megabytes(after['size_bytes'])} ({megabytes(before['size_bytes'] - after['size_bytes'])} reclaimed)")
+
+
+def timestamp(value: str) -> int:
+    """
+    an ISO date or date and time, in local time, as a unix timestamp
+    """
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def export(db: DatabaseManager, args: argparse.Namespace):
+    out = open(args.output, "w", encoding="utf-8") if args.output != "-" else sys.stdout
+    try:
+        out.writelines(export_lines(db=db, user_name=args.user, since=args.since, until=args.until))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def import_(db: DatabaseManager, args: argparse.Namespace):
+    source = open(args.input, encoding="utf-8") if args.input != "-" else sys.stdin
+    try:
+        counts = import_lines(db=db, lines=source, batch_size=args.batch_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"Imported {counts['chats']} chats, {counts['messages']} messages and {counts['documents']} documents")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Maintenance commands for the rag_app database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compress_parser = commands.add_parser("compress", help="compress the large values stored before compression was on")
+    compress_parser.add_argument("--batch-size", type=int, default=500, help="rows per transaction")
+    compress_parser.set_defaults(run=compress)
+
+    archive_parser = commands.add_parser("archive", help="archive idle chats and reclaim the space they took")
+    archive_parser.add_argument("--idle-days", type=int, required=True, help="archive chats not updated for this many days")
+    archive_parser.add_argument("--step-pages", type=int, default=2000, help="pages freed per vacuum step")
+    archive_parser.set_defaults(run=archive)
+
+    restore_parser = commands.add_parser("restore", help="bring an archived chat back")
+    restore_parser.add_argument("chat_id", type=int)
+    restore_parser.set_defaults(run=restore)
+
+    vacuum_parser = commands.add_parser("vacuum", help="give free pages back to the filesystem")
+    vacuum_parser.add_argument("--enable", action="store_true", help="turn incremental vacuum on first (runs a full, blocking VACUUM once)")
+    vacuum_parser.add_argument("--step-pages", type=int, default=2000, help="pages freed per vacuum step")
+    vacuum_parser.set_defaults(run=vacuum)
+
+    export_parser = commands.add_parser("export", help="write chats out as JSON Lines, one message per line")
+    export_parser.add_argument("-o", "--output", default="-", help="file to write to, standard output by default")
+    export_parser.add_argument("--user", help="only this user's chats")
+    export_parser.add_argument("--since", type=timestamp, help="only messages from this date (YYYY-MM-DD[THH:MM]) on")
+    export_parser.add_argument("--until", type=timestamp, help="only messages from before this date")
+    export_parser.set_defaults(run=export)
+
+    import_parser = commands.add_parser("import", help="add the chats of an export to the database, under new ids")
+    import_parser.add_argument("input", help="export file, or - for standard input")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="lines per transaction")
+    import_parser.set_defaults(run=import_)
+
+    args = parser.parse_args(argv)
+    configs = Configurations.load(logger=get_logger())
+    # opening the database also brings its schema up to date
+    db = DatabaseManager(configs=configs)
+    try:
+        args.run(db, args)
+    finally:
+        db.close()
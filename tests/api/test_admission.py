@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from rag_app.api.admission import AdmissionController
+from rag_app.api.factory import create_app
+from rag_app.app.core.errors import TurnRejectedError
+from rag_app.app.models import Message
+
+
+def test_waiting_turns_are_admitted_round_robin_across_users():
+    admission = AdmissionController(max_running=1, max_queued=10, max_queued_per_user=10)
+    order = []
+
+    async def turn(user, name):
+        async with admission.admit(user):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        await admission.acquire("someone else")
+        # the heavy user queues four turns before the light user's one arrives
+        names = [("heavy", "h1"), ("heavy", "h2"), ("heavy", "h3"), ("heavy", "h4"), ("light", "l1")]
+        tasks = []
+        for user, name in names:
+            tasks.append(asyncio.create_task(turn(user, name)))
+            await asyncio.sleep(0)
+        admission.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["h1", "l1", "h2", "h3", "h4"]
+    assert admission.stats() == {"running": 0, "queued": 0, "rejected": 0}
+
+def test_full_queue_rejects_straight_away():
+    admission = AdmissionController(max_running=1, max_queued=2, max_queued_per_user=1, retry_after=7)
+
+    async def main():
+        await admission.acquire("a")
+        waiting = [asyncio.create_task(admission.acquire(user)) for user in ["b", "c"]]
+        await asyncio.sleep(0)
+        with pytest.raises(TurnRejectedError) as rejected:
+            await admission.acquire("d")
+        assert rejected.value.retry_after == 7
+        # b already has a turn waiting, and one is all it may have
+        with pytest.raises(TurnRejectedError):
+            await admission.acquire("b")
+
+        for _ in range(3):
+            admission.release()
+        await asyncio.gather(*waiting)
+
+    asyncio.run(main())
+    assert admission.rejected == 2
+
+def test_cancelled_waiter_gives_up_its_place():
+    admission = AdmissionController(max_running=1, max_queued=5)
+
+    async def main():
+        await admission.acquire("a")
+        waiter = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        admission.release()
+
+    asyncio.run(main())
+    assert admission.stats() == {"running": 0, "queued": 0, "rejected": 0}
+
+def test_api_answers_429_with_retry_after_when_full(fake_configs, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    fake_configs.yaml_values.max_running_turns = 1
+    fake_configs.yaml_values.max_queued_turns = 0
+    app = create_app(configs=fake_configs)
+    app.state.services.db.create_user(user_name="peter")
+    app.state.services.llm_client.get_messsage = lambda response: Message(role="assistant", content=response)
+
+    async def asend_request(messages, tools=None):
+        await asyncio.sleep(0.05)
+        return "hello"
+    app.state.services.llm_client.asend_request = asend_request
+
+    client = TestClient(app)
+    first, second = (client.post("/api/v1/users/peter/chats").json()["id"] for _ in range(2))
+    results = client.post("/api/v1/users/peter/batch", json={"prompts": ["a", "b"]}).json()
+
+    assert sorted(bool(result["error"]) for result in results) == [False, True]
+    assert client.post(f"/api/v1/users/peter/chats/{first}/messages", json={"prompt": "hi"}).status_code == 200
+
+    # a turn from another user holds the only slot
+    asyncio.run(app.state.admission.acquire("paul"))
+    response = client.post(f"/api/v1/users/peter/chats/{second}/messages", json={"prompt": "hi"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+    app.state.admission.release()
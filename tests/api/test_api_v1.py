@@ -0,0 +1,157 @@
+import asyncio, json
+import httpx, pytest
+from fastapi.testclient import TestClient
+from rag_app.api.factory import create_app
+from rag_app.app.models import Message
+
+
+@pytest.fixture
+def app(fake_configs, tmp_path):
+    # the batch runs turns in parallel threads; a shared-cache in-memory database can't take
+    # concurrent writers, so these tests use a file like the real app does
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    app = create_app(configs=fake_configs)
+    services = app.state.services
+    services.db.create_user(user_name="peter")
+    services.db.create_user(user_name="paul")
+
+    # echoes the last user prompt back, so each answer can be matched to its prompt
+    async def asend_request(messages, tools=None):
+        return next(m.message.content for m in reversed(messages) if m.message.role == "user")
+    services.llm_client.asend_request = asend_request
+    services.llm_client.get_messsage = lambda response: Message(role="assistant", content=f"answer to {response}")
+    return app
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+def test_create_chat_send_prompt_and_read_it_back(client):
+    response = client.post("/api/v1/users/peter/chats")
+    assert response.status_code == 201
+    chat_id = response.json()["id"]
+
+    response = client.post(f"/api/v1/users/peter/chats/{chat_id}/messages", json={"prompt": "what is article 9?"})
+    assert response.status_code == 200
+    assert response.json()["message"]["content"] == "answer to what is article 9?"
+
+    messages = client.get(f"/api/v1/users/peter/chats/{chat_id}/messages").json()
+    assert [(m["message"]["role"], m["message"]["content"]) for m in messages] == [
+        ("user", "what is article 9?"),
+        ("assistant", "answer to what is article 9?"),
+        ]
+
+    chats = client.get("/api/v1/users/peter/chats").json()
+    assert [(chat["id"], chat["slug"]) for chat in chats] == [(chat_id, "what is article 9?...")]
+    assert chats[0]["updated_at"] is not None
+
+def test_unknown_user_and_other_users_chat_are_not_found(client):
+    assert client.get("/api/v1/users/nobody/chats").status_code == 404
+    chat_id = client.post("/api/v1/users/peter/chats").json()["id"]
+    assert client.get(f"/api/v1/users/paul/chats/{chat_id}/messages").status_code == 404
+    assert client.post(f"/api/v1/users/paul/chats/{chat_id}/messages", json={"prompt": "hi"}).status_code == 404
+
+def test_retries_join_the_running_turn_only_with_an_idempotency_key(app):
+    calls = []
+
+    async def asend_request(messages, tools=None):
+        calls.append(messages[-1].message.content)
+        await asyncio.sleep(0.01)
+        return messages[-1].message.content
+    app.state.services.llm_client.asend_request = asend_request
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            chat_id = (await client.post("/api/v1/users/peter/chats")).json()["id"]
+            url = f"/api/v1/users/peter/chats/{chat_id}/messages"
+            retried = {"prompt": "what is article 9?"}
+            await asyncio.gather(*(client.post(url, json=retried, headers={"Idempotency-Key": "abc"}) for _ in range(2)))
+            asked_twice = {"prompt": "and article 10?"}
+            await asyncio.gather(*(client.post(url, json=asked_twice) for _ in range(2)))
+            return (await client.get(url)).json()
+
+    messages = asyncio.run(main())
+    assert calls == ["what is article 9?", "and article 10?", "and article 10?"]
+    assert [m["message"]["content"] for m in messages if m["message"]["role"] == "user"] == ["what is article 9?", "and article 10?", "and article 10?"]
+
+def test_batch_runs_prompts_in_their_own_chats_with_bounded_concurrency(app, client, fake_configs):
+    fake_configs.yaml_values.batch_concurrency = 2
+    running, peak = 0, 0
+
+    async def asend_request(messages, tools=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return messages[-1].message.content
+    app.state.services.llm_client.asend_request = asend_request
+
+    prompts = [f"question {i}" for i in range(5)]
+    results = client.post("/api/v1/users/peter/batch", json={"prompts": prompts}).json()
+
+    assert [result["response"]["message"]["content"] for result in results] == [f"answer to {p}" for p in prompts]
+    assert len({result["chat_id"] for result in results}) == 5
+    assert peak == 2
+
+def test_batch_rejects_too_many_prompts(client, fake_configs):
+    fake_configs.yaml_values.batch_max_prompts = 2
+    response = client.post("/api/v1/users/peter/batch", json={"prompts": ["a", "b", "c"]})
+    assert response.status_code == 413
+
+def test_search_finds_a_users_messages_with_snippets_and_pages(client):
+    prompts = ["what is a controller?", "when is a DPIA required?", "who is the controller here?", "what is processing?"]
+    chat_ids = {}
+    for prompt in prompts:
+        chat_id = client.post("/api/v1/users/peter/chats").json()["id"]
+        client.post(f"/api/v1/users/peter/chats/{chat_id}/messages", json={"prompt": prompt})
+        chat_ids[prompt] = chat_id
+    other = client.post("/api/v1/users/paul/chats").json()["id"]
+    client.post(f"/api/v1/users/paul/chats/{other}/messages", json={"prompt": "is paul a controller?"})
+
+    # the prompt and its echoed answer in two chats, and nothing of paul's
+    first = client.get("/api/v1/users/peter/search", params={"q": "controller", "limit": 3}).json()
+    assert len(first["hits"]) == 3 and first["next_after_id"] == first["hits"][-1]["message_id"]
+    params = {"q": "controller", "limit": 3, "after_rank": first["next_after_rank"], "after_id": first["next_after_id"]}
+    second = client.get("/api/v1/users/peter/search", params=params).json()
+    assert len(second["hits"]) == 1 and second["next_after_id"] is None
+    hits = first["hits"] + second["hits"]
+    assert len({hit["message_id"] for hit in hits}) == 4
+    assert {hit["chat_id"] for hit in hits} == {chat_ids["what is a controller?"], chat_ids["who is the controller here?"]}
+    assert {hit["role"] for hit in hits} == {"user", "assistant"}
+    assert all("**controller**" in hit["snippet"] for hit in hits)
+
+    # the last word matches as a prefix, and FTS5 syntax is taken literally
+    hits = client.get("/api/v1/users/peter/search", params={"q": "DPIA requ"}).json()["hits"]
+    assert {hit["chat_id"] for hit in hits} == {chat_ids["when is a DPIA required?"]}
+    assert client.get("/api/v1/users/peter/search", params={"q": 'controller" OR "processing'}).json()["hits"] == []
+    assert client.get("/api/v1/users/nobody/search", params={"q": "controller"}).status_code == 404
+
+def test_archived_chats_can_be_listed_and_restored(app, client):
+    chat_id = client.post("/api/v1/users/peter/chats").json()["id"]
+    client.post(f"/api/v1/users/peter/chats/{chat_id}/messages", json={"prompt": "what is article 9?"})
+    app.state.configs.yaml_values.archive_path = app.state.configs.sqlite_path + ".archive"
+    app.state.services.db.archive_idle_chats(idle_seconds=-60)
+
+    assert client.get("/api/v1/users/peter/chats").json() == []
+    assert [chat["id"] for chat in client.get("/api/v1/users/peter/archived_chats").json()] == [chat_id]
+    assert client.post(f"/api/v1/users/paul/archived_chats/{chat_id}/restore").status_code == 404
+    response = client.post(f"/api/v1/users/peter/archived_chats/{chat_id}/restore")
+    assert response.status_code == 200 and response.json()["slug"] == "what is article 9?..."
+    messages = client.get(f"/api/v1/users/peter/chats/{chat_id}/messages").json()
+    assert [m["message"]["content"] for m in messages] == ["what is article 9?", "answer to what is article 9?"]
+
+def test_export_streams_a_users_chats(client):
+    chat_id = client.post("/api/v1/users/peter/chats").json()["id"]
+    client.post(f"/api/v1/users/peter/chats/{chat_id}/messages", json={"prompt": "what is article 9?"})
+    client.post("/api/v1/users/paul/chats")
+
+    response = client.get("/api/v1/users/peter/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert [item["type"] for item in items] == ["chat", "message", "message", "message"]
+    assert items[0]["id"] == chat_id and items[0]["user"] == "peter"
+    assert items[-1]["message"]["content"] == "answer to what is article 9?"
+    assert client.get("/api/v1/users/nobody/export").status_code == 404
@@ -0,0 +1,85 @@
+import gzip, json
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from rag_app.api import assets as assets_module
+from rag_app.api.assets import STATIC_DIR, PrecompressedStaticFiles, StaticAssets, build_static, check_vendored, fetch_vendored
+from rag_app.app.core.errors import VendoredFileError
+from rag_app.api.factory import create_app
+
+CSS = "body { color: black; }\n" * 50
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "styles.css").write_text(CSS)
+    (tmp_path / "vendor").mkdir()
+    (tmp_path / "vendor" / "tiny.js").write_text("let x = 1;")
+    return tmp_path
+
+@pytest.fixture
+def client(static_dir):
+    build_static(static_dir)
+    app = Starlette(routes=[Mount("/static", PrecompressedStaticFiles(directory=static_dir), name="static")])
+    return TestClient(app)
+
+def test_build_fingerprints_and_precompresses(static_dir):
+    manifest = build_static(static_dir)
+    assert manifest["styles.css"].startswith("dist/styles.") and manifest["styles.css"].endswith(".css")
+    assert manifest["vendor/tiny.js"].startswith("dist/vendor/tiny.")
+    assert json.loads((static_dir / "dist" / "manifest.json").read_text()) == manifest
+
+    built = static_dir / manifest["styles.css"]
+    assert gzip.decompress((static_dir / f"{manifest['styles.css']}.gz").read_bytes()) == built.read_bytes()
+    # too small to be worth compressing
+    assert not (static_dir / f"{manifest['vendor/tiny.js']}.gz").exists()
+    # a rebuild of the same files gives the same names
+    assert build_static(static_dir) == manifest
+
+def test_fingerprinted_files_are_immutable_and_served_compressed(static_dir, client):
+    path = json.loads((static_dir / "dist" / "manifest.json").read_text())["styles.css"]
+    response = client.get(f"/static/{path}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"].startswith("text/css")
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.text == CSS
+
+    plain = client.get(f"/static/{path}", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.text == CSS
+
+    unhashed = client.get("/static/styles.css")
+    assert unhashed.headers["Cache-Control"] == "no-cache"
+
+class FakeRequest:
+    def url_for(self, name, path):
+        return f"/static/{path}"
+
+def test_pages_link_to_fingerprinted_files(static_dir):
+    build_static(static_dir)
+    assets = StaticAssets(static_dir)
+    assert assets.url(FakeRequest(), "styles.css") == f"/static/{assets.manifest['styles.css']}"
+
+def test_vendored_scripts_are_committed_and_match_their_pins(tmp_path):
+    check_vendored(STATIC_DIR)
+    with pytest.raises(VendoredFileError):
+        check_vendored(tmp_path)
+    # pages never link to the CDN
+    assert StaticAssets(tmp_path).url(FakeRequest(), "vendor/htmx.min.js") == "/static/vendor/htmx.min.js"
+
+def test_a_download_that_doesnt_match_its_pin_is_refused(tmp_path, monkeypatch):
+    class FakeResponse:
+        content = b"alert('not htmx');"
+        def raise_for_status(self):
+            pass
+    monkeypatch.setattr(assets_module.requests, "get", lambda url, timeout: FakeResponse())
+    with pytest.raises(VendoredFileError):
+        fetch_vendored(tmp_path)
+    assert not (tmp_path / "vendor").exists()
+
+def test_pages_are_gzipped(fake_configs):
+    client = TestClient(create_app(configs=fake_configs))
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
@@ -0,0 +1,94 @@
+import time
+from email.utils import formatdate
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from rag_app.api.conditional import is_not_modified, make_etag
+from rag_app.api.factory import create_app
+from rag_app.app.models import Message, MessageDocuments
+
+
+@pytest.fixture
+def app(fake_configs):
+    return create_app(configs=fake_configs)
+
+@pytest.fixture
+def client(app):
+    client = TestClient(app)
+    client.get("/")
+    client.post("/create_user/", data={"user_name": "peter"})
+    return client
+
+def add_chat(app, user_name="peter") -> int:
+    db = app.state.services.db
+    chat_id = db.create_chat(user_id=db.check_user(user_name), init_message=MessageDocuments(message=Message(role="system")))
+    db.insert_message(chat_id=chat_id, msg_docs=MessageDocuments(message=Message(role="user", content="hi")))
+    db.insert_message(chat_id=chat_id, msg_docs=MessageDocuments(message=Message(role="assistant", content="**hello**")))
+    db.add_slug(chat_id=chat_id, slug="hi...")
+    return chat_id
+
+def revalidate(client, url, response):
+    return client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+
+def test_unchanged_pages_return_304_until_a_chat_changes(app, client):
+    chat_id = add_chat(app)
+    for url in ["/users/peter", f"/user/peter/chat/{chat_id}", f"/user/peter/chat/{chat_id}/panel", "/users/peter/chats"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "private, no-cache"
+        assert revalidate(client, url, response).status_code == 304
+
+    before = client.get(f"/user/peter/chat/{chat_id}")
+    app.state.services.db.insert_message(
+        chat_id=chat_id, msg_docs=MessageDocuments(message=Message(role="user", content="again")),
+        )
+    after = revalidate(client, f"/user/peter/chat/{chat_id}", before)
+    assert after.status_code == 200
+    assert "again" in after.text
+
+def test_main_page_changes_when_a_user_is_added(app, client):
+    response = client.get("/")
+    assert revalidate(client, "/", response).status_code == 304
+    app.state.services.db.create_user(user_name="paul")
+    assert revalidate(client, "/", response).status_code == 200
+
+def test_304_still_switches_the_session_to_the_chat(app, client):
+    first, second = add_chat(app), add_chat(app)
+    response = client.get(f"/user/peter/chat/{second}/panel")
+    client.get(f"/user/peter/chat/{first}/panel")
+
+    assert revalidate(client, f"/user/peter/chat/{second}/panel", response).status_code == 304
+    session = app.state.session_manager.get_session(client.cookies["session_id"])
+    assert session.chat.id == second
+
+def test_panel_and_message_block_are_fragments(app, client):
+    chat_id = add_chat(app)
+    panel = client.get(f"/user/peter/chat/{chat_id}/panel")
+    assert "<html>" not in panel.text
+    assert "<strong>hello</strong>" in panel.text
+
+    rows = app.state.services.db.get_messages(chat_id=chat_id)
+    user_id, assistant_id = rows[1][2], rows[2][2]
+    assert ">hi<" in client.get(f"/user/peter/chat/{chat_id}/messages/{user_id}").text
+    block = client.get(f"/user/peter/chat/{chat_id}/messages/{assistant_id}")
+    assert "<strong>hello</strong>" in block.text
+    assert revalidate(client, f"/user/peter/chat/{chat_id}/messages/{assistant_id}", block).status_code == 304
+
+def test_other_users_chats_are_not_found(app, client):
+    app.state.services.db.create_user(user_name="paul")
+    chat_id = add_chat(app, user_name="paul")
+    assert client.get(f"/user/peter/chat/{chat_id}").status_code == 404
+    assert client.get(f"/user/peter/chat/{chat_id}/messages/1").status_code == 404
+
+def test_if_modified_since_and_weak_etags():
+    def request(**headers):
+        return Request({"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]})
+
+    etag = make_etag("page", 1)
+    now = int(time.time())
+    assert is_not_modified(request(if_none_match=etag.removeprefix("W/")), etag)
+    assert is_not_modified(request(if_none_match='"other", ' + etag), etag)
+    assert not is_not_modified(request(if_none_match='"other"'), etag)
+    assert is_not_modified(request(if_modified_since=formatdate(now, usegmt=True)), etag, last_modified=now)
+    assert not is_not_modified(request(if_modified_since=formatdate(now - 10, usegmt=True)), etag, last_modified=now)
+    assert not is_not_modified(request(if_modified_since="garbage"), etag, last_modified=now)
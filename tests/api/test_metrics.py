@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from rag_app.api.factory import create_app
+from rag_app.app.models import Message, MessageDocuments
+
+
+def stage_count(stage: str) -> float:
+    return REGISTRY.get_sample_value("rag_app_stage_seconds_count", {"stage": stage}) or 0
+
+@pytest.fixture
+def app(fake_configs, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    app = create_app(configs=fake_configs)
+    app.state.services.db.create_user(user_name="peter")
+
+    async def asend_request(messages, tools=None):
+        return "hello"
+    app.state.services.llm_client.asend_request = asend_request
+    app.state.services.llm_client.get_messsage = lambda response: Message(role="assistant", content=response)
+    return app
+
+def test_a_turn_is_observed_and_scraped(app):
+    client = TestClient(app)
+    before = {stage: stage_count(stage) for stage in ["llm_first", "sqlite_write", "render"]}
+    in_flight = REGISTRY.get_sample_value("rag_app_in_flight_turns")
+
+    chat_id = client.post("/api/v1/users/peter/chats").json()["id"]
+    client.post(f"/api/v1/users/peter/chats/{chat_id}/messages", json={"prompt": "hi"})
+    client.get("/")
+
+    assert stage_count("llm_first") == before["llm_first"] + 1
+    # the chat with its system prompt, then the turn's messages in one write
+    assert stage_count("sqlite_write") == before["sqlite_write"] + 2
+    assert stage_count("render") == before["render"] + 1
+    assert REGISTRY.get_sample_value("rag_app_in_flight_turns") == in_flight
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'rag_app_stage_seconds_count{stage="llm_first"}' in response.text
+    assert "rag_app_live_sessions" in response.text
+
+def test_a_new_chat_is_one_sqlite_write(app):
+    db = app.state.services.db
+    before = stage_count("sqlite_write")
+    db.create_chat(user_id=db.check_user("peter"), init_message=MessageDocuments(message=Message(role="system", content="system prompt")))
+    assert stage_count("sqlite_write") == before + 1
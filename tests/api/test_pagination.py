@@ -0,0 +1,69 @@
+import re
+import pytest
+from fastapi.testclient import TestClient
+from rag_app.api.factory import create_app
+from rag_app.app.models import Message, MessageDocuments
+
+
+@pytest.fixture
+def app(fake_configs):
+    fake_configs.yaml_values.chat_window_messages = 4
+    fake_configs.yaml_values.chats_page_size = 2
+    return create_app(configs=fake_configs)
+
+@pytest.fixture
+def client(app):
+    client = TestClient(app)
+    client.get("/")
+    client.post("/create_user/", data={"user_name": "peter"})
+    return client
+
+def add_chat(app, turns: int) -> int:
+    db = app.state.services.db
+    chat_id = db.create_chat(user_id=db.check_user("peter"), init_message=MessageDocuments(message=Message(role="system")))
+    for i in range(turns):
+        db.insert_message(chat_id=chat_id, msg_docs=MessageDocuments(message=Message(role="user", content=f"question {i}")))
+        db.insert_message(chat_id=chat_id, msg_docs=MessageDocuments(message=Message(role="assistant", content=f"answer {i}")))
+    db.add_slug(chat_id=chat_id, slug=f"chat {chat_id}")
+    return chat_id
+
+def next_url(html: str, attribute: str = "hx-get", css_class: str = "load-older") -> str | None:
+    match = re.search(rf'class="{css_class}"[^>]*?{attribute}="([^"]+)"', html, re.S)
+    return match.group(1).replace("&amp;", "&") if match else None
+
+def test_chat_page_loads_the_latest_window_and_older_messages_on_scroll(app, client):
+    chat_id = add_chat(app, turns=5)
+    page = client.get(f"/user/peter/chat/{chat_id}").text
+    shown = re.findall(r"(?:question|answer) \d", page)
+    assert shown == ["question 3", "answer 3", "question 4", "answer 4"]
+
+    older = []
+    url = next_url(page)
+    while url:
+        fragment = client.get(url).text
+        older = re.findall(r"(?:question|answer) \d", fragment) + older
+        url = next_url(fragment)
+    assert older == ["question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2"]
+
+    # scrolling back doesn't grow the session's chat
+    session = app.state.session_manager.get_session(client.cookies["session_id"])
+    assert len(session.chat.messages) == 5
+
+def test_sidebar_loads_more_chats_with_a_cursor(app, client):
+    chat_ids = [add_chat(app, turns=1) for _ in range(5)]
+    page = client.get("/users/peter").text
+
+    seen = [int(chat_id) for chat_id in re.findall(r'href="[^"]*/chat/(\d+)"', page)]
+    url = next_url(page, css_class="load-more")
+    while url:
+        fragment = client.get(url).text
+        seen += [int(chat_id) for chat_id in re.findall(r'href="[^"]*/chat/(\d+)"', fragment)]
+        url = next_url(fragment, css_class="load-more")
+    assert seen == sorted(chat_ids, reverse=True)
+
+def test_api_pages_through_messages(app, client):
+    chat_id = add_chat(app, turns=3)
+    latest = client.get(f"/api/v1/users/peter/chats/{chat_id}/messages", params={"limit": 2}).json()
+    assert [m["message"]["content"] for m in latest] == ["question 2", "answer 2"]
+    before = client.get(f"/api/v1/users/peter/chats/{chat_id}/messages", params={"limit": 2, "before_id": latest[0]["id"]}).json()
+    assert [m["message"]["content"] for m in before] == ["question 1", "answer 1"]
@@ -0,0 +1,71 @@
+import pytest
+from rag_app.api.factory import create_app
+from rag_app.api.rendering import MessageRenderer
+from rag_app.app.models import Message, MessageDocuments, ChromaDbResult
+
+
+class CountingTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.filename = template.filename
+        self.calls = 0
+
+    def render(self, **context):
+        self.calls += 1
+        return self.template.render(**context)
+
+
+@pytest.fixture
+def app(fake_configs):
+    return create_app(configs=fake_configs)
+
+@pytest.fixture
+def messages(app):
+    db = app.state.services.db
+    db.create_user(user_name="peter")
+    chat_id = db.create_chat(user_id=db.check_user("peter"), init_message=MessageDocuments(message=Message(role="system")))
+    documents = [ChromaDbResult(id="doc", document="article text", metadata={"article": "9"})]
+    messages = [
+        MessageDocuments(message=Message(role="assistant", content="| a | b |\n|---|---|\n| 1 | 2 |"), documents=documents),
+        MessageDocuments(message=Message(role="assistant", content="**bold**")),
+        ]
+    for msg_docs in messages:
+        msg_docs.id = db.insert_message(chat_id=chat_id, msg_docs=msg_docs)
+    return messages
+
+def counting_renderer(app, max_entries=2000) -> MessageRenderer:
+    renderer = MessageRenderer(templates=app.state.templates, db=app.state.services.db, max_entries=max_entries)
+    renderer.template = CountingTemplate(renderer.template)
+    return renderer
+
+def test_render_caches_in_memory_and_in_sqlite(app, messages):
+    renderer = counting_renderer(app)
+    first = renderer.render_many(messages)
+    assert "<table>" in first[0] and "article text" in first[0]
+    assert "<strong>bold</strong>" in first[1]
+    assert renderer.render_many(messages) == first
+    assert renderer.template.calls == 2
+
+    # a new process starts with an empty LRU but finds the HTML next to the message rows
+    fresh = counting_renderer(app)
+    assert fresh.render_many(messages) == first
+    assert fresh.template.calls == 0
+
+def test_template_change_and_unsaved_messages_render_again(app, messages):
+    renderer = counting_renderer(app)
+    renderer.render_many(messages)
+
+    changed = counting_renderer(app)
+    changed.version = "another template"
+    changed.render_many(messages)
+    assert changed.template.calls == 2
+
+    unsaved = MessageDocuments(message=Message(role="assistant", content="LLM call failed"))
+    changed.render(unsaved)
+    changed.render(unsaved)
+    assert changed.template.calls == 4
+
+def test_lru_keeps_at_most_max_entries(app, messages):
+    renderer = counting_renderer(app, max_entries=1)
+    renderer.render_many(messages)
+    assert list(renderer._cache) == [messages[1].id]
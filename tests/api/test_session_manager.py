@@ -0,0 +1,189 @@
+import pytest
+from rag_app.api.session_manager import SessionManager
+from rag_app.api.session_store import SessionStore
+from rag_app.app.services.session import Session
+from rag_app.app.services.container import Services
+from tests.services.utils import build_db
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def sm(clock):
+    return SessionManager(ttl_seconds=10, max_sessions=2, clock=clock)
+
+def test_add_and_get_session(sm, fake_configs):
+    session = sm.add_session(Session(configs=fake_configs))
+    assert sm.has_session(session.id)
+    assert sm.get_session(session.id) is session
+    assert sm.get_session("missing") is None
+    assert sm.get_session(None) is None
+    assert sm.live == 1
+
+def test_session_expires_after_ttl(sm, clock, fake_configs):
+    session = sm.add_session(Session(configs=fake_configs))
+    clock.now = 11
+    assert sm.get_session(session.id) is None
+    assert session.db is None
+    assert sm.stats() == {"live": 0, "evicted": 0, "expired": 1}
+
+def test_get_session_refreshes_ttl(sm, clock, fake_configs):
+    session = sm.add_session(Session(configs=fake_configs))
+    clock.now = 8
+    sm.get_session(session.id)
+    clock.now = 16
+    assert sm.get_session(session.id) is session
+
+def test_lru_eviction_releases_session(sm, clock, fake_configs):
+    first = sm.add_session(Session(configs=fake_configs))
+    second = sm.add_session(Session(configs=fake_configs))
+
+    # touching the first session makes the second one the least recently used
+    clock.now = 1
+    sm.get_session(first.id)
+    third = sm.add_session(Session(configs=fake_configs))
+
+    assert sm.has_session(first.id)
+    assert not sm.has_session(second.id)
+    assert sm.has_session(third.id)
+    assert second.chat is None and second.llm_client is None and second.tool_client is None
+    assert sm.stats() == {"live": 2, "evicted": 1, "expired": 0}
+
+def test_busy_session_is_closed_after_its_turn(clock, fake_configs):
+    running = set()
+    sm = SessionManager(ttl_seconds=10, max_sessions=1, clock=clock, busy=lambda session_id: session_id in running)
+    first = sm.add_session(Session(configs=fake_configs))
+    running.add(first.id)
+
+    # evicted while its turn is running, so the turn keeps its clients
+    sm.add_session(Session(configs=fake_configs))
+    assert not sm.has_session(first.id)
+    assert first.db is not None
+    sm.cleanup_expired()
+    assert first.db is not None
+
+    running.clear()
+    sm.cleanup_expired()
+    assert first.db is None
+
+def test_cleanup_expired(sm, clock, fake_configs):
+    old = sm.add_session(Session(configs=fake_configs))
+    clock.now = 5
+    recent = sm.add_session(Session(configs=fake_configs))
+    clock.now = 12
+    assert sm.cleanup_expired() == 1
+    assert not sm.has_session(old.id)
+    assert sm.has_session(recent.id)
+
+def test_reaper_start_stop(fake_configs):
+    sm = SessionManager(ttl_seconds=0, reap_interval=0.01)
+    sm.add_session(Session(configs=fake_configs))
+    sm.start_reaper()
+    sm._stop.wait(0.2)
+    sm.stop_reaper()
+    assert sm.live == 0
+    assert sm.expired == 1
+
+def test_reaper_keeps_going_after_a_failed_sweep(fake_configs):
+    sm = SessionManager(ttl_seconds=0, reap_interval=0.01, logger=fake_configs.logger)
+    sm.add_session(Session(configs=fake_configs))
+    sweep, failures = sm.cleanup_expired, []
+
+    def flaky():
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        return sweep()
+
+    sm.cleanup_expired = flaky
+    sm.start_reaper()
+    sm._stop.wait(0.2)
+    sm.stop_reaper()
+    assert failures == [1]
+    assert sm.live == 0
+
+@pytest.fixture
+def store(fake_configs):
+    return SessionStore(configs=fake_configs)
+
+def make_worker(fake_configs, services, store):
+    return SessionManager(
+        store=store,
+        session_factory=lambda session_id: Session(configs=fake_configs, services=services, session_id=session_id),
+    )
+
+def test_session_rebuilt_from_store_by_another_worker(fake_configs, store):
+    services = Services.build(configs=fake_configs)
+    services.db.create_user("peter")
+    worker_a = make_worker(fake_configs, services, store)
+    worker_b = make_worker(fake_configs, services, store)
+
+    session = worker_a.add_session(Session(configs=fake_configs, services=services))
+    session.load_user(user_name="peter")
+    worker_a.save(session)
+
+    rebuilt = worker_b.get_session(session.id)
+    assert rebuilt is not session
+    assert rebuilt.id == session.id
+    assert rebuilt.user.name == "peter"
+    # a second lookup is served from memory
+    assert worker_b.get_session(session.id) is rebuilt
+
+def test_stale_cached_session_is_refreshed(fake_configs, store, fake_messages):
+    services = Services.build(configs=fake_configs)
+    build_db(fake_db=services.db, fake_messages=fake_messages)
+    worker_a = make_worker(fake_configs, services, store)
+    worker_b = make_worker(fake_configs, services, store)
+
+    session = worker_a.add_session(Session(configs=fake_configs, services=services))
+    session.load_user(user_name="peter")
+    worker_a.save(session)
+
+    on_b = worker_b.get_session(session.id)
+    on_b.load_chat(chat_id=1)
+    worker_b.save(on_b)
+
+    refreshed = worker_a.get_session(session.id)
+    assert refreshed is not session
+    assert refreshed.chat.id == 1
+
+def test_removed_session_is_gone_for_every_worker(fake_configs, store):
+    services = Services.build(configs=fake_configs)
+    worker_a = make_worker(fake_configs, services, store)
+    worker_b = make_worker(fake_configs, services, store)
+    session = worker_a.add_session(Session(configs=fake_configs, services=services))
+    assert worker_b.has_session(session.id)
+
+    worker_a.remove_session(session.id)
+    assert not worker_b.has_session(session.id)
+
+def test_store_expiry(fake_configs, store):
+    store.save(session_id="old", user_name=None, chat_id=None)
+    with store._get_conn() as conn:
+        conn.execute("UPDATE web_sessions SET updated_at = 0 WHERE id = 'old'")
+    store.save(session_id="new", user_name=None, chat_id=None)
+    assert store.delete_expired(ttl_seconds=60) == 1
+    assert store.load("old") is None
+    assert store.load("new") is not None
+
+def test_stream_tickets_are_claimed_once(fake_configs, store):
+    stream_id = store.save_stream(session_id="session", prompt="what is a controller?", tool_names=["gdpr_query"])
+    # another session can't open the stream
+    assert store.claim_stream(session_id="other", stream_id=stream_id) is None
+    assert store.claim_stream(session_id="session", stream_id=stream_id) == ("what is a controller?", ["gdpr_query"])
+    assert store.claim_stream(session_id="session", stream_id=stream_id) is None
+
+    expired = store.save_stream(session_id="session", prompt="stale", tool_names=[])
+    with store._get_conn() as conn:
+        conn.execute("UPDATE stream_tickets SET created_at = 0 WHERE id = ?", (expired,))
+    assert store.claim_stream(session_id="session", stream_id=expired) is None
@@ -0,0 +1,128 @@
+import asyncio, threading
+from rag_app.api.turns import TurnTracker
+
+
+def test_turns_for_a_session_run_one_at_a_time():
+    tracker = TurnTracker()
+    log = []
+
+    def make_turn(name):
+        async def turn():
+            log.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            log.append(f"{name} end")
+            return name
+        return turn
+
+    async def main():
+        return await asyncio.gather(
+            tracker.run("chat:1", make_turn("first")),
+            tracker.run("chat:1", make_turn("second")),
+        )
+
+    assert asyncio.run(main()) == ["first", "second"]
+    assert log == ["first start", "first end", "second start", "second end"]
+    assert tracker.in_flight == 0
+    assert not tracker.busy("session")
+
+def test_retry_with_the_same_idempotency_key_joins_in_flight_turn():
+    tracker = TurnTracker()
+    calls = []
+
+    async def turn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(
+            tracker.run("chat:1", turn, idempotency_key="abc"),
+            tracker.run("chat:1", turn, idempotency_key="abc"),
+        )
+
+    assert asyncio.run(main()) == ["answer", "answer"]
+    assert len(calls) == 1
+
+    async def without_keys():
+        return await asyncio.gather(tracker.run("chat:1", turn), tracker.run("chat:1", turn))
+
+    # the same question asked twice, on purpose, gets asked twice
+    asyncio.run(without_keys())
+    assert len(calls) == 3
+
+def test_status_reports_running_and_queued_turns():
+    tracker = TurnTracker()
+    release = None
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+
+        async def turn():
+            await release.wait()
+
+        first = asyncio.create_task(tracker.run("session", turn))
+        second = asyncio.create_task(tracker.run("session", turn))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        status = tracker.status("session")
+        release.set()
+        await asyncio.gather(first, second)
+        return status
+
+    status = asyncio.run(main())
+    assert status["in_progress"] is True
+    assert status["queued"] == 1
+    assert tracker.status("session") == {"in_progress": False, "queued": 0, "started_at": None}
+
+def test_hold_queues_behind_running_turn():
+    tracker = TurnTracker()
+    log = []
+
+    async def main():
+        async def turn():
+            log.append("run start")
+            await asyncio.sleep(0.01)
+            log.append("run end")
+
+        async def streamed():
+            await asyncio.sleep(0)
+            async with tracker.hold("chat:1", session_id="session"):
+                assert tracker.busy("session")
+                log.append("hold")
+
+        await asyncio.gather(tracker.run("chat:1", turn, idempotency_key="abc"), streamed())
+
+    asyncio.run(main())
+    assert log == ["run start", "run end", "hold"]
+    assert tracker.in_flight == 0
+    assert not tracker.busy("session")
+
+def test_busy_can_be_asked_from_another_thread_while_turns_come_and_go():
+    tracker = TurnTracker()
+    errors, seen, stop = [], set(), threading.Event()
+
+    def reaper():
+        while not stop.is_set():
+            try:
+                seen.update(session for session in ("a", "b") if tracker.busy(session))
+            except Exception as e:
+                errors.append(e)
+
+    async def turn():
+        await asyncio.sleep(0)
+
+    async def main():
+        for n in range(200):
+            await asyncio.gather(*(
+                tracker.run(f"chat:{n}:{i}", turn, session_id="a" if i % 2 else "b") for i in range(10)
+                ))
+
+    thread = threading.Thread(target=reaper)
+    thread.start()
+    asyncio.run(main())
+    stop.set()
+    thread.join()
+    assert errors == []
+    assert seen == {"a", "b"}
+    assert not tracker.busy("a") and not tracker.busy("b")
@@ -1,4 +1,4 @@
-import pytest, logging, uuid, json, time
+import pytest, logging, uuid, json, time, sqlite3
 from rag_app.app.core.config import Configurations
 from rag_app.app.services.db_manager import DatabaseManager
 from rag_app.app.models import *
@@ -64,6 +64,9 @@ def fake_logger():
 @pytest.fixture
 def fake_configs(fake_logger):
     unique_db = f"file:memdb_{uuid.uuid4().hex}?mode=memory&cache=shared"
+    # a shared in-memory database is dropped as soon as its last connection closes,
+    # so keep one open for the whole test
+    anchor = sqlite3.connect(unique_db, uri=True)
 
     configs = ConfigurationsModel(
         model="llama",
@@ -76,6 +79,7 @@ def fake_configs(fake_logger):
         sqlite_path=unique_db,
         system_prompt="system prompt"
     )
-    return Configurations.from_model(logger=fake_logger, configs_model=configs)
+    yield Configurations.from_model(logger=fake_logger, configs_model=configs)
+    anchor.close()
 
 
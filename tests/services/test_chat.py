@@ -18,7 +18,7 @@ def mock_db():
     db.create_chat.return_value = 1
     mock_message = Message(role='system', content="system prompt")
     db.get_messages.return_value = [
-        (json.dumps(mock_message.model_dump()), None)
+        (mock_message.model_dump(), None)
         ]
     return db
 
@@ -47,4 +47,21 @@ def test_instantiate_chat_with_existing_id(fake_configs, mock_user, fake_message
     # run the test:
     chat = Chat(user=mock_user, db=fake_db, configs=fake_configs, chat_id=1)
     fake_msg_docs = chat.messages[0]
-    assert fake_msg_docs.message.content == "fake prompt"
\ No newline at end of file
+    assert fake_msg_docs.message.content == "fake prompt"
+def test_load_recent_window_and_older(fake_configs, mock_user):
+    fake_configs.yaml_values.chat_window_messages = 3
+    db = DatabaseManager(configs=fake_configs)
+    chat = Chat(user=mock_user, db=db, configs=fake_configs)
+    chat.init_chat("prompt 0")
+    for i in range(1, 6):
+        chat.add_message(MessageDocuments(message=Message(role="user", content=f"prompt {i}")))
+
+    loaded = Chat(user=mock_user, db=db, configs=fake_configs, chat_id=chat.id)
+    assert loaded.has_older
+    assert [m.message.content for m in loaded.messages] == ["system prompt", "prompt 3", "prompt 4", "prompt 5"]
+
+    older = loaded.load_older()
+    assert [m.message.content for m in older] == ["prompt 0", "prompt 1", "prompt 2"]
+    assert len(loaded.messages) == 7
+    assert loaded.load_older() == []
+    assert not loaded.has_older
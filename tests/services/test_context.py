@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.context import ContextBuilder
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.user import User
+from rag_app.app.models import *
+
+
+@pytest.fixture
+def db(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    db.create_user("test_user")
+    return db
+
+@pytest.fixture
+def chat(fake_configs, db):
+    user = User(configs=fake_configs, db=db, user_name="test_user")
+    chat = Chat(user=user, db=db, configs=fake_configs)
+    chat.init_chat("question 1")
+    chat.add_message(MessageDocuments(message=Message(role="assistant", content="answer 1")))
+    tool_call = ToolCall(id="call_1", type="function", function=FunctionCall(name="gdpr_query", arguments="{}"))
+    chat.add_message(MessageDocuments(message=Message(role="user", content="question 2")))
+    chat.add_message(MessageDocuments(message=Message(role="assistant", tool_calls=[tool_call])))
+    chat.add_message(MessageDocuments(message=Message(role="tool", tool_call_id="call_1", content="documents")))
+    chat.add_message(MessageDocuments(message=Message(role="assistant", content="answer 2")))
+    chat.add_message(MessageDocuments(message=Message(role="user", content="question 3")))
+    return chat
+
+@pytest.fixture
+def builder(fake_configs, db):
+    llm_client = MagicMock()
+    builder = ContextBuilder(configs=fake_configs, db=db, llm_client=llm_client)
+    # every message costs 10 tokens
+    builder.count_tokens = MagicMock(return_value=10)
+    builder._schedule_summary = MagicMock()
+    return builder
+
+def contents(context):
+    return [msg_docs.message.content for msg_docs in context]
+
+def test_build_sends_everything_within_budget(builder, chat, fake_configs):
+    fake_configs.yaml_values.context_token_budget = 1000
+    context = builder.build(chat)
+    assert len(context) == len(chat.messages)
+    builder._schedule_summary.assert_not_called()
+
+def test_build_drops_old_turns_and_schedules_summary(builder, chat, fake_configs):
+    fake_configs.yaml_values.context_token_budget = 60
+    fake_configs.yaml_values.context_keep_turns = 1
+
+    context = builder.build(chat)
+
+    # system prompt + the tool-using turn (4 messages) + the last turn (1 message)
+    assert contents(context) == ["system prompt", "question 2", None, "documents", "answer 2", "question 3"]
+    first_turn_end = chat.messages[2].id
+    builder._schedule_summary.assert_called_once_with(chat_id=chat.id, up_to_message_id=first_turn_end)
+
+def test_build_always_keeps_recent_turns(builder, chat, fake_configs):
+    fake_configs.yaml_values.context_token_budget = 1
+    fake_configs.yaml_values.context_keep_turns = 2
+    context = builder.build(chat)
+    assert contents(context)[0] == "system prompt"
+    assert contents(context)[1] == "question 2"
+    assert contents(context)[-1] == "question 3"
+
+def test_build_uses_stored_summary(builder, chat, db, fake_configs):
+    fake_configs.yaml_values.context_token_budget = 1000
+    db.upsert_summary(chat_id=chat.id, up_to_message_id=chat.messages[2].id, summary="earlier stuff")
+
+    context = builder.build(chat)
+
+    assert contents(context)[:3] == [
+        "system prompt",
+        "Summary of the earlier conversation:\nearlier stuff",
+        "question 2",
+        ]
+    builder._schedule_summary.assert_not_called()
+
+def test_summarise_stores_summary(builder, chat, db):
+    response_message = Message(role="assistant", content="a short summary")
+    builder.llm_client.get_messsage.return_value = response_message
+    builder._summarise(chat_id=chat.id, up_to_message_id=chat.messages[2].id)
+
+    assert db.get_summary(chat_id=chat.id) == (chat.messages[2].id, "a short summary")
+    sent = builder.llm_client.send_request.call_args.kwargs["messages"]
+    assert "user: question 1" in sent[1].message.content
+    assert "assistant: answer 1" in sent[1].message.content
+
+def test_count_tokens_caches_stored_messages(fake_configs, db):
+    builder = ContextBuilder(configs=fake_configs, db=db, llm_client=MagicMock())
+    msg_docs = MessageDocuments(message=Message(role="user", content="hello"), id=7)
+    with patch("rag_app.app.services.context.litellm.token_counter", return_value=5) as counter:
+        assert builder.count_tokens(msg_docs) == 5
+        assert builder.count_tokens(msg_docs) == 5
+    counter.assert_called_once()
@@ -5,6 +5,7 @@ from rag_app.app.services.db_manager import DatabaseManager
 from rag_app.app.services.chat import Chat
 from rag_app.app.services.user import User
 from rag_app.app.models import *
+from tests.services.utils import add_chat
 
 
 mock_logger = logging.getLogger(name="mock_logger")
@@ -63,16 +64,18 @@ def test_create_chat(fake_configs):
                 )
             ]
         )
-    mock_message_blob = json.dumps(mock_message.message.model_dump())
-    mock_documents_blob = json.dumps([doc.model_dump() for doc in mock_message.documents])
     with db._get_conn() as conn:
         cursor = conn.cursor()
         chat_id = db.create_chat(user_id=1, init_message=mock_message)
-        cursor.execute("SELECT message, documents FROM messages WHERE chat_id = ?", (chat_id,))
+        cursor.execute("SELECT role, content, documents FROM messages WHERE chat_id = ?", (chat_id,))
         row = cursor.fetchone()
         assert chat_id > 0
-        assert row[0] == mock_message_blob
-        assert row[1] == mock_documents_blob
+        assert row[:2] == (mock_message.message.role, mock_message.message.content)
+        # the message only refers to its documents
+        [[chroma_id, _]] = json.loads(row[2])
+        assert chroma_id == "id"
+    [stored] = Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)
+    assert stored.documents == mock_message.documents
 
 def test_insert_message(fake_configs):
     db = DatabaseManager(configs=fake_configs)
@@ -93,11 +96,11 @@ def test_insert_message(fake_configs):
     # get the updated blob from the database and compare it to test blob
     with db._get_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT message FROM messages WHERE chat_id=?", (chat_id,))
+        cursor.execute("SELECT role, content FROM messages WHERE chat_id=?", (chat_id,))
         rows = cursor.fetchall()
         msg_blob = json.dumps([
             MessageDocuments(
-                message=Message(**json.loads(row[0]))
+                message=Message(role=row[0], content=row[1])
                 ).model_dump(mode="json")
                 for row in rows
                 ])
@@ -114,6 +117,123 @@ def test_get_messages(fake_configs):
 
     # use the method to get the messages from the db
     messages = db.get_messages(chat_id=chat_id)
-    test_message = MessageDocuments(message=Message(**json.loads(messages[0][0])))
+    test_message = MessageDocuments(message=Message(**messages[0][0]))
     message_blob = json.dumps([test_message.model_dump()])
     assert mock_blob == message_blob
+
+def test_get_chats_pages_by_updated_at_and_id(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    chat_ids = [add_chat(db) for _ in range(5)]
+    user_id = db.check_user("test_user")
+    # several chats share an updated_at, so the id has to break the tie
+    with db._get_conn() as conn:
+        conn.executemany("UPDATE chats SET updated_at = ? WHERE id = ?", [(100, chat_ids[0]), (200, chat_ids[1]), (200, chat_ids[2]), (200, chat_ids[3]), (300, chat_ids[4])])
+
+    pages, before = [], None
+    while page := db.get_chats(user_id=user_id, limit=2, before=before):
+        pages.append([row[0] for row in page])
+        before = (page[-1][2], page[-1][0])
+    assert pages == [[chat_ids[4], chat_ids[3]], [chat_ids[2], chat_ids[1]], [chat_ids[0]]]
+
+def test_documents_are_stored_once(fake_configs, fake_messages):
+    db = DatabaseManager(configs=fake_configs)
+    chat_ids = [add_chat(db, turn=[fake_messages.model_copy(deep=True)]) for _ in range(3)]
+    # the same document under a new version gets a row of its own
+    changed = fake_messages.model_copy(deep=True)
+    changed.documents[0].document = "fake document1, revised"
+    db.insert_message(chat_id=chat_ids[0], msg_docs=changed)
+
+    with db._get_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 3
+    loaded = Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_ids[0]), db=db)
+    assert loaded[1].documents == fake_messages.documents
+    assert loaded[2].documents == changed.documents
+
+def test_messages_with_inline_documents_still_load(fake_configs, fake_messages):
+    db = DatabaseManager(configs=fake_configs)
+    chat_id = add_chat(db)
+    # written before the documents table existed
+    with db._get_conn() as conn:
+        conn.execute(
+            "INSERT INTO messages (chat_id, role, content, documents) VALUES (?, ?, ?, ?)",
+            (chat_id, fake_messages.message.role, fake_messages.message.content, json.dumps([d.model_dump() for d in fake_messages.documents]))
+            )
+    loaded = Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)
+    assert loaded[1].documents == fake_messages.documents
+
+def test_large_values_are_compressed_and_read_back(fake_configs, fake_messages):
+    fake_configs.yaml_values.blob_compression_min_bytes = 500
+    db = DatabaseManager(configs=fake_configs)
+    chat_id = add_chat(db)
+    tool = MessageDocuments(message=Message(role="tool", content="article text " * 100, tool_call_id="call_1"))
+    db.insert_message(chat_id=chat_id, msg_docs=tool)
+
+    with db._get_conn() as conn:
+        kinds = conn.execute("SELECT typeof(content) FROM messages WHERE chat_id = ? ORDER BY id", (chat_id,)).fetchall()
+    # the short system prompt stays as it was
+    assert kinds == [("text",), ("blob",)]
+    loaded = Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)
+    assert loaded[1].message == tool.message
+
+def test_compress_existing_rows(fake_configs, fake_messages):
+    db = DatabaseManager(configs=fake_configs)
+    chat_id = add_chat(db)
+    tool = MessageDocuments(message=Message(role="tool", content="article text " * 100, tool_call_id="call_1"))
+    db.insert_message(chat_id=chat_id, msg_docs=tool)
+
+    # stored uncompressed under the default threshold of 2048 bytes
+    fake_configs.yaml_values.blob_compression_min_bytes = 500
+    db = DatabaseManager(configs=fake_configs)
+    stats = db.compress_existing()
+    assert stats["compressed"] == 1 and stats["bytes_after"] < stats["bytes_before"]
+    assert db.compress_existing()["compressed"] == 0
+    assert Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)[1].message == tool.message
+
+def test_messages_round_trip_through_columns(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    chat_id = add_chat(db)
+    calls = [
+        ToolCall(id="call_1", type="function", function=FunctionCall(name="gdpr_query", arguments='{"query": "article 9"}')),
+        ToolCall(id="call_2", type="function", function=FunctionCall(name="gdpr_get_article", arguments='{"number": 9}')),
+        ]
+    turn = [
+        MessageDocuments(message=Message(role="user", content="what is article 9?")),
+        MessageDocuments(message=Message(role="assistant", tool_calls=calls, provider_specific_fields={"cached": True})),
+        MessageDocuments(message=Message(role="tool", content="Article 9", tool_call_id="call_1")),
+        MessageDocuments(message=Message(role="assistant", content="special categories")),
+        ]
+    db.save_turn(chat_id=chat_id, msg_docs=turn)
+
+    loaded = Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)
+    assert [item.message for item in loaded[1:]] == [item.message for item in turn]
+    assert db.get_message(chat_id=chat_id, message_id=turn[1].id)[0]["tool_calls"][1]["id"] == "call_2"
+    assert db.get_message_texts(chat_id=chat_id, after_id=turn[0].id) == [
+        ("assistant", None), ("tool", "Article 9"), ("assistant", "special categories"),
+        ]
+
+def test_search_only_finds_the_users_own_messages_and_pages_by_rank(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    chats = {name: add_chat(db, name) for name in ("peter", "paul", "mary")}
+    users = {name: db.check_user(name) for name in chats}
+    for name, user_id in users.items():
+        # everyone writes the other users' ids too, so they can't be taken for the owner
+        others = " ".join(str(other) for other in users.values() if other != user_id)
+        db.save_turn(chat_id=chats[name], msg_docs=[
+            MessageDocuments(message=Message(role="user", content=f"controller question {i} from {name} {others}"))
+            for i in range(5)
+            ])
+
+    for name, user_id in users.items():
+        pages, after = [], None
+        while True:
+            rows = db.search_messages(user_id=user_id, text="controller", limit=2, after=after)
+            if not rows:
+                break
+            pages.append(rows)
+            after = (rows[-1][5], rows[-1][0])
+        hits = [row for page in pages for row in page]
+        assert len(pages) == 3 and len(hits) == len({row[0] for row in hits}) == 5
+        assert {row[1] for row in hits} == {chats[name]}
+        assert [(row[5], row[0]) for row in hits] == sorted((row[5], row[0]) for row in hits)
+        for other in users.values():
+            assert {row[1] for row in db.search_messages(user_id=user_id, text=str(other))} <= {chats[name]}
@@ -1,4 +1,5 @@
-import pytest, logging
+import pytest, logging, asyncio
+import httpx
 from unittest.mock import patch, MagicMock
 from rag_app.app.core.config import Configurations
 from rag_app.app.services.embeddings import EmbeddingsClient
@@ -16,4 +17,20 @@ def test_embedder_output(embeder):
     mock_resp.status_code = 200
     with patch("rag_app.app.services.embeddings.requests.post", return_value=mock_resp):
         result = embeder.embed("test text")
-    assert result == fake_embedding
\ No newline at end of file
+    assert result == fake_embedding
+def test_embedder_aembed(embeder):
+    def handler(request):
+        assert request.url.path == "/embeddings"
+        return httpx.Response(200, json={"embedding": [0.1, 0.2]})
+
+    async def run():
+        embeder._async_client = httpx.AsyncClient(
+            base_url=embeder.configs.embeddings_url,
+            transport=httpx.MockTransport(handler),
+            )
+        try:
+            return await embeder.aembed("test text")
+        finally:
+            await embeder.aclose()
+
+    assert asyncio.run(run()) == [0.1, 0.2]
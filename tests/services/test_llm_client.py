@@ -1,7 +1,10 @@
-import pytest
-from unittest.mock import MagicMock
+import pytest, asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+from litellm import RateLimitError
+from prometheus_client import REGISTRY
 from rag_app.app.services.llm_client import LlmClient
-from rag_app.app.models import Message
+from rag_app.app.core.errors import LlmCallFailedError
+from rag_app.app.models import Message, MessageDocuments
 
 @pytest.fixture
 def llm_client(fake_configs):
@@ -22,4 +25,34 @@ def test_llm_client_get_message(llm_client):
 
     assert isinstance(result, Message)
     assert result.role == "user"
-    assert result.content == "test content"
\ No newline at end of file
+    assert result.content == "test content"
+def test_asend_request_retries_rate_limits(llm_client):
+    rate_limit = RateLimitError(message="slow down", llm_provider="openai", model="llama")
+    fake_acompletion = AsyncMock(side_effect=[rate_limit, "response"])
+    with patch("rag_app.app.services.llm_client.acompletion", fake_acompletion), \
+         patch("rag_app.app.services.llm_client.asyncio.sleep", AsyncMock()) as fake_sleep:
+        result = asyncio.run(llm_client.asend_request(
+            messages=[MessageDocuments(message=Message(role="user", content="hi"))]
+            ))
+    assert result == "response"
+    assert fake_acompletion.await_count == 2
+    fake_sleep.assert_awaited_once_with(2)
+
+def test_asend_request_unrecoverable_error(llm_client):
+    with patch("rag_app.app.services.llm_client.acompletion", AsyncMock(side_effect=ValueError("bad"))):
+        with pytest.raises(LlmCallFailedError):
+            asyncio.run(llm_client.asend_request(
+                messages=[MessageDocuments(message=Message(role="user", content="hi"))]
+                ))
+
+def test_retries_and_failures_are_counted(llm_client):
+    rate_limit = RateLimitError(message="slow down", llm_provider="openai", model="llama")
+    retries = REGISTRY.get_sample_value("rag_app_retries_total", {"cause": "rate_limit"}) or 0
+    errors = REGISTRY.get_sample_value("rag_app_errors_total", {"component": "llm"}) or 0
+
+    llm_client._check_retry(rate_limit, attempt=1, backoff=2)
+    with pytest.raises(LlmCallFailedError):
+        llm_client._check_retry(ValueError("bad"), attempt=1, backoff=2)
+
+    assert REGISTRY.get_sample_value("rag_app_retries_total", {"cause": "rate_limit"}) == retries + 1
+    assert REGISTRY.get_sample_value("rag_app_errors_total", {"component": "llm"}) == errors + 1
@@ -0,0 +1,128 @@
+import json, sqlite3
+import pytest
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.migrations import MIGRATIONS, Migration, migrate, schema_version
+
+
+def query_plan(conn, query, params) -> str:
+    return " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+
+def test_new_database_is_at_the_latest_version(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    with db._get_conn() as conn:
+        assert schema_version(conn) == MIGRATIONS[-1].version
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_messages_chat", "idx_chats_user_updated"} <= indexes
+
+def test_old_database_is_upgraded_in_place(tmp_path):
+    path = str(tmp_path / "old.db")
+    # a database from before the schema had a version: no rendered columns, no indexes
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE users (id INTEGER PRIMARY KEY, user_name TEXT UNIQUE, created_at INTEGER);
+        CREATE TABLE chats (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, slug TEXT, created_at INTEGER, updated_at INTEGER);
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, message TEXT, documents TEXT, created_at INTEGER);
+        INSERT INTO users (user_name, created_at) VALUES ('old_user', 1);
+        INSERT INTO chats (user_id, slug, created_at) VALUES (1, 'old chat', 5);
+        INSERT INTO messages (chat_id, message, created_at) VALUES (1, '{"role": "user", "content": "what is article 9?"}', 5);
+        INSERT INTO messages (chat_id, message, documents, created_at)
+            VALUES (1, '{}', '[{"id": "art9", "document": "Article 9", "metadata": {"n": 9}}]', 6);
+        INSERT INTO messages (chat_id, message, documents, created_at)
+            VALUES (1, '{}', '[{"id": "art9", "document": "Article 9", "metadata": {"n": 9}}]', 7);
+        """
+    )
+    assert schema_version(conn) == 0
+
+    assert migrate(conn) == MIGRATIONS[-1].version
+    assert conn.execute("SELECT slug, updated_at FROM chats").fetchall() == [("old chat", 5)]
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    assert {"rendered_html", "rendered_version"} <= columns
+    # the copies of the same document became references to a single row
+    assert conn.execute("SELECT chroma_id, document FROM documents").fetchall() == [("art9", "Article 9")]
+    refs = [json.loads(row[0]) for row in conn.execute("SELECT documents FROM messages WHERE documents IS NOT NULL")]
+    assert refs[0] == refs[1] and refs[0][0][0] == "art9"
+    # and the messages that were already there can be searched
+    assert conn.execute("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'owner : \"1\" AND article'").fetchall() == [(1,)]
+    # a second run has nothing left to do
+    assert migrate(conn) == MIGRATIONS[-1].version
+    conn.close()
+
+def test_failed_migration_leaves_the_database_as_it_was(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "failed.db"))
+    migrate(conn)
+
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        migrate(conn, migrations=[*MIGRATIONS, Migration(MIGRATIONS[-1].version + 1, "broken", broken)])
+    assert schema_version(conn) == MIGRATIONS[-1].version
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    conn.close()
+
+@pytest.mark.parametrize("query, params", [
+    ("SELECT role, content, tool_call_id, extra, documents, id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?", (1, 20)),
+    ("SELECT role, content, tool_call_id, extra, documents, id FROM messages WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?", (1, 50, 20)),
+    ("SELECT role, content, tool_call_id, extra, documents, id FROM messages WHERE chat_id = ? ORDER BY id ASC LIMIT 1", (1,)),
+    ("SELECT MAX(id) FROM messages WHERE chat_id = ?", (1,)),
+])
+def test_message_queries_use_the_chat_index(fake_configs, query, params):
+    db = DatabaseManager(configs=fake_configs)
+    with db._get_conn() as conn:
+        plan = query_plan(conn, query, params)
+    assert "USING" in plan and "idx_messages_chat" in plan
+    assert "TEMP B-TREE" not in plan
+
+@pytest.mark.parametrize("query, params", [
+    ("SELECT id, slug, updated_at FROM chats WHERE user_id = ? ORDER BY updated_at DESC, id DESC LIMIT ?", (1, 20)),
+    ("SELECT id, slug, updated_at FROM chats WHERE user_id = ? AND (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?", (1, 100, 5, 20)),
+    ("SELECT COUNT(*), MAX(updated_at) FROM chats WHERE user_id = ?", (1,)),
+])
+def test_chat_list_queries_are_covered_by_the_user_index(fake_configs, query, params):
+    db = DatabaseManager(configs=fake_configs)
+    with db._get_conn() as conn:
+        plan = query_plan(conn, query, params)
+    assert "COVERING INDEX idx_chats_user_updated" in plan
+    assert "TEMP B-TREE" not in plan
+
+def test_search_query_uses_the_full_text_index(fake_configs):
+    db = DatabaseManager(configs=fake_configs)
+    with db._get_conn() as conn:
+        plan = query_plan(
+            conn,
+            """
+            SELECT messages_fts.rowid, chats.id
+            FROM messages_fts JOIN chats ON chats.id = messages_fts.chat_id
+            WHERE messages_fts MATCH ? AND (messages_fts.rank, messages_fts.rowid) > (?, ?)
+            ORDER BY messages_fts.rank, messages_fts.rowid LIMIT ?
+            """,
+            ('owner : "1" AND content : ("controller")', -1.5, 7, 20),
+            )
+    assert "VIRTUAL TABLE INDEX" in plan
+    assert "SEARCH chats USING INTEGER PRIMARY KEY" in plan
+
+def test_messages_are_split_into_columns(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "blobs.db"))
+    migrate(conn, migrations=MIGRATIONS[:6])
+    call = {"id": "call_1", "type": "function", "function": {"name": "gdpr_query", "arguments": '{"query": "article 9"}'}}
+    conn.executemany(
+        "INSERT INTO messages (chat_id, message, created_at) VALUES (1, ?, 5)",
+        [
+            (json.dumps({"role": "assistant", "content": None, "tool_calls": [call], "provider_specific_fields": {"x": 1}}),),
+            (json.dumps({"role": "tool", "content": "Article 9", "tool_call_id": "call_1"}),),
+        ]
+    )
+    conn.commit()
+
+    assert migrate(conn) == MIGRATIONS[-1].version
+    assert "message" not in {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    assert conn.execute("SELECT role, content, tool_call_id, extra FROM messages ORDER BY id").fetchall() == [
+        ("assistant", None, None, '{"provider_specific_fields": {"x": 1}}'),
+        ("tool", "Article 9", "call_1", None),
+        ]
+    assert conn.execute("SELECT message_id, position, id, name, arguments FROM tool_calls").fetchall() == [
+        (1, 0, "call_1", "gdpr_query", '{"query": "article 9"}'),
+        ]
+    conn.close()
@@ -1,4 +1,5 @@
-from unittest.mock import MagicMock
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 from rag_app.app.services.rag import RagClient
 import pytest, requests
 from rag_app.app.models import ChromaDbResult, MessageDocuments, Message, RerankResponse, RerankItem
@@ -198,3 +199,30 @@ def test_chroma_query_handle_resp_error(rag_client):
 
     # exception chaining preserved
     assert isinstance(exc.value.__cause__, requests.HTTPError)
+
+def test_get_collection_reuses_client(rag_client):
+    with patch("rag_app.app.services.rag.chromadb.HttpClient") as mock_http_client:
+        first = rag_client._get_collection(name="gdpr")
+        second = rag_client._get_collection(name="gdpr")
+        rag_client._get_collection(name="edpb_guidance")
+
+    assert first is second
+    mock_http_client.assert_called_once()
+    assert mock_http_client.return_value.get_collection.call_count == 2
+
+def test_concurrent_first_queries_share_one_async_client(rag_client):
+    client = MagicMock()
+    client.get_collection = AsyncMock(return_value="collection")
+
+    async def connect(host, port):
+        await asyncio.sleep(0.01)
+        return client
+
+    async def main():
+        return await asyncio.gather(*(rag_client._aget_collection(name="gdpr") for _ in range(3)))
+
+    with patch("rag_app.app.services.rag.chromadb.AsyncHttpClient", side_effect=connect) as mock_http_client:
+        assert asyncio.run(main()) == ["collection"] * 3
+
+    mock_http_client.assert_called_once()
+    client.get_collection.assert_awaited_once()
@@ -0,0 +1,53 @@
+from rag_app.app.models import Message, MessageDocuments
+from tests.services.utils import add_chat, make_db
+
+
+def test_reads_are_cached_until_a_write(fake_configs, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db")
+    db.create_user("peter")
+    cache = db.read_models
+
+    version, users = cache.users()
+    assert [row[1] for row in users] == ["peter"]
+    assert cache.users() == (version, users)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    db.create_user("paul")
+    version, users = cache.users()
+    assert sorted(row[1] for row in users) == ["paul", "peter"]
+    assert cache.misses == 2
+    db.close()
+
+def test_chat_writes_invalidate_the_chat_list(fake_configs, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db")
+    db.create_user("peter")
+    db.create_user("paul")
+    peter, paul = db.read_models.user_id("peter"), db.read_models.user_id("paul")
+    chat_id = add_chat(db, "peter")
+
+    assert [row[0] for row in db.read_models.chats(peter)[1]] == [chat_id]
+    db.read_models.chats(paul)
+    misses = db.read_models.misses
+
+    # paul's list is left alone by a write to peter's chat
+    db.add_slug(chat_id=chat_id, slug="controllers")
+    assert db.read_models.chats(peter)[1][0][1] == "controllers"
+    db.read_models.chats(paul)
+    assert db.read_models.misses == misses + 1
+
+    db.save_turn(chat_id=chat_id, msg_docs=[MessageDocuments(message=Message(role="user", content="what is a controller?"))], slug="renamed")
+    assert db.read_models.chats(peter)[1][0][1] == "renamed"
+    db.close()
+
+def test_writes_by_another_worker_are_seen(fake_configs, tmp_path):
+    path = tmp_path / "rag_app.db"
+    first, second = make_db(fake_configs, path), make_db(fake_configs, path)
+    first.create_user("peter")
+    user_id = second.read_models.user_id("peter")
+    assert second.read_models.chats(user_id)[1] == []
+
+    chat_id = add_chat(first, "peter")
+    assert [row[0] for row in second.read_models.chats(user_id)[1]] == [chat_id]
+    first.create_user("paul")
+    assert sorted(row[1] for row in second.read_models.users()[1]) == ["paul", "peter"]
+    first.close()
@@ -0,0 +1,98 @@
+import json, time
+import pytest
+from rag_app.app.models import Message, MessageDocuments
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.retention import MaintenanceThread
+from tests.services.utils import add_chat
+
+
+@pytest.fixture
+def db(fake_configs, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    fake_configs.yaml_values.archive_path = str(tmp_path / "archive.db")
+    db = DatabaseManager(configs=fake_configs)
+    db.create_user("peter")
+    db.create_user("paul")
+    yield db
+    db.close()
+
+def add_summarized_chat(db, fake_messages, content="what is a controller?", updated_at=None) -> int:
+    chat_id = add_chat(db, "peter", turn=[
+        MessageDocuments(message=Message(role="user", content=content), documents=fake_messages.documents),
+        MessageDocuments(message=Message(role="assistant", content="an answer " * 500)),
+        ], updated_at=updated_at)
+    db.upsert_summary(chat_id=chat_id, up_to_message_id=1, summary="a summary")
+    return chat_id
+
+def test_idle_chats_are_archived_and_restored_as_they_were(db, fake_messages):
+    old = add_summarized_chat(db, fake_messages, updated_at=int(time.time()) - 40 * 86400)
+    recent = add_summarized_chat(db, fake_messages, content="when is a DPIA required?")
+    before = Chat.blobs_to_msg_docs(db.get_messages(chat_id=old), db=db)
+
+    stats = db.archive_idle_chats(idle_seconds=30 * 86400)
+    assert stats["archived_chats"] == 1 and stats["archived_messages"] == 3 and stats["archive_bytes"] > 0
+    assert db.get_chat(chat_id=old) is None and db.get_messages(chat_id=old) is None
+    assert db.get_summary(chat_id=old) is None
+    assert db.search_messages(user_id=db.check_user("peter"), text="controller") == []
+    assert db.get_chat(chat_id=recent) is not None
+    assert [row[0] for row in db.get_archived_chats(user_id=db.check_user("peter"))] == [old]
+    # archiving again finds nothing left to do
+    assert db.archive_idle_chats(idle_seconds=30 * 86400)["archived_chats"] == 0
+
+    # only its owner can have it back
+    assert not db.restore_chat(chat_id=old, user_id=db.check_user("paul"))
+    assert db.restore_chat(chat_id=old, user_id=db.check_user("peter"))
+    assert Chat.blobs_to_msg_docs(db.get_messages(chat_id=old), db=db) == before
+    assert db.get_summary(chat_id=old) == (1, "a summary")
+    assert {row[1] for row in db.search_messages(user_id=db.check_user("peter"), text="controller")} == {old}
+    assert db.get_archived_chats(user_id=db.check_user("peter")) == []
+    # a restored chat counts as just used
+    assert db.archive_idle_chats(idle_seconds=30 * 86400)["archived_chats"] == 0
+
+def test_incremental_vacuum_gives_the_space_back(db, fake_messages):
+    assert db.space_stats()["incremental_vacuum"] == 1
+    for _ in range(20):
+        add_summarized_chat(db, fake_messages, updated_at=1)
+    db.archive_idle_chats(idle_seconds=86400)
+    before = db.space_stats()
+    assert before["free_bytes"] > 0
+
+    stats = db.incremental_vacuum(step_pages=2)
+    after = db.space_stats()
+    assert stats["freed_bytes"] == before["free_bytes"]
+    assert after["free_bytes"] == 0
+    assert after["size_bytes"] == before["size_bytes"] - stats["freed_bytes"]
+
+def test_older_databases_can_turn_incremental_vacuum_on(fake_configs, tmp_path):
+    import sqlite3
+    path = tmp_path / "old.db"
+    sqlite3.connect(path).execute("CREATE TABLE users (id INTEGER PRIMARY KEY, user_name TEXT UNIQUE, created_at INTEGER)")
+    fake_configs.yaml_values.sqlite_path = str(path)
+    db = DatabaseManager(configs=fake_configs)
+    assert db.space_stats()["incremental_vacuum"] == 0
+    assert db.incremental_vacuum() == {"freed_pages": 0, "freed_bytes": 0}
+    db.enable_incremental_vacuum()
+    assert db.space_stats()["incremental_vacuum"] == 1
+    db.close()
+
+def test_maintenance_runs_in_one_worker_at_a_time(db, fake_configs, fake_messages):
+    other_db = DatabaseManager(configs=fake_configs)
+    first, second = (
+        MaintenanceThread(db=workers_db, interval=60, idle_seconds=30 * 86400, vacuum_step_pages=2, logger=fake_configs.logger)
+        for workers_db in (db, other_db)
+        )
+    add_summarized_chat(db, fake_messages, updated_at=1)
+
+    assert first.run_once()["archived_chats"] == 1
+    assert second.run_once() is None
+    # the holder renews its lease
+    assert first.run_once()["archived_chats"] == 0
+
+    # the lease of a worker that stopped is free at once, and one that died runs out
+    first.stop()
+    assert second.run_once() is not None
+    assert not db.take_lease(MaintenanceThread.LEASE, holder="third", seconds=60)
+    other_db.take_lease(MaintenanceThread.LEASE, holder=second.holder, seconds=-1)
+    assert db.take_lease(MaintenanceThread.LEASE, holder="third", seconds=60)
+    other_db.close()
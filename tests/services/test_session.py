@@ -1,10 +1,13 @@
-import logging, uuid
+import logging, uuid, asyncio, json, threading
+from unittest.mock import AsyncMock, MagicMock
 from logging import Logger
 from rag_app.app.services.session import Session
 from rag_app.app.services.llm_client import LlmClient
 from rag_app.app.services.db_manager import DatabaseManager
 from rag_app.app.services.tool_handler import ToolHandler
-from rag_app.app.models import Tool, FunctionDefinition
+from rag_app.app.services.container import Services
+from rag_app.app.models import Tool, FunctionDefinition, ToolCall, FunctionCall, Message, MessageDocuments, ChromaDbResult
+from litellm.types.utils import ModelResponseStream, StreamingChoices, Delta
 from tests.services.utils import build_db
 
 # checks the init to make sure chat and user are None and everything else loads as expected.
@@ -18,6 +21,15 @@ def test_init_session(fake_configs):
     assert isinstance(session.llm_client, LlmClient)
     assert isinstance(session.tool_client, ToolHandler)
 
+def test_sessions_share_services(fake_configs):
+    services = Services.build(configs=fake_configs)
+    first = Session(configs=fake_configs, services=services)
+    second = Session(configs=fake_configs, services=services)
+    assert first.id != second.id
+    assert first.db is second.db is services.db
+    assert first.llm_client is second.llm_client
+    assert first.tool_client is second.tool_client
+
 def test__get_tools_success(fake_configs):
     fake_tool_chain = {
         "fake_tool": Tool(
@@ -69,3 +81,168 @@ def test_load_user_success(fake_configs, fake_messages):
 # need to add handling for this. right now, the route doesn't handle it at all.
 def test_load_user_failure(fake_configs, fake_messages):
     pass
+
+def test_aprocess_prompt_with_tool_call(fake_configs, fake_messages):
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+
+    tool_call = ToolCall(id="call_1", type="function", function=FunctionCall(name="gdpr_query", arguments="{}"))
+    responses = {
+        "first": Message(role="assistant", tool_calls=[tool_call]),
+        "second": Message(role="assistant", content="final answer"),
+        }
+    session.llm_client.asend_request = AsyncMock(side_effect=["first", "second"])
+    session.llm_client.get_messsage = MagicMock(side_effect=lambda response: responses[response])
+    documents = [ChromaDbResult(id="doc", document="text", metadata={})]
+    session.tool_client.ahandle = AsyncMock(return_value=[
+        MessageDocuments(message=Message(role="tool", tool_call_id="call_1", content="[]"), documents=documents)
+        ])
+
+    result = asyncio.run(session.aprocess_prompt(prompt="what is article 9?", tool_names=["gdpr_query"]))
+
+    assert result.message.content == "final answer"
+    assert result.documents == documents
+    assert [m.message.role for m in session.chat.messages] == ["system", "user", "assistant", "tool", "assistant"]
+    stored = session.db.get_messages(chat_id=session.chat.id)
+    assert len(stored) == 5
+
+def test_a_turn_is_written_in_one_transaction(fake_configs, fake_messages):
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+    session.llm_client.asend_request = AsyncMock(return_value="answer")
+    session.llm_client.get_messsage = MagicMock(return_value=Message(role="assistant", content="the answer"))
+    create_chat = MagicMock(wraps=session.db.create_chat)
+    session.db.create_chat = create_chat
+    insert_message = MagicMock(wraps=session.db.insert_message)
+    session.db.insert_message = insert_message
+    save_turn = MagicMock(wraps=session.db.save_turn)
+    session.db.save_turn = save_turn
+
+    result = asyncio.run(session.aprocess_prompt(prompt="hello"))
+
+    # the system prompt is stored with the new chat; everything else in one go at the end
+    create_chat.assert_called_once()
+    insert_message.assert_not_called()
+    save_turn.assert_called_once()
+    assert save_turn.call_args.kwargs["slug"] == "hello..."
+    # the ids are set once the turn is stored
+    assert [m.id for m in session.chat.messages[1:]] == [row[2] for row in session.db.get_messages(chat_id=session.chat.id)[1:]]
+    assert result.id == session.chat.messages[-1].id
+
+def test_write_behind_flushes_on_close(fake_configs, fake_messages, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    fake_configs.yaml_values.sqlite_write_behind = True
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+    session.llm_client.asend_request = AsyncMock(return_value="answer")
+    session.llm_client.get_messsage = MagicMock(return_value=Message(role="assistant", content="the answer"))
+
+    asyncio.run(session.aprocess_prompt(prompt="hello"))
+    chat_id = session.chat.id
+    session.db.close()
+
+    fake_configs.yaml_values.sqlite_write_behind = False
+    stored = DatabaseManager(configs=fake_configs).get_messages(chat_id=chat_id)
+    assert [row[0]["content"] for row in stored[1:]] == ["hello", "the answer"]
+
+def _chunk(content=None, tool_calls=None):
+    return ModelResponseStream(choices=[StreamingChoices(delta=Delta(content=content, tool_calls=tool_calls))])
+
+def _stream(*chunks):
+    async def stream(messages, tools=None):
+        for chunk in chunks:
+            yield chunk
+    return stream
+
+def test_aprocess_prompt_streaming_with_tool_call(fake_configs, fake_messages):
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+
+    # the tool call arrives in pieces, with its id and name only in the first one
+    first_call = _stream(
+        _chunk(tool_calls=[{"id": "call_1", "index": 0, "type": "function", "function": {"name": "gdpr_query", "arguments": '{"query"'}}]),
+        _chunk(tool_calls=[{"index": 0, "function": {"arguments": ': "art 9"}'}}]),
+        )
+    second_call = _stream(_chunk(content="final "), _chunk(content="answer"))
+    streams = iter([first_call, second_call])
+    session.llm_client.asend_request_stream = lambda messages, tools=None: next(streams)(messages, tools)
+    documents = [ChromaDbResult(id="doc", document="text", metadata={})]
+    session.tool_client.ahandle = AsyncMock(return_value=[
+        MessageDocuments(message=Message(role="tool", tool_call_id="call_1", content="[]"), documents=documents)
+        ])
+
+    async def main():
+        return [event async for event in session.aprocess_prompt_streaming(prompt="what is article 9?", tool_names=["gdpr_query"])]
+
+    events = asyncio.run(main())
+
+    assert [event.type for event in events] == ["tool_call", "retrieval", "retrieval", "token", "token", "done"]
+    assert events[0].content == 'gdpr_query({"query": "art 9"})'
+    sent = session.tool_client.ahandle.call_args.args[0]
+    assert sent.tool_calls[0].id == "call_1"
+    assert session.last_message().message.content == "final answer"
+    assert session.last_message().documents == documents
+    assert [m.message.role for m in session.chat.messages] == ["system", "user", "assistant", "tool", "assistant"]
+
+def test_aprocess_prompt_streaming_waits_for_write_behind_ids_before_done(fake_configs, fake_messages, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    fake_configs.yaml_values.sqlite_write_behind = True
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+    session.llm_client.asend_request_stream = _stream(_chunk(content="the "), _chunk(content="answer"))
+    # an earlier write holds up the queue for a moment
+    release = threading.Event()
+    session.db._write_behind.submit(release.wait)
+    threading.Timer(0.1, release.set).start()
+
+    async def main():
+        async for event in session.aprocess_prompt_streaming(prompt="hello"):
+            if event.type == "done":
+                return session.last_message().id
+
+    message_id = asyncio.run(main())
+    fake_configs.yaml_values.sqlite_write_behind = False
+    assert message_id is not None
+    assert session.db.get_message(chat_id=session.chat.id, message_id=message_id)[0]["content"] == "the answer"
+    session.db.close()
+
+def test_aprocess_prompt_waits_for_write_behind_ids(fake_configs, fake_messages, tmp_path):
+    fake_configs.yaml_values.sqlite_path = str(tmp_path / "rag_app.db")
+    fake_configs.yaml_values.sqlite_write_behind = True
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+    session.llm_client.asend_request = AsyncMock(return_value="answer")
+    session.llm_client.get_messsage = MagicMock(return_value=Message(role="assistant", content="the answer"))
+    # an earlier write holds up the queue for a moment
+    release = threading.Event()
+    session.db._write_behind.submit(release.wait)
+    threading.Timer(0.1, release.set).start()
+
+    result = asyncio.run(session.aprocess_prompt(prompt="hello"))
+    fake_configs.yaml_values.sqlite_write_behind = False
+    assert result.id is not None
+    assert session.db.get_message(chat_id=session.chat.id, message_id=result.id)[0]["content"] == "the answer"
+    session.db.close()
+
+def test_aprocess_prompt_streaming_saves_partial_answer_when_closed_early(fake_configs, fake_messages):
+    session = Session(configs=fake_configs)
+    build_db(fake_db=session.db, fake_messages=fake_messages)
+    session.load_user(user_name="peter")
+    session.llm_client.asend_request_stream = _stream(_chunk(content="partial "), _chunk(content="answer"))
+
+    async def main():
+        events = session.aprocess_prompt_streaming(prompt="hello")
+        first = await anext(events)
+        await events.aclose()
+        return first
+
+    assert asyncio.run(main()).content == "partial "
+    assert session.last_message().message.content == "partial "
+    stored = session.db.get_messages(chat_id=session.chat.id)
+    assert len(stored) == 3
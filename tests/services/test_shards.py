@@ -0,0 +1,78 @@
+import sqlite3
+import pytest
+from rag_app.app.core.errors import ConfigurationsError
+from rag_app.app.models import Message, MessageDocuments
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.shards import shard_path
+from rag_app.app.services.transfer import export_lines, import_lines
+from tests.services.utils import add_chat, make_db, qa_turn
+
+
+def test_shard_path():
+    assert shard_path("data/rag.db", 0) == "data/rag.db"
+    assert shard_path("data/rag.db", 2) == "data/rag.db.shard2"
+    assert shard_path("file:memdb?mode=memory&cache=shared", 1) == "file:memdb.shard1?mode=memory&cache=shared"
+
+def test_chats_live_in_their_users_shard(fake_configs, fake_messages, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db", shards=3)
+    chats = {name: add_chat(db, name, turn=qa_turn(f"question from {name}", fake_messages.documents)) for name in ("peter", "paul", "mary")}
+
+    for name, chat_id in chats.items():
+        user_id = db.check_user(name)
+        assert db.shard_of(chat_id) == db.shard_of(user_id)
+        rows = db.get_messages(chat_id=chat_id)
+        assert all(db.shard_of(message_id) == db.shard_of(user_id) for _, _, message_id in rows)
+        loaded = Chat.blobs_to_msg_docs(rows, db=db)
+        assert loaded[2].documents == fake_messages.documents
+        assert [row[0] for row in db.read_models.chats(user_id)[1]] == [chat_id]
+        assert {hit[1] for hit in db.search_messages(user_id=user_id, text=name)} == {chat_id}
+    assert (tmp_path / "rag_app.db.shard2").exists()
+
+    rendered = {message_id: f"<p>{message_id}</p>" for chat_id in chats.values() for _, _, message_id in db.get_messages(chat_id=chat_id)}
+    db.save_rendered(rendered=rendered, version="v1")
+    assert db.get_rendered(message_ids=list(rendered), version="v1") == rendered
+    db.close()
+
+def test_writes_to_other_shards_dont_wait(fake_configs, fake_messages, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db", shards=2)
+    first = add_chat(db, "peter", turn=qa_turn("what is a controller?", fake_messages.documents))
+    second = add_chat(db, "paul", turn=qa_turn("when is a DPIA required?", fake_messages.documents))
+    assert db.shard_of(first) != db.shard_of(second)
+
+    # another writer holds the lock of peter's shard
+    blocker = sqlite3.connect(shard_path(str(tmp_path / "rag_app.db"), db.shard_of(first)))
+    blocker.execute("BEGIN IMMEDIATE")
+    db.save_turn(chat_id=second, msg_docs=[MessageDocuments(message=Message(role="user", content="and a processor?"))])
+    blocker.rollback()
+    blocker.close()
+    assert len(db.get_messages(chat_id=second)) == 5
+    db.close()
+
+def test_the_number_of_shards_is_fixed(fake_configs, fake_messages, tmp_path):
+    db = make_db(fake_configs, tmp_path / "sharded.db", shards=2)
+    db.close()
+    with pytest.raises(ConfigurationsError):
+        make_db(fake_configs, tmp_path / "sharded.db", shards=3)
+
+    db = make_db(fake_configs, tmp_path / "plain.db")
+    add_chat(db, "peter", turn=qa_turn("what is a controller?", fake_messages.documents))
+    db.close()
+    with pytest.raises(ConfigurationsError):
+        make_db(fake_configs, tmp_path / "plain.db", shards=2)
+
+def test_import_into_shards(fake_configs, fake_messages, tmp_path):
+    source = make_db(fake_configs, tmp_path / "plain.db")
+    for name in ("peter", "paul", "mary"):
+        add_chat(source, name, turn=qa_turn(f"question from {name}", fake_messages.documents))
+    # small batches, so documents written once in the export reach shards in later batches
+    lines = list(export_lines(source))
+    source.close()
+
+    target = make_db(fake_configs, tmp_path / "sharded.db", shards=3)
+    import_lines(target, lines, batch_size=3)
+    for name in ("peter", "paul", "mary"):
+        [(chat_id, slug, _)] = target.get_chats(user_id=target.check_user(name))
+        loaded = Chat.blobs_to_msg_docs(target.get_messages(chat_id=chat_id), db=target)
+        assert slug == f"question from {name}"
+        assert loaded[2].documents == fake_messages.documents
+    target.close()
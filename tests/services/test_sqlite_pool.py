@@ -0,0 +1,66 @@
+import threading
+import pytest
+from rag_app.app.services.sqlite_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(path=str(tmp_path / "pool.db"), size=4, busy_timeout_ms=2000)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)")
+    yield pool
+    pool.close()
+
+def test_connections_are_tuned(pool):
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1   # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 2000
+
+def test_nested_use_shares_the_connection_and_transaction(pool):
+    with pool.connection() as outer:
+        outer.execute("INSERT INTO items (value) VALUES (1)")
+        with pool.connection() as inner:
+            assert inner is outer
+            assert inner.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+        assert outer.in_transaction
+
+def test_failed_block_rolls_back_and_returns_the_connection(pool):
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items (value) VALUES (1)")
+            raise ValueError
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+def test_readers_and_a_writer_run_concurrently(pool):
+    errors = []
+
+    def write():
+        try:
+            for i in range(200):
+                with pool.connection() as conn:
+                    conn.execute("INSERT INTO items (value) VALUES (?)", (i,))
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            for _ in range(200):
+                with pool.connection() as conn:
+                    conn.execute("SELECT COUNT(*), MAX(value) FROM items").fetchone()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write), threading.Thread(target=write)]
+    threads += [threading.Thread(target=read) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 400
+    # never more connections than the pool's size
+    assert pool._idle.qsize() <= 4
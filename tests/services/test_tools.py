@@ -1,7 +1,9 @@
 from rag_app.app.tools.registry import TOOLS
-import pytest, logging,json
+import pytest, logging, json, asyncio
+from prometheus_client import REGISTRY
 from unittest.mock import patch, MagicMock
 from rag_app.app.core.config import Configurations
+from rag_app.app.core.errors import RagClientFailedError
 from rag_app.app.services.chat import Chat
 from rag_app.app.services.user import User
 from rag_app.app.services.embeddings import EmbeddingsClient
@@ -81,4 +83,47 @@ def test_tools_client_handle_nonexistent_tool(tools_client):
     fake_message = Message(role="user", content="test content", tool_calls=[fake_tool_call])
     messages = tools_client.handle(fake_message)
     msg_docs = messages[0]
-    assert msg_docs.message.content == "There is no tool with that name."
\ No newline at end of file
+    assert msg_docs.message.content == "There is no tool with that name."
+    # names the model makes up don't become metric labels
+    assert REGISTRY.get_sample_value("rag_app_tool_calls_total", {"tool": "nonexistent_tool"}) is None
+    assert REGISTRY.get_sample_value("rag_app_tool_calls_total", {"tool": "unknown"}) >= 1
+def test_tools_client_ahandle_runs_calls_concurrently(tools_client):
+    started = []
+
+    async def fake_achroma_query(arguments, tool_call_id, collection):
+        started.append(tool_call_id)
+        await asyncio.sleep(0.01)
+        # both calls have started before either finishes
+        assert len(started) == 2
+        return MessageDocuments(message=Message(role="tool", tool_call_id=tool_call_id, content=arguments["query_text"]))
+
+    tools_client.rag.achroma_query = fake_achroma_query
+    tool_calls = [
+        ToolCall(id=call_id, type="function", function=FunctionCall(name="gdpr_query", arguments=json.dumps({"query_text": call_id})))
+        for call_id in ("first", "second")
+        ]
+    message = Message(role="assistant", tool_calls=tool_calls)
+
+    responses = asyncio.run(tools_client.ahandle(message))
+    assert [r.message.tool_call_id for r in responses] == ["first", "second"]
+    assert [r.message.content for r in responses] == ["first", "second"]
+
+def test_tools_client_sync_and_async_calls_share_a_route(tools_client):
+    calls = []
+
+    def fake_chroma_query(arguments, tool_call_id, collection):
+        calls.append(("sync", collection, arguments))
+        raise RagClientFailedError("chroma is down")
+
+    async def fake_achroma_query(arguments, tool_call_id, collection):
+        calls.append(("async", collection, arguments))
+        return MessageDocuments(message=Message(role="tool", tool_call_id=tool_call_id, content="ok"))
+
+    tools_client.rag.chroma_query = fake_chroma_query
+    tools_client.rag.achroma_query = fake_achroma_query
+    tool_call = ToolCall(id="1234", type="function", function=FunctionCall(name="gdpr_query", arguments=json.dumps({"query_text": "controllers"})))
+    message = Message(role="assistant", tool_calls=[tool_call])
+
+    assert tools_client.handle(message)[0].message.content == "chroma is down"
+    assert asyncio.run(tools_client.ahandle(message))[0].message.content == "ok"
+    assert calls == [("sync", "gdpr", {"query_text": "controllers"}), ("async", "gdpr", {"query_text": "controllers"})]
@@ -0,0 +1,65 @@
+import json
+from rag_app.app.models import MessageDocuments
+from rag_app.app.services.chat import Chat
+from rag_app.app.services.transfer import export_lines, import_lines
+from tests.services.utils import add_chat, make_db, qa_turn
+
+
+# long enough to be stored compressed, so the export has to decompress it
+TOOL_TEXT = "article text " * 300
+
+def load(db, chat_id) -> list[MessageDocuments]:
+    return Chat.blobs_to_msg_docs(db.get_messages(chat_id=chat_id), db=db)
+
+def test_export_and_import_round_trip(fake_configs, fake_messages, tmp_path):
+    source = make_db(fake_configs, tmp_path / "source.db")
+    first = add_chat(source, "peter", turn=qa_turn("what is a controller?", fake_messages.documents, tool_content=TOOL_TEXT))
+    second = add_chat(source, "paul", turn=qa_turn("when is a DPIA required?", fake_messages.documents, tool_content=TOOL_TEXT))
+    lines = list(export_lines(db=source))
+
+    kinds = [json.loads(line)["type"] for line in lines]
+    # each chat before its messages, and each document only once
+    assert kinds == ["chat", "message", "message", "document", "document", "message", "message", "chat", "message", "message", "message", "message"]
+
+    target = make_db(fake_configs, tmp_path / "target.db")
+    target.create_user("paul")
+    add_chat(target, "mary", turn=qa_turn("an existing chat", fake_messages.documents, tool_content=TOOL_TEXT))
+    counts = import_lines(db=target, lines=lines, batch_size=3)
+    assert counts == {"chats": 2, "documents": 2, "messages": 8}
+
+    imported = {slug: chat_id for chat_id, slug, _ in target.get_chats(user_id=target.check_user("peter"))}
+    imported |= {slug: chat_id for chat_id, slug, _ in target.get_chats(user_id=target.check_user("paul"))}
+    for chat_id, slug in ((first, "what is a controller?"), (second, "when is a DPIA required?")):
+        strip = lambda messages: [(m.message, m.documents) for m in messages]
+        assert strip(load(target, imported[slug])) == strip(load(source, chat_id))
+    hits = target.search_messages(user_id=target.check_user("paul"), text="DPIA")
+    assert {hit[1] for hit in hits} == {imported["when is a DPIA required?"]}
+    source.close()
+    target.close()
+
+def test_export_filters_by_user_and_date(fake_configs, fake_messages, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db")
+    add_chat(db, "peter", turn=qa_turn("old question", fake_messages.documents, tool_content=TOOL_TEXT), created_at=1_000)
+    add_chat(db, "peter", turn=qa_turn("new question", fake_messages.documents, tool_content=TOOL_TEXT), created_at=2_000)
+    add_chat(db, "paul", turn=qa_turn("pauls question", fake_messages.documents, tool_content=TOOL_TEXT), created_at=2_000)
+
+    def slugs(**filters):
+        return [item["slug"] for item in map(json.loads, export_lines(db=db, **filters)) if item["type"] == "chat"]
+
+    assert slugs() == ["old question", "new question", "pauls question"]
+    assert slugs(user_name="peter") == ["old question", "new question"]
+    assert slugs(user_name="peter", since=1_500) == ["new question"]
+    assert slugs(until=1_500) == ["old question"]
+    db.close()
+
+def test_export_reads_in_batches(fake_configs, fake_messages, tmp_path):
+    db = make_db(fake_configs, tmp_path / "rag_app.db")
+    for n in range(3):
+        add_chat(db, "peter", turn=qa_turn(f"question {n}", fake_messages.documents, tool_content=TOOL_TEXT))
+    rows = db.iter_export_rows(batch_size=2)
+    chat, message = next(rows)
+    assert chat[1] == "peter" and message[1]["role"] == "system"
+    # stopping early closes the export's connection
+    rows.close()
+    assert len(list(db.iter_export_rows(batch_size=2))) == 12
+    db.close()
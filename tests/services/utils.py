@@ -1,5 +1,8 @@
 import time, json
+from rag_app.app.core.config import Configurations
+from rag_app.app.models import ChromaDbResult, Message, MessageDocuments
 from rag_app.app.services.db_manager import DatabaseManager
+from rag_app.app.services.message_store import write_messages
 
 
 # A helper function to add fake values to an in-memory SQLite database via 
@@ -30,14 +33,55 @@ def build_db(fake_db: DatabaseManager, fake_messages):
                 )
             chat_id = cursor.lastrowid
 
-            msg_blob = fake_messages.message.model_dump_json()
             docs_blob = json.dumps([d.model_dump() for d in fake_messages.documents])
             
-            cursor.execute(
-                """
-                INSERT INTO messages (chat_id, message, documents, created_at)
-                VALUES (?, ?, ?, ?)
-                """,
-                (chat_id, msg_blob, docs_blob, ts)
-                )
-            return
\ No newline at end of file
+            write_messages(cursor, [(None, chat_id, fake_messages.message.model_dump(), docs_blob, ts)])
+            return
+
+
+def make_db(fake_configs, path=None, shards: int = 1) -> DatabaseManager:
+    """
+    a DatabaseManager with configs of its own, since the database is found through them: the
+    file at path, or fake_configs' in-memory database, split into shards
+    """
+    update = {"sqlite_shards": shards}
+    if path is not None:
+        update["sqlite_path"] = str(path)
+    configs = Configurations(fake_configs.logger, fake_configs.yaml_values.model_copy(update=update))
+    return DatabaseManager(configs=configs)
+
+def qa_turn(prompt: str, documents: list[ChromaDbResult] | None = None, tool_content: str = "article text") -> list[MessageDocuments]:
+    """
+    a turn with a tool call: the prompt, the tool's answer with its documents, and the reply
+    """
+    return [
+        MessageDocuments(message=Message(role="user", content=prompt)),
+        MessageDocuments(message=Message(role="tool", content=tool_content, tool_call_id="call_1"), documents=documents),
+        MessageDocuments(message=Message(role="assistant", content=f"answer to {prompt}")),
+        ]
+
+def add_chat(
+        db: DatabaseManager,
+        user_name: str = "test_user",
+        turn: list[MessageDocuments] | None = None,
+        slug: str | None = None,
+        created_at: int | None = None,
+        updated_at: int | None = None,
+        ) -> int:
+    """
+    adds a chat with a system prompt and then the turn, if given, for the user, who is created
+    if need be. the slug is the turn's prompt unless given. created_at backdates its messages
+    and updated_at the chat.
+    """
+    if db.check_user(user_name) is None:
+        db.create_user(user_name)
+    system = MessageDocuments(message=Message(role="system", content="system prompt"))
+    chat_id = db.create_chat(user_id=db.check_user(user_name), init_message=system)
+    if turn:
+        db.save_turn(chat_id=chat_id, msg_docs=turn, slug=slug or turn[0].message.content)
+    with db._get_conn(db.shard_of(chat_id)) as conn:
+        if created_at is not None:
+            conn.execute("UPDATE messages SET created_at = ? WHERE chat_id = ?", (created_at, chat_id))
+        if updated_at is not None:
+            conn.execute("UPDATE chats SET updated_at = ? WHERE id = ?", (updated_at, chat_id))
+    return chat_id